@@ -1,6 +1,17 @@
 from django.contrib import admin
 
-from filesharing.models import FileModel, FilePermissionModel
+from filesharing.models import (
+    ContentBlobModel,
+    FileModel,
+    FilePermissionModel,
+    StorageUsageModel,
+    UploadPartModel,
+    UploadSessionModel,
+)
 
+admin.site.register(ContentBlobModel)
 admin.site.register(FileModel)
 admin.site.register(FilePermissionModel)
+admin.site.register(UploadSessionModel)
+admin.site.register(UploadPartModel)
+admin.site.register(StorageUsageModel)
@@ -0,0 +1,189 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class FileListingCache:
+    """
+    Cache of file listing responses, keyed by user, listing version and URL.
+
+    Every user has a listing version in the cache. Entries are stored under
+    the version current when they were built, and anything that changes a
+    user's listing bumps the version once its transaction commits, so stale
+    entries are never read again and simply expire. A missing version is
+    recreated from the clock rather than from 1, so it cannot collide with a
+    version used before it was evicted.
+
+    Versions expire after FILE_LISTING_CACHE_TIMEOUT like the entries. With
+    a cache that is not shared between processes, an invalidation only
+    reaches the process that made it, and the expiry bounds how long the
+    others keep answering with the old listing and ETag.
+    """
+
+    version_key = "files:listing-version:{user_id}"
+    entry_key = "files:listing:{user_id}:{version}:{url_hash}"
+    hits_key = "files:listing-cache:hits"
+    misses_key = "files:listing-cache:misses"
+
+    def get_version(self, user_id) -> int:
+        """Get the current listing version of a user."""
+        key = self.version_key.format(user_id=user_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, time.time_ns(), timeout=settings.FILE_LISTING_CACHE_TIMEOUT)
+            version = cache.get(key)
+        return version
+
+    def get_key(self, user_id, url) -> str:
+        """Get the cache key of a user's listing at url."""
+        return self.entry_key.format(
+            user_id=user_id,
+            version=self.get_version(user_id),
+            url_hash=hashlib.sha256(url.encode()).hexdigest(),
+        )
+
+    def get_etag(self, user_id, url) -> str:
+        """
+        Get the ETag of a user's listing at url. It changes with the listing
+        version, so it can be checked without building the listing.
+        """
+        version = self.get_version(user_id)
+        return hashlib.sha256(f"{user_id}:{version}:{url}".encode()).hexdigest()
+
+    def get(self, key):
+        """Get a cached listing, or None, counting hits and misses."""
+        data = cache.get(key)
+        self._count(self.misses_key if data is None else self.hits_key)
+        return data
+
+    def set(self, key, data) -> None:
+        cache.set(key, data, timeout=settings.FILE_LISTING_CACHE_TIMEOUT)
+
+    def invalidate(self, user_ids) -> None:
+        """Bump the listing version of users once the transaction commits."""
+        user_ids = list(user_ids)
+        if user_ids:
+            transaction.on_commit(lambda: self._bump(user_ids))
+
+    def get_stats(self) -> dict:
+        """Get the hit and miss counts of the cache."""
+        hits = cache.get(self.hits_key, 0)
+        misses = cache.get(self.misses_key, 0)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+    def _bump(self, user_ids) -> None:
+        for user_id in user_ids:
+            key = self.version_key.format(user_id=user_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted; a fresh version from the clock replaces it.
+                cache.add(
+                    key, time.time_ns(), timeout=settings.FILE_LISTING_CACHE_TIMEOUT
+                )
+
+    def _count(self, key) -> None:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+
+
+class DownloadUrlCache:
+    """
+    Cache of presigned download URLs, keyed by file, user and version.
+
+    A URL is kept until S3_DOWNLOAD_URL_MIN_REMAINING seconds before it
+    expires, so one that is handed out always has that long left. Every
+    file and user pair has a version in the cache, which is deleted once a
+    transaction revoking the user's access to the file, or deleting the
+    file, commits; it is then recreated from the clock. Keys are taken
+    before access is checked, so a URL presigned while access is revoked is
+    stored under the old version and never read.
+    """
+
+    version_key = "files:download-url-version:{file_id}:{user_id}"
+    entry_key = "files:download-url:{file_id}:{user_id}:{version}"
+
+    def get_key(self, file_id, user_id) -> str:
+        """
+        Get the cache key of a user's URL for a file. Raises ValueError
+        when file_id is not a valid file id.
+        """
+        file_id = uuid.UUID(str(file_id))
+        return self.get_keys([file_id], user_id)[file_id]
+
+    def get_keys(self, file_ids, user_id) -> dict:
+        """Get the cache keys of a user's URLs for files, by file id."""
+        # File ids from URLs may be spelled differently from the stored ones.
+        file_ids = [uuid.UUID(str(file_id)) for file_id in file_ids]
+        version_keys = {
+            file_id: self.version_key.format(file_id=file_id, user_id=user_id)
+            for file_id in file_ids
+        }
+        versions = cache.get_many(version_keys.values())
+        keys = {}
+        for file_id, version_key in version_keys.items():
+            version = versions.get(version_key)
+            if version is None:
+                cache.add(
+                    version_key,
+                    time.time_ns(),
+                    timeout=settings.S3_DOWNLOAD_URL_EXPIRES,
+                )
+                version = cache.get(version_key)
+            keys[file_id] = self.entry_key.format(
+                file_id=file_id, user_id=user_id, version=version
+            )
+        return keys
+
+    def get(self, key):
+        """Get a cached download URL, or None."""
+        return cache.get(key)
+
+    def set(self, key, url) -> None:
+        cache.set(
+            key,
+            url,
+            timeout=settings.S3_DOWNLOAD_URL_EXPIRES
+            - settings.S3_DOWNLOAD_URL_MIN_REMAINING,
+        )
+
+    def get_many(self, keys) -> dict:
+        """Get the cached URLs under keys, given by file id, by file id."""
+        file_ids = {key: file_id for file_id, key in keys.items()}
+        return {file_ids[key]: url for key, url in cache.get_many(file_ids).items()}
+
+    def set_many(self, urls, keys) -> None:
+        """Cache URLs given by file id under keys, given by file id."""
+        cache.set_many(
+            {keys[file_id]: url for file_id, url in urls.items()},
+            timeout=settings.S3_DOWNLOAD_URL_EXPIRES
+            - settings.S3_DOWNLOAD_URL_MIN_REMAINING,
+        )
+
+    def invalidate(self, file_id, user_ids) -> None:
+        """Drop the URLs of a file for users once the transaction commits."""
+        self.invalidate_many({file_id: user_ids})
+
+    def invalidate_many(self, user_ids_by_file) -> None:
+        """
+        Bulk version of invalidate for a dict of user ids by file id, with
+        one delete once the transaction commits.
+        """
+        keys = [
+            self.version_key.format(file_id=uuid.UUID(str(file_id)), user_id=user_id)
+            for file_id, user_ids in user_ids_by_file.items()
+            for user_id in user_ids
+        ]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,296 @@
+import functools
+import itertools
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .objectcache import ObjectDiskCache
+from .storage import FileRange, LocalObjectStorage, get_object_storage
+from .utils import iterate_in_thread
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Download modes in which clients fetch files from /files/download/<id>/content/.
+APP_DOWNLOAD_MODES = ("proxy", "accel")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header selects no byte of the file."""
+
+
+def parse_byte_range(header, size):
+    """
+    Return the (first, last) byte positions selected by a Range header, or
+    None when the whole file should be sent. Headers that are malformed or
+    ask for several ranges are ignored, as RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.replace(" ", "")) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+        if first > last:
+            if first >= size:
+                raise RangeNotSatisfiable
+            return None
+    elif last:
+        # The final bytes of the file.
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if size == 0:
+        raise RangeNotSatisfiable
+    return first, last
+
+
+def iterate_body(body, chunk_size):
+    """Read an object body in chunks, closing it however reading ends."""
+    try:
+        yield from iter(functools.partial(body.read, chunk_size), b"")
+    finally:
+        body.close()
+
+
+def stream_object(request, object_key, size, etag, filename):
+    """
+    Stream an object through the app in FILE_PROXY_CHUNK_SIZE chunks,
+    answering Range and If-Range requests with the selected bytes. etag must
+    change whenever the content could, so that If-Range can be checked
+    without asking the object storage.
+
+    Objects in S3 that fit in the ObjectDiskCache are sent from their cached
+    copy, whole or in part, through the WSGI server's file wrapper, which
+    uses sendfile where available. Copies still being fetched, and all of
+    them under ASGI, are read in chunks instead.
+    """
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    status = 200 if byte_range is None else 206
+    asgi = isinstance(request, ASGIRequest)
+    storage = get_object_storage()
+    disk_cache = ObjectDiskCache()
+    if not storage.local and disk_cache.can_cache(size):
+        first, last = byte_range or (0, size - 1)
+        content_length = last - first + 1
+        file = disk_cache.open(object_key, size, content_length)
+        if byte_range is not None:
+            file = FileRange(file, first, last)
+        if asgi:
+            content = iterate_body(file, settings.FILE_PROXY_CHUNK_SIZE)
+            response = StreamingHttpResponse(
+                iterate_in_thread(content, thread_sensitive=False),
+                status=status,
+                content_type="application/octet-stream",
+            )
+        else:
+            response = FileResponse(
+                file, status=status, content_type="application/octet-stream"
+            )
+            response.block_size = settings.FILE_PROXY_CHUNK_SIZE
+    else:
+        body, content_length = storage.open(object_key, byte_range)
+        content = iterate_body(body, settings.FILE_PROXY_CHUNK_SIZE)
+        if asgi:
+            # Under ASGI each chunk is read in a worker thread, and none is
+            # held while waiting for a slow client to take the previous one.
+            content = iterate_in_thread(content, thread_sensitive=False)
+        response = StreamingHttpResponse(
+            content, status=status, content_type="application/octet-stream"
+        )
+    response["Content-Length"] = content_length
+    if byte_range is not None:
+        response["Content-Range"] = "bytes {}-{}/{}".format(*byte_range, size)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def accel_redirect_location(path):
+    """Get the internal location nginx serves a local object's path from."""
+    relative_path = os.path.relpath(path, settings.FILE_LOCAL_STORAGE_ROOT)
+    return settings.FILE_ACCEL_REDIRECT_PREFIX + quote(
+        relative_path.replace(os.sep, "/")
+    )
+
+
+def offload_object(object_key, filename):
+    """
+    Answer with a FILE_ACCEL_HEADER header that has the web server send an
+    object stored under FILE_LOCAL_STORAGE_ROOT, itself answering Range
+    requests. The file is not opened here.
+    """
+    path = LocalObjectStorage().path(object_key)
+    response = HttpResponse(content_type="application/octet-stream")
+    if settings.FILE_ACCEL_HEADER == "X-Sendfile":
+        response["X-Sendfile"] = path
+    else:
+        response["X-Accel-Redirect"] = accel_redirect_location(path)
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def offload_archive(files):
+    """
+    Answer with the file list nginx's mod_zip builds a ZIP archive of files,
+    rows with original_filename, size and object_key, from. Each entry is
+    fetched through FILE_ACCEL_REDIRECT_PREFIX and sent with sendfile; the
+    CRC-32s are left for mod_zip to compute.
+    """
+    storage = LocalObjectStorage()
+    used_names = set()
+    lines = [
+        "- {} {} {}\n".format(
+            file.size,
+            accel_redirect_location(storage.path(file.object_key)),
+            archive_name(file.original_filename, used_names),
+        )
+        for file in files
+    ]
+    response = HttpResponse("".join(lines), content_type="text/plain")
+    response["X-Archive-Files"] = "zip"
+    response["X-Archive-Charset"] = "utf-8"
+    response["Content-Disposition"] = 'attachment; filename="files.zip"'
+    return response
+
+
+class ChunkBuffer:
+    """
+    A write-only, unseekable file that collects what is written to it until
+    it is taken, so that a ZipFile can be streamed as it is written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        """Return what was written since the last call and forget it."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def open_object(object_key, size, chunk_size):
+    """
+    Open an object, from FILE_LOCAL_STORAGE_ROOT in "accel" mode and from
+    the ObjectDiskCache or the object storage otherwise, and read its first
+    chunk, returning the body, the first chunk and an iterator over the
+    remaining chunks.
+    """
+    if settings.FILE_DOWNLOAD_MODE == "accel":
+        storage = LocalObjectStorage()
+    else:
+        storage = get_object_storage()
+    disk_cache = ObjectDiskCache()
+    if not storage.local and disk_cache.can_cache(size):
+        body = disk_cache.open(object_key, size)
+    else:
+        body, _ = storage.open(object_key)
+    chunks = iter(functools.partial(body.read, chunk_size), b"")
+    try:
+        first = next(chunks, b"")
+    except BaseException:
+        body.close()
+        raise
+    return body, first, chunks
+
+
+def archive_name(filename, used_names):
+    """
+    Return the name of a file in an archive: its filename with path
+    separators and line breaks replaced, numbered like "report (1).pdf" if an earlier entry
+    already has it. Names are compared case-insensitively, since archives
+    are often extracted on case-insensitive file systems.
+    """
+    name = filename
+    for character in "/\\\r\n":
+        name = name.replace(character, "_")
+    name = name.strip() or "file"
+    stem, extension = os.path.splitext(name)
+    number = 0
+    while name.casefold() in used_names:
+        number += 1
+        name = f"{stem} ({number}){extension}"
+    used_names.add(name.casefold())
+    return name
+
+
+def stream_archive(files, chunk_size):
+    """
+    Yield a ZIP archive of files, rows with original_filename, size,
+    upload_date and object_key, as it is built.
+
+    Entries are stored uncompressed, since most uploads are already
+    compressed, and read in chunk_size chunks. While one entry is
+    being sent, the request for the next one is made in a worker thread, so
+    there is no pause between entries; at most one chunk of each is held.
+    """
+    buffer = ChunkBuffer()
+    used_names = set()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        if files:
+            pending = executor.submit(
+                open_object, files[0].object_key, files[0].size, chunk_size
+            )
+        try:
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+                for index, file in enumerate(files):
+                    body, first, chunks = pending.result()
+                    pending = None
+                    try:
+                        if index + 1 < len(files):
+                            next_file = files[index + 1]
+                            pending = executor.submit(
+                                open_object,
+                                next_file.object_key,
+                                next_file.size,
+                                chunk_size,
+                            )
+                        upload_date = timezone.localtime(file.upload_date)
+                        info = zipfile.ZipInfo(
+                            archive_name(file.original_filename, used_names),
+                            date_time=upload_date.timetuple()[:6],
+                        )
+                        info.file_size = file.size
+                        with archive.open(info, "w") as entry:
+                            for chunk in itertools.chain([first], chunks):
+                                entry.write(chunk)
+                                data = buffer.take()
+                                if data:
+                                    yield data
+                    finally:
+                        body.close()
+            # The data descriptor of the last entry and the central directory.
+            yield buffer.take()
+        finally:
+            if pending is not None:
+                pending.cancel()
+                if not pending.cancelled() and pending.exception() is None:
+                    pending.result()[0].close()
@@ -0,0 +1,429 @@
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    SkipFile,
+    StopFutureHandlers,
+)
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import FileModel
+from .repository import (
+    ContentBlobRepository,
+    FileRepository,
+    StorageUsageRepository,
+)
+from .serializers import MAX_UPLOAD_SIZE
+from .storage import StorageError, get_object_storage
+from .utils import build_blob_key, has_blocked_extension
+
+EXTENSION_MAX_LENGTH = FileModel._meta.get_field("file_extension").max_length
+# Room for multipart boundaries, part headers and small form fields when
+# comparing Content-Length against a limit on file content.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Upload rejected."
+    default_code = "upload_rejected"
+
+
+class UploadTooLarge(UploadRejected):
+    default_detail = "File size should be less than 350MB"
+    default_code = "upload_too_large"
+
+
+class QuotaExceeded(UploadRejected):
+    default_detail = "Storage quota exceeded"
+    default_code = "quota_exceeded"
+
+
+class BlockedFileType(UploadRejected):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_detail = "Files of this type cannot be uploaded"
+    default_code = "blocked_file_type"
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    Reject an upload as early as possible instead of after it was received.
+
+    Content-Length is checked against the file size limit and the user's
+    remaining USER_STORAGE_QUOTA before the body is read, file names against
+    BLOCKED_UPLOAD_EXTENSIONS as each file starts, and the received bytes
+    against both limits as they arrive. The first limit crossed raises an
+    UploadRejected, which stops reading the body. Must come before the
+    handler storing the files, so no byte past a limit is stored.
+
+    Pass max_file_size=None or check_extensions=False when the storing
+    handler reports those per file instead.
+    """
+
+    def __init__(
+        self, request=None, max_file_size=MAX_UPLOAD_SIZE, check_extensions=True
+    ):
+        super().__init__(request)
+        self.max_file_size = max_file_size
+        self.check_extensions = check_extensions
+        self.remaining_quota = None
+        self.received = 0
+        self.file_received = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        self.remaining_quota = StorageUsageRepository().get_remaining_quota(
+            self.request.user
+        )
+        if not content_length:
+            return
+        if (
+            self.max_file_size is not None
+            and content_length > self.max_file_size + MULTIPART_OVERHEAD
+        ):
+            raise UploadTooLarge()
+        if (
+            self.remaining_quota is not None
+            and content_length > self.remaining_quota + MULTIPART_OVERHEAD
+        ):
+            raise QuotaExceeded()
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.file_received = 0
+        if self.check_extensions and has_blocked_extension(file_name):
+            raise BlockedFileType()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        self.file_received += len(raw_data)
+        if self.max_file_size is not None and self.file_received > self.max_file_size:
+            raise UploadTooLarge()
+        if self.remaining_quota is not None and self.received > self.remaining_quota:
+            raise QuotaExceeded()
+        return raw_data
+
+    def file_complete(self, file_size):
+        # The file is stored by a handler further down the list.
+        return None
+
+
+class S3UploadedFile(UploadedFile):
+    """
+    A file whose content was already written to the object storage while it
+    was received.
+    """
+
+    def __init__(
+        self,
+        file_id,
+        object_key,
+        sha256,
+        name,
+        size,
+        content_type,
+        charset,
+        content_type_extra=None,
+    ):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.file_id = file_id
+        # None when the content matched an existing blob and was not stored
+        self.object_key = object_key
+        self.sha256 = sha256
+
+    def close(self):
+        # There is no local file handle to release.
+        pass
+
+
+class S3MultipartUploadHandler(FileUploadHandler):
+    """
+    Stream the "file" field of a multipart request straight into the object
+    storage.
+
+    Incoming chunks are written into a StreamingUpload while the rest of the
+    body is still being received. With S3, the TransferEngine sends files
+    above S3_UPLOAD_MULTIPART_THRESHOLD as parts of S3_UPLOAD_PART_SIZE bytes
+    from a pool of S3_UPLOAD_MAX_CONCURRENCY threads, so a worker holds a
+    bounded number of part buffers and never spools the upload to memory or
+    disk. Local storage writes the chunks to the object's file.
+
+    A pending file and its upload session are recorded before any data is
+    sent, in their own short transactions, so reconcile_uploads can finish
+    or roll back uploads whose request never got to store them.
+
+    The content is hashed with SHA-256 on the way through. When the client
+    sends an X-Content-SHA256 header naming content that is already stored,
+    nothing is stored at all; the body is still hashed so the claim can be
+    checked before the existing blob is shared.
+    """
+
+    upload_field_name = "file"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.storage = get_object_storage()
+        self.active = False
+        self.uploaded_file = None
+        # Not "file": MultiPartParser closes handler.file on SkipFile.
+        self.pending_file = None
+        self.object_key = None
+        self.sha256 = None
+        self.engine = None
+        self.stream = None
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name != self.upload_field_name:
+            return
+        if self.active or self.uploaded_file is not None:
+            # Only the first "file" part of a request is accepted.
+            raise SkipFile()
+
+        # Normalise the name the same way UploadedFile does, so the S3 key
+        # matches the original_filename stored for the file.
+        self.file_name = UploadedFile(name=file_name).name
+        self.sha256 = hashlib.sha256()
+        declared_sha256 = self.request.META.get("HTTP_X_CONTENT_SHA256", "").lower()
+        if declared_sha256 and ContentBlobRepository().exists(declared_sha256):
+            self.object_key = None
+        else:
+            self.object_key = build_blob_key(uuid.uuid4())
+
+        self.pending_file = FileRepository().create_pending_file(
+            original_filename=self.file_name,
+            size=0,
+            owner=self.request.user,
+            expires_at=timezone.now()
+            + timedelta(seconds=settings.PENDING_UPLOAD_EXPIRES),
+            object_key=self.object_key or "",
+        )
+        if self.object_key is not None:
+            self.engine = self.storage.open_transfer()
+            self.stream = self.engine.open_stream(self.object_key)
+        self.active = True
+        # The default handlers must not spool this file to memory or disk.
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        self.sha256.update(raw_data)
+        if self.stream is not None:
+            try:
+                self.stream.write(raw_data)
+            except Exception:
+                self.discard()
+                raise
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+
+        if self.stream is not None:
+            try:
+                self.stream.finish()
+            except Exception:
+                self.discard()
+                raise
+            self.stream = None
+            self._release()
+
+        self.active = False
+        self.uploaded_file = S3UploadedFile(
+            file_id=self.pending_file.id,
+            object_key=self.object_key,
+            sha256=self.sha256.hexdigest(),
+            name=self.file_name,
+            size=file_size,
+            content_type=self.content_type,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        return self.uploaded_file
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def discard(self):
+        """Remove everything this handler wrote and mark the file as failed."""
+        self.delete_stored_object()
+        if self.pending_file is not None:
+            FileRepository().mark_upload_failed(self.pending_file)
+        self.active = False
+        self.uploaded_file = None
+
+    def delete_stored_object(self):
+        """Remove the object this handler stored, if any."""
+        if self.stream is not None:
+            # Aborts the multipart upload if one was started.
+            self.stream.cancel()
+            self.stream = None
+        elif self.uploaded_file is not None and self.object_key is not None:
+            try:
+                self.storage.delete(self.object_key)
+            except StorageError:
+                pass
+        self._release()
+
+    def _release(self):
+        if self.engine is not None:
+            self.engine.shutdown()
+            self.engine = None
+
+
+class BatchUpload:
+    """One file of a batch upload and the transfer storing it."""
+
+    def __init__(self, name, object_key):
+        self.name = name
+        self.object_key = object_key
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.stream = None
+        self.error = None
+        self.uploaded_file = None
+
+
+class S3BatchUploadHandler(FileUploadHandler):
+    """
+    Stream every "files" field of a multipart request into the object
+    storage.
+
+    All files share one TransferEngine. A file's transfer is left running
+    when its last chunk has been received, so writes of earlier files
+    overlap with receiving the next ones; wait() collects the outcome of
+    each. Nothing is recorded in the database here: the view stores the
+    metadata of all files in bulk once the transfers are done, and
+    discard() deletes the objects when that fails.
+    """
+
+    upload_field_name = "files"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.storage = get_object_storage()
+        self.engine = None
+        self.uploads = []
+        self.current = None
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.current = None
+        if field_name != self.upload_field_name:
+            return
+
+        upload = BatchUpload(
+            name=UploadedFile(name=file_name).name,
+            object_key=build_blob_key(uuid.uuid4()),
+        )
+        self.uploads.append(upload)
+        self.current = upload
+        if len(self.uploads) > settings.MAX_BATCH_UPLOAD_FILES:
+            upload.error = (
+                f"No more than {settings.MAX_BATCH_UPLOAD_FILES} files "
+                "can be uploaded at once"
+            )
+        elif has_blocked_extension(upload.name):
+            upload.error = BlockedFileType.default_detail
+        elif len(upload.name.split(".")[-1]) > EXTENSION_MAX_LENGTH:
+            upload.error = "File extension is too long"
+        else:
+            if self.engine is None:
+                self.engine = self.storage.open_transfer()
+            upload.stream = self.engine.open_stream(upload.object_key)
+        # Rejected files are drained here too, never spooled.
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        upload = self.current
+        if upload is None:
+            return raw_data
+
+        upload.size += len(raw_data)
+        if upload.stream is None:
+            return None
+        if upload.size > MAX_UPLOAD_SIZE:
+            self._fail(upload, "File size should be less than 350MB")
+            return None
+
+        upload.sha256.update(raw_data)
+        try:
+            upload.stream.write(raw_data)
+        except Exception as exc:
+            self._fail(upload, str(exc))
+        return None
+
+    def file_complete(self, file_size):
+        upload = self.current
+        if upload is None:
+            return None
+
+        self.current = None
+        if upload.stream is not None:
+            # Let the transfer finish in the background; see wait().
+            upload.stream.close()
+        upload.uploaded_file = S3UploadedFile(
+            file_id=None,
+            object_key=upload.object_key,
+            sha256=upload.sha256.hexdigest(),
+            name=upload.name,
+            size=file_size,
+            content_type=self.content_type,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        return upload.uploaded_file
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def wait(self):
+        """Wait for all transfers and return the uploads, with their errors."""
+        for upload in self.uploads:
+            if upload.stream is None:
+                continue
+            try:
+                upload.stream.finish()
+            except Exception as exc:
+                upload.error = str(exc)
+        self._release()
+        return self.uploads
+
+    def discard(self, uploads=None):
+        """Cancel or delete the objects stored for uploads, all by default."""
+        stored_keys = []
+        for upload in self.uploads if uploads is None else uploads:
+            if upload.stream is None:
+                continue
+            if upload.stream.done() and upload.error is None:
+                stored_keys.append(upload.object_key)
+            else:
+                upload.stream.cancel()
+            upload.stream = None
+        self._release()
+        self.delete_objects(stored_keys)
+
+    def delete_objects(self, keys):
+        """Delete stored objects, with one multi-object delete on S3."""
+        if keys:
+            self.storage.delete_many(keys)
+
+    def _fail(self, upload, error):
+        upload.error = error
+        upload.stream.cancel()
+        upload.stream = None
+
+    def _release(self):
+        if self.engine is not None:
+            self.engine.shutdown()
+            self.engine = None
@@ -0,0 +1,81 @@
+import time
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from filesharing.presign import S3Presigner
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure presigned URLs per second from botocore's "
+        "generate_presigned_url and from S3Presigner, for GET and PUT. "
+        "Signing is local, so no S3 endpoint needs to be running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=5000,
+            help="URLs signed per run (default: 5000).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs per signer; the best run is reported (default: 3).",
+        )
+
+    def handle(self, *args, **options):
+        client = boto3.client(
+            "s3",
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+            config=Config(signature_version="s3v4"),
+        )
+        presigner = S3Presigner(
+            access_key=settings.AWS_ACCESS_KEY_ID,
+            secret_key=settings.AWS_SECRET_ACCESS_KEY,
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            region=settings.AWS_S3_REGION_NAME,
+        )
+        bucket = settings.AWS_STORAGE_BUCKET_NAME
+        count = options["count"]
+
+        self.stdout.write(
+            f"{'method':>6} {'botocore/s':>11} {'native/s':>10} {'speedup':>8}"
+        )
+        for method, operation in [("GET", "get_object"), ("PUT", "put_object")]:
+            botocore_rate = self.best_rate(
+                lambda key: client.generate_presigned_url(
+                    operation, Params={"Bucket": bucket, "Key": key}, ExpiresIn=300
+                ),
+                count,
+                options["repeat"],
+            )
+            native_rate = self.best_rate(
+                lambda key: presigner.presign(method, bucket, key, 300),
+                count,
+                options["repeat"],
+            )
+            self.stdout.write(
+                f"{method:>6} {botocore_rate:>11.0f} {native_rate:>10.0f} "
+                f"{native_rate / botocore_rate:>7.1f}x"
+            )
+
+    def best_rate(self, presign, count, repeat):
+        """Return the highest number of URLs per second over repeat runs."""
+        keys = [f"blobs/benchmark-{i}" for i in range(count)]
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for key in keys:
+                presign(key)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return count / best
@@ -0,0 +1,105 @@
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from filesharing.models import FileModel
+from filesharing.serializers import (
+    FILE_DATA_ROW_FIELDS,
+    FileDataSerializer,
+    serialize_file_rows,
+)
+
+# One size in each unit FileDataSerializer shows.
+SIZES = [512, 20 * 1024, 30 * 1024**2, 1536 * 1024**2]
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serializing file listing rows with FileDataSerializer and "
+        "with serialize_file_rows, for a grid of page sizes. Rows are built in "
+        "memory, so no database is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int_list,
+            default=[16, 100, 1000],
+            help="Comma-separated row counts (default: 16,100,1000).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Runs per row count; the best run is reported (default: 20).",
+        )
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        self.stdout.write(
+            f"{'rows':>6} {'serializer ms':>14} {'rows ms':>9} {'speedup':>8}"
+        )
+        for count in options["rows"]:
+            rows = self.build_rows(count)
+            if renderer.render(self.serialize_instances(rows)) != renderer.render(
+                serialize_file_rows(rows)
+            ):
+                raise AssertionError("Serialized listings differ")
+
+            slow = self.best_time(self.serialize_instances, rows, options["repeat"])
+            fast = self.best_time(serialize_file_rows, rows, options["repeat"])
+            self.stdout.write(
+                f"{count:>6} {slow * 1000:>14.3f} {fast * 1000:>9.3f} "
+                f"{slow / fast:>7.1f}x"
+            )
+
+    def build_rows(self, count):
+        """Rows as values_list(*FILE_DATA_ROW_FIELDS, named=True) returns them."""
+        now = timezone.now()
+        row_class = namedtuple("Row", FILE_DATA_ROW_FIELDS)
+        return [
+            row_class(
+                uuid.uuid4(),
+                f"file-{i}.txt",
+                "txt",
+                SIZES[i % len(SIZES)],
+                now - timedelta(minutes=i),
+                "F",
+            )
+            for i in range(count)
+        ]
+
+    def serialize_instances(self, rows):
+        """The previous path: model instances from the rows, then the serializer."""
+        # from_db takes values in the model's field order, as the ORM reads them.
+        field_names = [
+            field.attname
+            for field in FileModel._meta.concrete_fields
+            if field.attname in FILE_DATA_ROW_FIELDS
+        ]
+        files = []
+        for row in rows:
+            file = FileModel.from_db(
+                "default", field_names, [getattr(row, name) for name in field_names]
+            )
+            file.permission = row.permission
+            files.append(file)
+        return FileDataSerializer(files, many=True).data
+
+    def best_time(self, serialize, rows, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize(rows)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
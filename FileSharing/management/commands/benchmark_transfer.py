@@ -0,0 +1,106 @@
+import os
+import time
+
+import boto3
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from s3transfer.manager import TransferConfig
+
+from filesharing.transfer import TransferEngine
+
+MB = 1024 * 1024
+# Chunk size Django hands to upload handlers.
+REQUEST_CHUNK_SIZE = 64 * 1024
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure upload throughput of the transfer engine for a grid of part "
+        "sizes and concurrency levels. Point --endpoint-url at a local S3 "
+        "stand-in such as MinIO or moto_server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoint-url",
+            default=settings.AWS_S3_ENDPOINT_URL,
+            help="S3 endpoint to upload to (default: AWS_S3_ENDPOINT_URL).",
+        )
+        parser.add_argument(
+            "--bucket",
+            default=settings.AWS_STORAGE_BUCKET_NAME,
+            help="Bucket to upload to; created if missing.",
+        )
+        parser.add_argument(
+            "--size", type=int, default=100, help="Upload size in MB (default: 100)."
+        )
+        parser.add_argument(
+            "--part-sizes",
+            type=int_list,
+            default=[5, 8, 16, 32],
+            help="Comma-separated part sizes in MB (default: 5,8,16,32).",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int_list,
+            default=[1, 2, 4, 8],
+            help="Comma-separated concurrency levels (default: 1,2,4,8).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Uploads per combination; the best run is reported (default: 3).",
+        )
+
+    def handle(self, *args, **options):
+        client = boto3.client(
+            "s3",
+            endpoint_url=options["endpoint_url"],
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        )
+        bucket = options["bucket"]
+        try:
+            client.head_bucket(Bucket=bucket)
+        except client.exceptions.ClientError:
+            client.create_bucket(Bucket=bucket)
+
+        size = options["size"] * MB
+        data = os.urandom(size)
+        key = "benchmark/transfer"
+
+        self.stdout.write(f"Uploading {options['size']}MB to {bucket}")
+        self.stdout.write(f"{'part size':>10} {'concurrency':>12} {'seconds':>9} {'MB/s':>8}")
+        for part_size in options["part_sizes"]:
+            for concurrency in options["concurrency"]:
+                config = TransferConfig(
+                    multipart_threshold=part_size * MB,
+                    multipart_chunksize=part_size * MB,
+                    max_request_concurrency=concurrency,
+                    max_in_memory_upload_chunks=concurrency,
+                )
+                best = min(
+                    self.time_upload(client, config, bucket, key, data)
+                    for _ in range(options["repeat"])
+                )
+                self.stdout.write(
+                    f"{part_size:>8}MB {concurrency:>12} {best:>9.2f} "
+                    f"{size / MB / best:>8.1f}"
+                )
+        client.delete_object(Bucket=bucket, Key=key)
+
+    def time_upload(self, client, config, bucket, key, data):
+        """Stream data through the engine the way the upload handler does."""
+        view = memoryview(data)
+        started = time.perf_counter()
+        with TransferEngine(client=client, config=config, bucket_name=bucket) as engine:
+            stream = engine.open_stream(key)
+            for offset in range(0, len(data), REQUEST_CHUNK_SIZE):
+                stream.write(view[offset : offset + REQUEST_CHUNK_SIZE])
+            stream.finish()
+        return time.perf_counter() - started
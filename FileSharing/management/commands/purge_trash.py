@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from filesharing.repository import FileRepository
+from filesharing.storage import get_object_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Permanently delete files that have been in the trash for more than "
+        "FILE_TRASH_RETENTION seconds, and their content once no other file "
+        "shares it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.FILE_PURGE_BATCH_SIZE,
+            help="Files deleted per transaction (default: FILE_PURGE_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        storage = get_object_storage()
+        file_repository = FileRepository()
+        before = timezone.now() - timezone.timedelta(
+            seconds=settings.FILE_TRASH_RETENTION
+        )
+
+        purged = 0
+        deleted_objects = 0
+        failed_objects = 0
+        while True:
+            with transaction.atomic():
+                files = list(
+                    file_repository.get_expired_trash(before)[: options["batch_size"]]
+                )
+                object_keys = file_repository.delete_files_from_db(files)
+            if not files:
+                break
+            purged += len(files)
+
+            # The rows are gone, so objects that fail to delete are only
+            # reported; nothing refers to them any more.
+            errors = storage.delete_many(object_keys)
+            for object_key, error in errors.items():
+                self.stderr.write(f"{object_key}: {error}")
+            deleted_objects += len(object_keys) - len(errors)
+            failed_objects += len(errors)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Purged {purged} files from the trash, deleted {deleted_objects} "
+                f"objects, {failed_objects} could not be deleted."
+            )
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from filesharing.repository import StorageUsageRepository
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate every user's storage usage from their files and correct "
+        "the counters that drifted. Meant to run periodically."
+    )
+
+    def handle(self, *args, **options):
+        corrected = StorageUsageRepository().reconcile()
+        self.stdout.write(f"Corrected the storage usage of {corrected} users.")
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from filesharing.repository import FileRepository, UploadSessionRepository
+from filesharing.storage import StorageError, get_object_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish or roll back pending uploads that expired or failed, and abort "
+        "multipart uploads the database no longer knows about."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--orphan-age",
+            type=int,
+            default=24,
+            help="Abort untracked multipart uploads started more than this many "
+            "hours ago (default: 24).",
+        )
+
+    def handle(self, *args, **options):
+        storage = get_object_storage()
+        file_repository = FileRepository()
+        upload_session_repository = UploadSessionRepository()
+        now = timezone.now()
+
+        finished = 0
+        rolled_back = 0
+        for upload_session in upload_session_repository.get_stale_sessions(now):
+            file = upload_session.file
+            try:
+                if (
+                    file.status == "P"
+                    and upload_session.object_key
+                    and not upload_session.upload_id
+                ):
+                    # The object may have arrived even though nobody finalized
+                    # it. A size of 0 means the upload was streamed and its
+                    # size was not known yet.
+                    size = storage.size(upload_session.object_key)
+                    if size is not None and file.size in [0, size]:
+                        with transaction.atomic():
+                            file_repository.finalize_upload(
+                                file, upload_session.user, size=size
+                            )
+                        finished += 1
+                        continue
+
+                if upload_session.upload_id:
+                    storage.abort_multipart_upload(
+                        upload_session.object_key, upload_session.upload_id
+                    )
+                elif upload_session.object_key:
+                    storage.delete(upload_session.object_key)
+            except StorageError as e:
+                self.stderr.write(f"{upload_session.object_key}: {e}")
+                continue
+            upload_session_repository.discard(upload_session)
+            rolled_back += 1
+
+        # Multipart uploads whose worker died mid-stream have no session row.
+        tracked_upload_ids = set(
+            upload_session_repository.filter()
+            .exclude(upload_id="")
+            .values_list("upload_id", flat=True)
+        )
+        cutoff = now - timezone.timedelta(hours=options["orphan_age"])
+        orphans = 0
+        for upload in storage.list_multipart_uploads():
+            if upload.upload_id in tracked_upload_ids or upload.initiated >= cutoff:
+                continue
+            try:
+                storage.abort_multipart_upload(upload.key, upload.upload_id)
+                orphans += 1
+            except StorageError as e:
+                self.stderr.write(f"{upload.key}: {e}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Finished {finished} and rolled back {rolled_back} pending "
+                f"uploads, aborted {orphans} orphaned multipart uploads."
+            )
+        )
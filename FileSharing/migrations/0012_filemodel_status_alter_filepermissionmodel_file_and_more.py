@@ -0,0 +1,48 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0011_alter_filepermissionmodel_file_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filemodel',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('S', 'Stored')], default='S', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='filepermissionmodel',
+            name='file',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_permissions', to='filesharing.filemodel'),
+        ),
+        migrations.AlterField(
+            model_name='filepermissionmodel',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_permissions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='UploadSessionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_key', models.CharField(max_length=1024)),
+                ('upload_id', models.CharField(blank=True, default='', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='upload_session', to='filesharing.filemodel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Upload Session',
+                'verbose_name_plural': 'Upload Sessions',
+                'db_table': 'upload_sessions',
+            },
+        ),
+    ]
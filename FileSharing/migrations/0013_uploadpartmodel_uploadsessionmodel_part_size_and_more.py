@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0012_filemodel_status_alter_filepermissionmodel_file_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadPartModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.PositiveIntegerField()),
+                ('etag', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Upload Part',
+                'verbose_name_plural': 'Upload Parts',
+                'db_table': 'upload_parts',
+                'ordering': ['part_number'],
+            },
+        ),
+        migrations.AddField(
+            model_name='uploadsessionmodel',
+            name='part_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='uploadsessionmodel',
+            index=models.Index(fields=['expires_at'], name='upload_sess_expires_aebd1e_idx'),
+        ),
+        migrations.AddField(
+            model_name='uploadpartmodel',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='filesharing.uploadsessionmodel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='uploadpartmodel',
+            unique_together={('session', 'part_number')},
+        ),
+    ]
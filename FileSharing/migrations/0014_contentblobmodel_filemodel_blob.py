@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0013_uploadpartmodel_uploadsessionmodel_part_size_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlobModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('object_key', models.CharField(max_length=1024, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Content Blob',
+                'verbose_name_plural': 'Content Blobs',
+                'db_table': 'content_blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='filemodel',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='filesharing.contentblobmodel'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0014_contentblobmodel_filemodel_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filemodel',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('S', 'Stored'), ('F', 'Failed')], default='S', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='uploadsessionmodel',
+            name='object_key',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_storage_usage(apps, schema_editor):
+    FilePermissionModel = apps.get_model("filesharing", "FilePermissionModel")
+    StorageUsageModel = apps.get_model("filesharing", "StorageUsageModel")
+
+    stored = FilePermissionModel.objects.filter(file__status="S")
+    owned = dict(
+        stored.filter(permission="F")
+        .values("user_id")
+        .annotate(total=Sum("file__size"))
+        .values_list("user_id", "total")
+    )
+    visible = (
+        stored.values("user_id")
+        .annotate(total=Sum("file__size"))
+        .values_list("user_id", "total")
+    )
+    StorageUsageModel.objects.bulk_create(
+        [
+            StorageUsageModel(
+                user_id=user_id,
+                owned_bytes=owned.get(user_id, 0),
+                visible_bytes=total,
+            )
+            for user_id, total in visible
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0015_alter_filemodel_status_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsageModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owned_bytes', models.BigIntegerField(default=0)),
+                ('visible_bytes', models.BigIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Storage Usage',
+                'verbose_name_plural': 'Storage Usage',
+                'db_table': 'storage_usage',
+            },
+        ),
+        migrations.RunPython(backfill_storage_usage, migrations.RunPython.noop),
+    ]
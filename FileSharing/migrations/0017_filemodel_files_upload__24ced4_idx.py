@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0016_storageusagemodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filemodel',
+            index=models.Index(fields=['upload_date', 'id'], name='files_upload__24ced4_idx'),
+        ),
+    ]
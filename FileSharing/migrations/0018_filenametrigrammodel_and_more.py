@@ -0,0 +1,73 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:18
+
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_file_name_trigrams(apps, schema_editor):
+    FileModel = apps.get_model("filesharing", "FileModel")
+    FileNameTrigramModel = apps.get_model("filesharing", "FileNameTrigramModel")
+
+    trigrams = []
+    for file_id, name in (
+        FileModel.objects.values_list("id", "original_filename").iterator()
+    ):
+        name = "".join(
+            character
+            for character in unicodedata.normalize("NFKD", name.lower())
+            if not unicodedata.combining(character)
+        )
+        trigrams.extend(
+            FileNameTrigramModel(file_id=file_id, trigram=trigram)
+            for trigram in {name[i : i + 3] for i in range(len(name) - 2)}
+        )
+        if len(trigrams) >= 10000:
+            FileNameTrigramModel.objects.bulk_create(trigrams, ignore_conflicts=True)
+            trigrams = []
+    FileNameTrigramModel.objects.bulk_create(trigrams, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0017_filemodel_files_upload__24ced4_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileNameTrigramModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+            options={
+                'verbose_name': 'File Name Trigram',
+                'verbose_name_plural': 'File Name Trigrams',
+                'db_table': 'file_name_trigrams',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='filemodel',
+            index=models.Index(fields=['original_filename'], name='files_origina_17f0ac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filemodel',
+            index=models.Index(fields=['file_extension'], name='files_file_ex_5338c0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filemodel',
+            index=models.Index(fields=['size'], name='files_size_9a2746_idx'),
+        ),
+        migrations.AddField(
+            model_name='filenametrigrammodel',
+            name='file',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_trigrams', to='filesharing.filemodel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='filenametrigrammodel',
+            unique_together={('trigram', 'file')},
+        ),
+        migrations.RunPython(backfill_file_name_trigrams, migrations.RunPython.noop),
+    ]
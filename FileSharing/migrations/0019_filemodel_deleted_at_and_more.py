@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0018_filenametrigrammodel_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filemodel',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='filemodel',
+            index=models.Index(fields=['deleted_at'], name='files_deleted_65053c_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0019_filemodel_deleted_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filenametrigrammodel',
+            index=models.Index(fields=['file', 'trigram'], name='file_name_t_file_id_8ef747_idx'),
+        ),
+    ]
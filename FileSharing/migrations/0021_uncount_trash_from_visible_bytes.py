@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-17 09:12
+
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def uncount_owned_trash(apps, schema_editor):
+    FilePermissionModel = apps.get_model("filesharing", "FilePermissionModel")
+    StorageUsageModel = apps.get_model("filesharing", "StorageUsageModel")
+
+    # Trashed files were only taken out of their readers' visible bytes.
+    trashed = (
+        FilePermissionModel.objects.filter(
+            permission="F", file__status="S", file__deleted_at__isnull=False
+        )
+        .values("user_id")
+        .annotate(total=Sum("file__size"))
+        .values_list("user_id", "total")
+    )
+    for user_id, total in trashed:
+        StorageUsageModel.objects.filter(user_id=user_id).update(
+            visible_bytes=F("visible_bytes") - total
+        )
+
+
+def recount_owned_trash(apps, schema_editor):
+    FilePermissionModel = apps.get_model("filesharing", "FilePermissionModel")
+    StorageUsageModel = apps.get_model("filesharing", "StorageUsageModel")
+
+    trashed = (
+        FilePermissionModel.objects.filter(
+            permission="F", file__status="S", file__deleted_at__isnull=False
+        )
+        .values("user_id")
+        .annotate(total=Sum("file__size"))
+        .values_list("user_id", "total")
+    )
+    for user_id, total in trashed:
+        StorageUsageModel.objects.filter(user_id=user_id).update(
+            visible_bytes=F("visible_bytes") + total
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesharing', '0020_filenametrigrammodel_file_name_t_file_id_8ef747_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(uncount_owned_trash, recount_owned_trash),
+    ]
@@ -6,7 +6,30 @@ def user_directory_path(instance, filename):
     return f"user_{instance.owner.id}/{filename}"
 
 
+class ContentBlobModel(models.Model):
+    # SHA-256 of the content, unknown for uploads that bypass the app
+    sha256 = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    object_key = models.CharField(max_length=1024, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "content_blobs"
+        verbose_name = "Content Blob"
+        verbose_name_plural = "Content Blobs"
+
+    def __str__(self):
+        return self.sha256 or self.object_key
+
+
 class FileModel(models.Model):
+    STATUS_CHOICES = [
+        ("P", "Pending"),
+        ("S", "Stored"),
+        ("F", "Failed"),
+    ]
+
     id = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False, unique=True
     )
@@ -14,9 +37,32 @@ class FileModel(models.Model):
     original_filename = models.CharField(max_length=255)
     size = models.PositiveIntegerField()
     file_extension = models.CharField(max_length=20)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="S")
+    # Files uploaded before content addressing have no blob and keep their
+    # per-user key, see FileRepository.get_object_key.
+    blob = models.ForeignKey(
+        ContentBlobModel,
+        on_delete=models.PROTECT,
+        related_name="files",
+        null=True,
+        blank=True,
+    )
+    # Set when the owner moves the file to the trash; purge_trash deletes it
+    # FILE_TRASH_RETENTION seconds later.
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = "files"
+        indexes = [
+            # Keyset pagination of listings, see FileCursorPagination.
+            models.Index(fields=["upload_date", "id"]),
+            # Listing filters, see FileRepository.filter_files.
+            models.Index(fields=["original_filename"]),
+            models.Index(fields=["file_extension"]),
+            models.Index(fields=["size"]),
+            # Expired tombstones, see FileRepository.get_expired_trash.
+            models.Index(fields=["deleted_at"]),
+        ]
         verbose_name = "File"
         verbose_name_plural = "Files"
 
@@ -24,6 +70,30 @@ class FileModel(models.Model):
         return self.original_filename
 
 
+class FileNameTrigramModel(models.Model):
+    """
+    One row per distinct lowercase three-character substring of a file name,
+    so substring searches can find candidate files through an index instead
+    of scanning every name with LIKE '%...%'.
+    """
+
+    file = models.ForeignKey(
+        FileModel, on_delete=models.CASCADE, related_name="name_trigrams"
+    )
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        db_table = "file_name_trigrams"
+        unique_together = ("trigram", "file")
+        # Reached from a user's permission rows, see FileRepository.filter_files.
+        indexes = [models.Index(fields=["file", "trigram"])]
+        verbose_name = "File Name Trigram"
+        verbose_name_plural = "File Name Trigrams"
+
+    def __str__(self):
+        return f"{self.trigram} - {self.file}"
+
+
 class FilePermissionModel(models.Model):
     PERMISSION_CHOICES = [
         ("R", "Read Permission"),
@@ -51,3 +121,69 @@ class FilePermissionModel(models.Model):
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
+
+
+class UploadSessionModel(models.Model):
+    file = models.OneToOneField(
+        FileModel, on_delete=models.CASCADE, related_name="upload_session"
+    )
+    user = models.ForeignKey(
+        "accounts.UserModel", on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    # Empty when the content matched an existing blob and was never stored
+    object_key = models.CharField(max_length=1024, blank=True)
+    # S3 multipart UploadId, empty for single presigned PUT uploads
+    upload_id = models.CharField(max_length=1024, blank=True, default="")
+    part_size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "upload_sessions"
+        indexes = [
+            models.Index(fields=["expires_at"]),
+        ]
+        verbose_name = "Upload Session"
+        verbose_name_plural = "Upload Sessions"
+
+    def __str__(self):
+        return f"{self.user} - {self.file}"
+
+
+class UploadPartModel(models.Model):
+    session = models.ForeignKey(
+        UploadSessionModel, on_delete=models.CASCADE, related_name="parts"
+    )
+    part_number = models.PositiveIntegerField()
+    etag = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "upload_parts"
+        unique_together = ("session", "part_number")
+        ordering = ["part_number"]
+        verbose_name = "Upload Part"
+        verbose_name_plural = "Upload Parts"
+
+    def __str__(self):
+        return f"{self.session} - part {self.part_number}"
+
+
+class StorageUsageModel(models.Model):
+    user = models.OneToOneField(
+        "accounts.UserModel", on_delete=models.CASCADE, related_name="storage_usage"
+    )
+    # Bytes of the stored files the user owns, limited by USER_STORAGE_QUOTA
+    owned_bytes = models.BigIntegerField(default=0)
+    # Bytes of the stored files the user can see, owned or shared with them,
+    # outside the trash
+    visible_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "storage_usage"
+        verbose_name = "Storage Usage"
+        verbose_name_plural = "Storage Usage"
+
+    def __str__(self):
+        return f"{self.user} - {self.owned_bytes}"
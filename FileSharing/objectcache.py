@@ -0,0 +1,295 @@
+import contextlib
+import fcntl
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .storage import get_object_storage
+
+# Temporary files of fills that were never published are deleted after this
+# many seconds.
+STALE_FILL_AGE = 60 * 60
+# Seconds a request reading an entry that is still being fetched waits before
+# looking for more bytes.
+FILL_POLL_INTERVAL = 0.05
+
+
+class ObjectDiskCache:
+    """
+    Size-bounded cache of S3 object content in OBJECT_CACHE_DIR, shared by
+    the processes serving downloads through the app.
+
+    Entries are named after a hash of the object key. Keys already name one
+    version of the content, since blobs are content-addressed and older
+    files have per-file keys, so entries never go stale. A file's mtime
+    records its last use, and once the directory holds more than
+    OBJECT_CACHE_MAX_SIZE bytes the least recently used entries are
+    deleted. Readers keep a deleted entry open until they are done with it.
+
+    A missing entry is fetched once however many requests ask for it at
+    once. The first of them publishes a .fill- file for the entry, locked
+    exclusively for as long as a background thread writes the object into
+    it, and renamed into place once it is complete. Every request, the
+    first included, reads the .fill- file as it grows instead of waiting for
+    the whole object. A .fill- file that is unlocked before it is complete
+    belongs to a fetch that failed, and the next request starts over.
+    """
+
+    hits_key = "files:object-cache:hits"
+    misses_key = "files:object-cache:misses"
+    bytes_saved_key = "files:object-cache:bytes-saved"
+
+    def __init__(self):
+        self.directory = settings.OBJECT_CACHE_DIR
+
+    def can_cache(self, size) -> bool:
+        """Check if an object of size bytes is kept in the cache."""
+        return bool(self.directory) and size <= settings.OBJECT_CACHE_MAX_OBJECT_SIZE
+
+    def open(self, object_key, size, sent_size=None):
+        """
+        Open the cached copy of an object of size bytes for reading, fetching
+        it from the object storage first if it is missing. Copies still being
+        fetched are returned as FillReaders. sent_size is the number of bytes
+        that will be sent from it, all of them by default, which are counted
+        as saved when it was cached.
+        """
+        if sent_size is None:
+            sent_size = size
+        path = self._path(object_key)
+        fill_path = os.path.join(self.directory, ".fill-" + os.path.basename(path))
+        while True:
+            try:
+                file = open(path, "rb")
+            except FileNotFoundError:
+                pass
+            else:
+                self._hit(path, sent_size)
+                return file
+
+            try:
+                file = self._fill(object_key, path, fill_path, size)
+            except FileExistsError:
+                file = self._follow(fill_path, size)
+                if file is not None:
+                    self._hit(path, sent_size)
+                    return file
+            else:
+                self._count(self.misses_key)
+                return file
+
+    def get_stats(self) -> dict:
+        """Get the hit and miss counts, bytes saved and size of the cache."""
+        hits = cache.get(self.hits_key, 0)
+        misses = cache.get(self.misses_key, 0)
+        lookups = hits + misses
+        entries = self._entries()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "bytes_saved": cache.get(self.bytes_saved_key, 0),
+            "objects": len(entries),
+            "size": sum(entry.stat().st_size for entry in entries),
+        }
+
+    def _fill(self, object_key, path, fill_path, size):
+        """
+        Start fetching an object into fill_path and return a FillReader of
+        it. Raise FileExistsError if another request is fetching it already.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".new-")
+        try:
+            # Locked before it is published, so no request ever sees a fill
+            # that nobody holds.
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            reader = open(temp_path, "rb", buffering=0)
+            try:
+                os.link(temp_path, fill_path)
+            except BaseException:
+                reader.close()
+                raise
+        except BaseException:
+            os.close(fd)
+            raise
+        finally:
+            os.unlink(temp_path)
+
+        try:
+            # Errors opening the object are raised before anything is sent.
+            body, _ = get_object_storage().open(object_key)
+        except BaseException:
+            os.unlink(fill_path)
+            os.close(fd)
+            reader.close()
+            raise
+        threading.Thread(
+            target=self._write_fill,
+            args=(body, fd, fill_path, path, size),
+            name="object-cache-fill",
+            daemon=True,
+        ).start()
+        return FillReader(reader, size)
+
+    def _write_fill(self, body, fd, fill_path, path, size):
+        """Copy an object body into a fill and put it in place when complete."""
+        with open(fd, "wb") as file:
+            try:
+                try:
+                    for chunk in iter(
+                        functools.partial(body.read, settings.FILE_PROXY_CHUNK_SIZE),
+                        b"",
+                    ):
+                        file.write(chunk)
+                        # Readers follow the file, not this buffer.
+                        file.flush()
+                finally:
+                    body.close()
+                if file.tell() != size:
+                    raise OSError(f"Expected {size} bytes, got {file.tell()}")
+                os.replace(fill_path, path)
+            except Exception:
+                # Readers find the fill unlocked and incomplete, and fail.
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(fill_path)
+                return
+        self._evict()
+
+    def _follow(self, fill_path, size):
+        """
+        Open the fill another request is running as a FillReader. Return
+        None when it finished or failed meanwhile, deleting a failed one so
+        the object can be fetched again.
+        """
+        try:
+            file = open(fill_path, "rb", buffering=0)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Still being written.
+            return FillReader(file, size)
+
+        # Nobody holds the fill: it was put in place, or its fetch died.
+        stat = os.fstat(file.fileno())
+        file.close()
+        try:
+            current = os.stat(fill_path)
+            if (current.st_dev, current.st_ino) == (stat.st_dev, stat.st_ino):
+                os.unlink(fill_path)
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _hit(self, path, sent_size):
+        self._count(self.hits_key)
+        self._count(self.bytes_saved_key, sent_size)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since it was opened.
+            pass
+
+    def _evict(self):
+        """Delete the least recently used entries while over the size limit."""
+        entries = []
+        stale_before = time.time() - STALE_FILL_AGE
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                try:
+                    stat = entry.stat()
+                    if entry.name.startswith("."):
+                        if entry.name.startswith(".new-") and (
+                            stat.st_mtime < stale_before
+                        ):
+                            os.unlink(entry.path)
+                    elif entry.is_file():
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:
+                    # Deleted by another process evicting at the same time.
+                    pass
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= settings.OBJECT_CACHE_MAX_SIZE:
+                break
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def _entries(self) -> list:
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        with os.scandir(self.directory) as scan:
+            return [
+                entry
+                for entry in scan
+                if not entry.name.startswith(".") and entry.is_file()
+            ]
+
+    def _path(self, object_key) -> str:
+        name = hashlib.sha256(object_key.encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _count(self, key, amount=1) -> None:
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.add(key, amount, timeout=None)
+
+
+class FillReader:
+    """
+    Reads a cache entry that is still being fetched, waiting for the bytes
+    that have not been written yet. Raises OSError if the fetch fails
+    before size bytes were written.
+    """
+
+    def __init__(self, file, size):
+        self.file = file
+        self.size = size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        remaining = self.size - self.file.tell()
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        while True:
+            data = self.file.read(size)
+            if data:
+                return data
+            self._wait()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _wait(self):
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # The fetch is still running.
+            time.sleep(FILL_POLL_INTERVAL)
+            return
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        if os.fstat(self.file.fileno()).st_size < self.size:
+            raise OSError("The object could not be fetched into the cache")
@@ -0,0 +1,103 @@
+import uuid
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class FileCursorPagination(BasePagination):
+    """
+    Keyset pagination over files, newest first, by (upload_date, id).
+
+    The cursor holds the (upload_date, id) of the last row shown, and the
+    next page is the rows after it in the files index. Unlike page numbers
+    there is no OFFSET to scan past and no COUNT(*), so every page costs the
+    same however deep it is. Cursors that go backwards hold the first row
+    shown and read the index the other way.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        if position is not None:
+            upload_date, file_id = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(upload_date__gt=upload_date)
+                    | Q(upload_date=upload_date, id__gt=file_id)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(upload_date__lt=upload_date)
+                    | Q(upload_date=upload_date, id__lt=file_id)
+                )
+        if reverse:
+            queryset = queryset.order_by("upload_date", "id")
+        else:
+            queryset = queryset.order_by("-upload_date", "-id")
+
+        # One extra row tells whether there is a page beyond this one.
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_position = (
+            self.get_position(results[-1]) if has_next and results else None
+        )
+        self.previous_position = (
+            self.get_position(results[0]) if has_previous and results else None
+        )
+        return results
+
+    def get_position(self, file):
+        return file.upload_date, file.id
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def decode_cursor(self, request):
+        """Return the position and direction of the cursor in a request."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            querystring = b64decode(encoded.encode("ascii")).decode("ascii")
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            upload_date = parse_datetime(tokens["d"][0])
+            file_id = uuid.UUID(tokens["i"][0])
+            reverse = bool(int(tokens.get("r", ["0"])[0]))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if upload_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (upload_date, file_id), reverse
+
+    def encode_cursor(self, position, reverse):
+        upload_date, file_id = position
+        tokens = {"d": upload_date.isoformat(), "i": str(file_id)}
+        if reverse:
+            tokens["r"] = "1"
+        encoded = b64encode(parse.urlencode(tokens).encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
@@ -0,0 +1,112 @@
+import datetime
+import hashlib
+import hmac
+import threading
+from urllib.parse import quote, urlsplit
+
+ALGORITHM = "AWS4-HMAC-SHA256"
+# Ports left out of the Host header, as clients send it.
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def quote_query(value):
+    return quote(str(value), safe="-_.~")
+
+
+class S3Presigner:
+    """
+    Presigns S3 object URLs with SigV4 query parameters.
+
+    The URLs are the ones botocore's generate_presigned_url gives for a client
+    with a custom endpoint, which addresses buckets by path. botocore builds
+    a whole request through its event and serialization machinery for each
+    URL, while only a few HMACs are needed; the signing key they start from
+    changes once a day, so it is derived once per day and region.
+    """
+
+    def __init__(
+        self, access_key, secret_key, endpoint_url, region="us-east-1", token=None
+    ):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.token = token
+        endpoint = urlsplit(endpoint_url)
+        self.base_url = f"{endpoint.scheme}://{endpoint.netloc}"
+        self.host = endpoint.hostname
+        if endpoint.port and endpoint.port != DEFAULT_PORTS.get(endpoint.scheme):
+            self.host = f"{self.host}:{endpoint.port}"
+        self._signing_keys = {}
+        self._lock = threading.Lock()
+
+    def presign(self, method, bucket, key, expires_in, params=None, now=None) -> str:
+        """
+        Return a URL that allows method on key in bucket for expires_in
+        seconds. params are extra query parameters, such as uploadId and
+        partNumber for a multipart part, in the order they appear in the URL.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+
+        auth_params = {
+            "X-Amz-Algorithm": ALGORITHM,
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": expires_in,
+            "X-Amz-SignedHeaders": "host",
+        }
+        if self.token is not None:
+            auth_params["X-Amz-Security-Token"] = self.token
+        query = [
+            (quote_query(name), quote_query(value))
+            for name, value in [*(params or {}).items(), *auth_params.items()]
+        ]
+
+        path = f"/{bucket}/{quote(key, safe='/~')}"
+        canonical_request = "\n".join(
+            [
+                method,
+                path,
+                "&".join(f"{name}={value}" for name, value in sorted(query)),
+                f"host:{self.host}\n",
+                "host",
+                "UNSIGNED-PAYLOAD",
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                ALGORITHM,
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signature = hmac.new(
+            self.get_signing_key(amz_date[:8]),
+            string_to_sign.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+        query_string = "&".join(f"{name}={value}" for name, value in query)
+        return f"{self.base_url}{path}?{query_string}&X-Amz-Signature={signature}"
+
+    def get_signing_key(self, datestamp) -> bytes:
+        """Get the SigV4 signing key of a day (YYYYMMDD) in the region."""
+        signing_key = self._signing_keys.get(datestamp)
+        if signing_key is None:
+            signing_key = f"AWS4{self.secret_key}".encode()
+            for part in (datestamp, self.region, "s3", "aws4_request"):
+                signing_key = hmac.new(
+                    signing_key, part.encode(), hashlib.sha256
+                ).digest()
+            with self._lock:
+                # Keys of earlier days are not needed again.
+                self._signing_keys = {
+                    day: key
+                    for day, key in self._signing_keys.items()
+                    if day >= datestamp
+                }
+                self._signing_keys[datestamp] = signing_key
+        return signing_key
+
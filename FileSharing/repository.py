@@ -1,8 +1,44 @@
-from typing import Type
-from django.db import models
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from typing import Iterator, List, Optional, Tuple, Type
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 
-from .models import FileModel, FilePermissionModel
+from .cache import DownloadUrlCache, FileListingCache
+from .models import (
+    ContentBlobModel,
+    FileModel,
+    FileNameTrigramModel,
+    FilePermissionModel,
+    StorageUsageModel,
+    UploadPartModel,
+    UploadSessionModel,
+)
+from .utils import build_blob_key, build_object_key, build_trigrams
+
+
+# Permissions through which users see a file in their listing: files in the
+# trash are left out for everyone, owners included, though they still count
+# towards their owner's quota.
+VISIBLE_PERMISSIONS = Q(file__deleted_at__isnull=True)
+
+ReadableFile = namedtuple(
+    "ReadableFile", ["id", "original_filename", "size", "upload_date", "object_key"]
+)
 
 
 class ObjectNotFoundException(Exception):
@@ -40,6 +76,141 @@ class Repository:
         return self.model.objects.filter(**kwargs)
 
 
+class ContentBlobRepository(Repository):
+    """Repository for ContentBlob model."""
+
+    def __init__(self):
+        super().__init__(ContentBlobModel)
+
+    def exists(self, sha256) -> bool:
+        """Check if a blob with the given SHA-256 is stored."""
+        return self.filter(sha256=sha256).exists()
+
+    def acquire(
+        self, sha256, object_key, size
+    ) -> Tuple[ContentBlobModel, bool]:
+        """
+        Take a reference to the blob with the given SHA-256, creating it from
+        object_key if there is none yet. Return the blob and whether it was
+        created; when it was not, the caller's object at object_key is a
+        duplicate. Blobs without a SHA-256 are never shared.
+        """
+        if sha256 is not None:
+            blob = self._reference(sha256)
+            if blob is not None:
+                return blob, False
+        if object_key is None:
+            raise ObjectNotFoundException(
+                f"{self.model.__name__} not found for sha256={sha256}"
+            )
+        try:
+            with transaction.atomic():
+                return self.create(sha256=sha256, object_key=object_key, size=size), True
+        except IntegrityError:
+            # Another upload of the same content created it first.
+            blob = self._reference(sha256)
+            if blob is None:
+                raise
+            return blob, False
+
+    def acquire_many(self, contents) -> List[ContentBlobModel]:
+        """
+        Bulk version of acquire for a list of (sha256, object_key, size)
+        tuples. Return the blob holding each content, in order. Contents that
+        repeat an existing blob or an earlier item take a reference to it.
+        """
+        counts = Counter(sha256 for sha256, _, _ in contents)
+        with transaction.atomic():
+            # Locked so that release() cannot delete them before the update.
+            blobs = {
+                blob.sha256: blob
+                for blob in self.filter(sha256__in=counts).select_for_update()
+            }
+            if blobs:
+                self.filter(sha256__in=blobs).update(
+                    ref_count=F("ref_count")
+                    + Case(
+                        *[
+                            When(sha256=sha256, then=Value(counts[sha256]))
+                            for sha256 in blobs
+                        ],
+                        default=Value(0),
+                    )
+                )
+
+            new_blobs = {}
+            for sha256, object_key, size in contents:
+                if sha256 not in blobs and sha256 not in new_blobs:
+                    new_blobs[sha256] = self.model(
+                        sha256=sha256,
+                        object_key=object_key,
+                        size=size,
+                        ref_count=counts[sha256],
+                    )
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(new_blobs.values())
+            except IntegrityError:
+                # Another upload stored some of the same content first.
+                return [
+                    blobs[sha256]
+                    if sha256 in blobs
+                    else self.acquire(sha256, object_key, size)[0]
+                    for sha256, object_key, size in contents
+                ]
+            blobs.update(new_blobs)
+            if any(blob.pk is None for blob in new_blobs.values()):
+                # MySQL does not return primary keys from bulk_create.
+                blobs.update(
+                    (blob.sha256, blob)
+                    for blob in self.filter(sha256__in=new_blobs)
+                )
+        return [blobs[sha256] for sha256, _, _ in contents]
+
+    def release(self, blob) -> bool:
+        """
+        Drop a reference to a blob, deleting the row when it was the last one.
+        Return True if the blob is gone and its object should be deleted.
+        """
+        with transaction.atomic():
+            self.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+            deleted, _ = self.filter(pk=blob.pk, ref_count=0).delete()
+        return deleted > 0
+
+    def release_many(self, blob_ids) -> List[str]:
+        """
+        Bulk version of release for a list of blob ids, which may repeat.
+        Return the object keys of the blobs that are gone, whose objects
+        should be deleted.
+        """
+        counts = Counter(blob_ids)
+        if not counts:
+            return []
+        with transaction.atomic():
+            self.filter(pk__in=counts).update(
+                ref_count=F("ref_count")
+                - Case(
+                    *[When(pk=pk, then=Value(count)) for pk, count in counts.items()],
+                    default=Value(0),
+                )
+            )
+            # Locked so that no reference is taken before they are deleted.
+            released = dict(
+                self.filter(pk__in=counts, ref_count=0)
+                .select_for_update()
+                .values_list("pk", "object_key")
+            )
+            self.filter(pk__in=released, ref_count=0).delete()
+        return list(released.values())
+
+    def _reference(self, sha256) -> Optional[ContentBlobModel]:
+        # Incrementing first makes this atomic with respect to release(),
+        # which only deletes rows whose count already dropped to zero.
+        if self.filter(sha256=sha256).update(ref_count=F("ref_count") + 1):
+            return self.model.objects.get(sha256=sha256)
+        return None
+
+
 class FileRepository(Repository):
     """Repository for File model."""
 
@@ -47,26 +218,246 @@ class FileRepository(Repository):
         super().__init__(FileModel)
 
     def upload_file(self, validated_data, owner) -> FileModel:
-        """Upload a file."""
+        """Store a file streamed to S3 by S3MultipartUploadHandler."""
         file = validated_data.pop("file")
-        file_extension = file.name.split(".")[-1]
-        file_instance = FileModel.objects.create(
-            original_filename=file.name,
-            size=file.size,
-            file_extension=file_extension,
-            **validated_data,
+        file_instance = FileModel.objects.select_related("upload_session").get(
+            id=file.file_id
+        )
+        return self.finalize_upload(
+            file_instance, owner, sha256=file.sha256, size=file.size
+        )
+
+    def upload_files(self, uploaded_files, owner) -> List[FileModel]:
+        """
+        Store files streamed to S3 by S3BatchUploadHandler with one bulk
+        insert per table. Return the new files, in order.
+        """
+        blobs = ContentBlobRepository().acquire_many(
+            [(file.sha256, file.object_key, file.size) for file in uploaded_files]
+        )
+        file_instances = FileModel.objects.bulk_create(
+            [
+                FileModel(
+                    original_filename=file.name,
+                    size=file.size,
+                    file_extension=file.name.split(".")[-1],
+                    blob=blob,
+                    status="S",
+                )
+                for file, blob in zip(uploaded_files, blobs)
+            ]
         )
-        FilePermissionModel.objects.create(
-            file=file_instance, user=owner, permission="F"
+        FilePermissionModel.objects.bulk_create(
+            [
+                FilePermissionModel(file=file_instance, user=owner, permission="F")
+                for file_instance in file_instances
+            ]
         )
+        total_size = sum(file_instance.size for file_instance in file_instances)
+        StorageUsageRepository().add(
+            [owner.id], owned_bytes=total_size, visible_bytes=total_size
+        )
+        self.index_file_names(file_instances)
+        FileListingCache().invalidate([owner.id])
+        return file_instances
+
+    def create_pending_file(
+        self, original_filename, size, owner, expires_at, object_key=None
+    ) -> FileModel:
+        """Create a pending file and the upload session that will store it."""
+        if object_key is None:
+            object_key = build_blob_key(uuid.uuid4())
+        with transaction.atomic():
+            file_instance = FileModel.objects.create(
+                original_filename=original_filename,
+                size=size,
+                file_extension=original_filename.split(".")[-1],
+                status="P",
+            )
+            UploadSessionModel.objects.create(
+                file=file_instance,
+                user=owner,
+                object_key=object_key,
+                expires_at=expires_at,
+            )
         return file_instance
 
+    def finalize_upload(self, file, owner, sha256=None, size=None) -> FileModel:
+        """
+        Mark a pending file as stored and make the uploader its owner. The
+        file takes a reference to the blob with the given SHA-256, or to the
+        object its upload session wrote.
+        """
+        upload_session = file.upload_session
+        if size is not None:
+            file.size = size
+        blob, _ = ContentBlobRepository().acquire(
+            sha256=sha256,
+            object_key=upload_session.object_key or None,
+            size=file.size,
+        )
+        file.blob = blob
+        file.status = "S"
+        file.save(update_fields=["blob", "size", "status"])
+        FilePermissionModel.objects.create(file=file, user=owner, permission="F")
+        StorageUsageRepository().add(
+            [owner.id], owned_bytes=file.size, visible_bytes=file.size
+        )
+        self.index_file_names([file])
+        FileListingCache().invalidate([owner.id])
+        upload_session.delete()
+        return file
+
+    def mark_upload_failed(self, file) -> None:
+        """Mark a pending file as failed; reconcile_uploads cleans it up."""
+        FileModel.objects.filter(pk=file.pk, status="P").update(status="F")
+
+    def get_object_key(self, file) -> str:
+        """Get the S3 key holding the content of a file."""
+        if file.blob_id is not None:
+            return file.blob.object_key
+        owner = self.get_file_owner(file)
+        return build_object_key(owner.id, file.id, file.original_filename)
+
+    def get_readable_files(self, file_ids, user) -> list:
+        """
+        Get the files among file_ids that a user has permission to access,
+        in one query, as rows of id, original_filename, size, upload_date
+        and object_key, the key of the stored object.
+        """
+        owner_ids = FilePermissionModel.objects.filter(
+            file=OuterRef("file"), permission="F"
+        ).values("user_id")[:1]
+        rows = (
+            FilePermissionModel.objects.filter(
+                user=user, file_id__in=file_ids, file__deleted_at__isnull=True
+            )
+            .annotate(owner_id=Subquery(owner_ids, output_field=models.UUIDField()))
+            .values_list(
+                "file_id",
+                "file__original_filename",
+                "file__size",
+                "file__upload_date",
+                "file__blob__object_key",
+                "owner_id",
+            )
+        )
+        files = []
+        for file_id, filename, size, upload_date, object_key, owner_id in rows:
+            if object_key is None:
+                object_key = build_object_key(owner_id, file_id, filename)
+            files.append(ReadableFile(file_id, filename, size, upload_date, object_key))
+        return files
+
+    def get_object_keys_for_user(self, file_ids, user) -> dict:
+        """
+        Get the S3 keys holding the content of the files among file_ids that
+        a user has permission to access, by file id, in one query.
+        """
+        return {
+            file.id: file.object_key
+            for file in self.get_readable_files(file_ids, user)
+        }
+
     def get_all_files_for_user(self, user) -> models.QuerySet:
-        """Get all files for a user."""
-        file_ids = FilePermissionModel.objects.filter(user=user).values_list(
-            "file_id", flat=True
+        """
+        Get all files for a user outside the trash, each annotated with the
+        user's permission on it by the same JOIN that selects them.
+        """
+        return (
+            FileModel.objects.filter(
+                file_permissions__user=user, status="S", deleted_at__isnull=True
+            )
+            .annotate(permission=F("file_permissions__permission"))
+            .order_by("-upload_date", "-id")
+        )
+
+    def iterate_files_for_user(self, user, fields) -> Iterator:
+        """
+        Iterate over all files for a user as values_list rows of fields, in
+        the order of get_all_files_for_user. Rows are read in keyset batches
+        of FILE_EXPORT_BATCH_SIZE, since MySQL drivers hold the whole result
+        of a query in memory even when it is read with iterator(). fields
+        must include upload_date and id.
+        """
+        queryset = self.get_all_files_for_user(user).values_list(*fields, named=True)
+        batch_size = settings.FILE_EXPORT_BATCH_SIZE
+        batch = queryset
+        while True:
+            count = 0
+            for row in batch[:batch_size].iterator(chunk_size=batch_size):
+                count += 1
+                yield row
+            if count < batch_size:
+                return
+            batch = queryset.filter(
+                Q(upload_date__lt=row.upload_date)
+                | Q(upload_date=row.upload_date, id__lt=row.id)
+            )
+
+    def filter_files(
+        self,
+        queryset,
+        user,
+        search=None,
+        name_prefix=None,
+        file_extension=None,
+        min_size=None,
+        max_size=None,
+        uploaded_after=None,
+        uploaded_before=None,
+    ) -> models.QuerySet:
+        """
+        Narrow a queryset of a user's files down by name, extension, size and
+        upload date. search matches anywhere in the name: the user's files
+        holding all of its trigrams are found through the file_name_trigrams
+        index, and only those candidates are checked with LIKE.
+        """
+        if search:
+            trigrams = build_trigrams(search)
+            if trigrams:
+                # Only the user's rows are grouped, so common trigrams cost no
+                # more as other users add files.
+                candidates = (
+                    FileNameTrigramModel.objects.filter(
+                        trigram__in=trigrams,
+                        file__file_permissions__user=user,
+                        file__deleted_at__isnull=True,
+                    )
+                    .values("file_id")
+                    .annotate(matched=Count("trigram"))
+                    .filter(matched=len(trigrams))
+                    .values("file_id")
+                )
+                queryset = queryset.filter(id__in=candidates)
+            queryset = queryset.filter(original_filename__icontains=search)
+        if name_prefix:
+            queryset = queryset.filter(original_filename__istartswith=name_prefix)
+        if file_extension:
+            queryset = queryset.filter(file_extension__iexact=file_extension)
+        if min_size is not None:
+            queryset = queryset.filter(size__gte=min_size)
+        if max_size is not None:
+            queryset = queryset.filter(size__lte=max_size)
+        if uploaded_after is not None:
+            queryset = queryset.filter(upload_date__gte=uploaded_after)
+        if uploaded_before is not None:
+            queryset = queryset.filter(upload_date__lt=uploaded_before)
+        return queryset
+
+    def index_file_names(self, files) -> None:
+        """Record the name trigrams of files for filter_files."""
+        # Trigrams that differ only in ways the column's collation ignores
+        # are the same row there; the first one is kept.
+        FileNameTrigramModel.objects.bulk_create(
+            [
+                FileNameTrigramModel(file=file, trigram=trigram)
+                for file in files
+                for trigram in build_trigrams(file.original_filename)
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
         )
-        return FileModel.objects.filter(id__in=file_ids).order_by("-upload_date")
 
     def get_file_permission_for_user(self, file, user) -> str:
         """Get file permission for a user."""
@@ -81,27 +472,175 @@ class FileRepository(Repository):
         except ObjectDoesNotExist:
             return False
 
+    def annotate_is_shared(self, users, file) -> models.QuerySet:
+        """Annotate users with whether they have permission to access a file."""
+        return users.annotate(
+            is_shared=Exists(
+                FilePermissionModel.objects.filter(file=file, user=OuterRef("pk"))
+            )
+        )
+
     def grant_read_permission(self, file, user) -> FilePermissionModel:
         """Grant a specific permission to a user for a file."""
-        return FilePermissionModel.objects.create(file=file, user=user, permission="R")
+        permission = FilePermissionModel.objects.create(
+            file=file, user=user, permission="R"
+        )
+        StorageUsageRepository().add([user.id], visible_bytes=file.size)
+        FileListingCache().invalidate([user.id])
+        return permission
 
     def revoke_read_permission(self, file, user) -> None:
         """Revoke read permission of a user for a file."""
-        FilePermissionModel.objects.filter(
+        deleted, _ = FilePermissionModel.objects.filter(
             file=file, user=user, permission="R"
         ).delete()
+        if deleted:
+            StorageUsageRepository().add([user.id], visible_bytes=-file.size)
+            FileListingCache().invalidate([user.id])
+            DownloadUrlCache().invalidate(file.id, [user.id])
+
+    def get_files_with_ownership(self, file_ids, user) -> dict:
+        """
+        Get the files among file_ids outside the trash by id, in one query,
+        each annotated with is_owner, whether the user owns it.
+        """
+        files = self.filter(id__in=file_ids, deleted_at__isnull=True).annotate(
+            is_owner=Exists(
+                FilePermissionModel.objects.filter(
+                    file=OuterRef("pk"), user=user, permission="F"
+                )
+            )
+        )
+        return {file.id: file for file in files}
+
+    def get_trash_for_user(self, user) -> models.QuerySet:
+        """
+        Get the files a user owns that are in the trash, most recently
+        deleted first, annotated with the user's permission like
+        get_all_files_for_user.
+        """
+        return (
+            FileModel.objects.filter(
+                file_permissions__user=user,
+                file_permissions__permission="F",
+                deleted_at__isnull=False,
+            )
+            .annotate(permission=F("file_permissions__permission"))
+            .order_by("-deleted_at", "-id")
+        )
+
+    def trash_files(self, files) -> set:
+        """
+        Move files to the trash, returning the ids of those that were not
+        there already. They keep counting towards their owner's quota until
+        purge_trash deletes them, but are no longer visible to anyone, their
+        owner included.
+        """
+        return self._set_deleted_at(files, timezone.now())
+
+    def restore_files(self, files) -> set:
+        """
+        Take files out of the trash, returning the ids of those that were
+        still in it.
+        """
+        return self._set_deleted_at(files, None)
+
+    def get_expired_trash(self, before) -> models.QuerySet:
+        """
+        Get the files moved to the trash before a time, oldest first, with
+        their blobs, locked when read in a transaction so that they cannot
+        be restored while they are being purged.
+        """
+        return (
+            self.filter(deleted_at__lt=before)
+            .order_by("deleted_at")
+            .select_for_update()
+            .prefetch_related("blob")
+        )
 
-    def delete_file_from_db(self, file, file_permissions) -> None:
-        """Delete a file and its permissions from the database."""
-        file_permissions.delete()
-        file.delete()
+    def _set_deleted_at(self, files, deleted_at) -> set:
+        trashing = deleted_at is not None
+        with transaction.atomic():
+            # Locked so that files moved twice at once are only counted once.
+            file_sizes = dict(
+                self.filter(id__in=[file.id for file in files])
+                .filter(deleted_at__isnull=trashing)
+                .select_for_update()
+                .values_list("id", "size")
+            )
+            if not file_sizes:
+                return set()
+            self.filter(id__in=file_sizes).update(deleted_at=deleted_at)
+            permissions = list(
+                FilePermissionModel.objects.filter(file_id__in=file_sizes).values_list(
+                    "file_id", "user_id", "permission"
+                )
+            )
+            # Files are visible only outside the trash; owned_bytes is left
+            # alone, as the trash counts towards the quota.
+            visible_bytes = defaultdict(int)
+            for file_id, user_id, _ in permissions:
+                size = file_sizes[file_id]
+                visible_bytes[user_id] += -size if trashing else size
+            StorageUsageRepository().add_many({}, visible_bytes)
+        FileListingCache().invalidate({user_id for _, user_id, _ in permissions})
+        if trashing:
+            user_ids_by_file = defaultdict(list)
+            for file_id, user_id, _ in permissions:
+                user_ids_by_file[file_id].append(user_id)
+            DownloadUrlCache().invalidate_many(user_ids_by_file)
+        return set(file_sizes)
+
+    def delete_files_from_db(self, files) -> dict:
+        """
+        Delete files inside or outside the trash with their permissions,
+        releasing their content blobs. Return the object keys of the content nothing references any
+        more, with the ids of the deleted files whose content each held, for
+        the object storage to remove once the transaction commits.
+        """
+        files = {file.id: file for file in files}
+        if not files:
+            return {}
+        permissions = list(
+            FilePermissionModel.objects.filter(file_id__in=files).values_list(
+                "file_id", "user_id", "permission"
+            )
+        )
+        owned_bytes = defaultdict(int)
+        visible_bytes = defaultdict(int)
+        user_ids_by_file = defaultdict(list)
+        owner_ids = {}
+        for file_id, user_id, permission in permissions:
+            file = files[file_id]
+            if permission == "F":
+                owned_bytes[user_id] -= file.size
+                owner_ids[file_id] = user_id
+            if file.deleted_at is None:
+                # Nobody has seen it since it went to the trash.
+                visible_bytes[user_id] -= file.size
+            user_ids_by_file[file_id].append(user_id)
+        StorageUsageRepository().add_many(owned_bytes, visible_bytes)
+        FileListingCache().invalidate({user_id for _, user_id, _ in permissions})
+        DownloadUrlCache().invalidate_many(user_ids_by_file)
 
-    def delete_file_from_s3(self, s3_resource, bucket_name, file, user) -> None:
-        """Delete a file from S3."""
-        object_name = f"user_{user.id}/{file.id}_{file.original_filename}"
-        bucket = s3_resource.Bucket(bucket_name)
-        s3_object = bucket.Object(object_name)
-        s3_object.delete()
+        self.filter(id__in=files).delete()
+        released_keys = set(
+            ContentBlobRepository().release_many(
+                [file.blob_id for file in files.values() if file.blob_id is not None]
+            )
+        )
+        object_keys = defaultdict(list)
+        for file in files.values():
+            if file.blob_id is None:
+                object_key = build_object_key(
+                    owner_ids.get(file.id), file.id, file.original_filename
+                )
+            elif file.blob.object_key in released_keys:
+                object_key = file.blob.object_key
+            else:
+                continue
+            object_keys[object_key].append(file.id)
+        return dict(object_keys)
 
     def check_user_is_owner(self, file, user) -> bool:
         """Check if a user is the owner of a file."""
@@ -118,6 +657,159 @@ class FileRepository(Repository):
         return FilePermissionModel.objects.get(file=file, permission="F").user
 
 
+class UploadSessionRepository(Repository):
+    """Repository for UploadSession model."""
+
+    def __init__(self):
+        super().__init__(UploadSessionModel)
+
+    def record_part(
+        self, upload_session, part_number, etag, size, expires_at
+    ) -> UploadPartModel:
+        """Record a received part and keep the session alive."""
+        part, _ = UploadPartModel.objects.update_or_create(
+            session=upload_session,
+            part_number=part_number,
+            defaults={"etag": etag, "size": size},
+        )
+        upload_session.expires_at = expires_at
+        upload_session.save(update_fields=["expires_at"])
+        return part
+
+    def get_received_offset(self, upload_session) -> int:
+        """Get the number of contiguous bytes received from the start of the file."""
+        offset = 0
+        expected_part_number = 1
+        for part_number, size in upload_session.parts.values_list(
+            "part_number", "size"
+        ):
+            if part_number != expected_part_number:
+                break
+            offset += size
+            expected_part_number += 1
+        return offset
+
+    def get_stale_sessions(self, now) -> models.QuerySet:
+        """Get all sessions that expired before now or whose upload failed."""
+        return self.model.objects.filter(
+            Q(expires_at__lt=now) | Q(file__status="F")
+        ).select_related("file")
+
+    def discard(self, upload_session) -> None:
+        """Delete a session together with its pending file and parts."""
+        upload_session.file.delete()
+
+
+class StorageUsageRepository(Repository):
+    """Repository for StorageUsage model."""
+
+    def __init__(self):
+        super().__init__(StorageUsageModel)
+
+    def get_for_user(self, user) -> StorageUsageModel:
+        """Get the storage usage of a user; users without a record use nothing."""
+        usage = self.filter(user=user).first()
+        if usage is None:
+            return self.model(user=user)
+        return usage
+
+    def get_remaining_quota(self, user) -> Optional[int]:
+        """Get the bytes a user may still upload, or None without a quota."""
+        if settings.USER_STORAGE_QUOTA is None:
+            return None
+        owned_bytes = self.get_for_user(user).owned_bytes
+        return max(settings.USER_STORAGE_QUOTA - owned_bytes, 0)
+
+    def add(self, user_ids, owned_bytes=0, visible_bytes=0) -> None:
+        """Add to the usage of users, or take from it with negative sizes."""
+        if not user_ids or not (owned_bytes or visible_bytes):
+            return
+        self.model.objects.bulk_create(
+            [self.model(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        self.filter(user_id__in=user_ids).update(
+            owned_bytes=F("owned_bytes") + owned_bytes,
+            visible_bytes=F("visible_bytes") + visible_bytes,
+        )
+
+    def add_many(self, owned_bytes, visible_bytes) -> None:
+        """
+        Bulk version of add taking different sizes for each user, as dicts
+        of bytes by user id.
+        """
+        user_ids = set(owned_bytes) | set(visible_bytes)
+        if not user_ids:
+            return
+        self.model.objects.bulk_create(
+            [self.model(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        self.filter(user_id__in=user_ids).update(
+            owned_bytes=F("owned_bytes") + self._by_user(owned_bytes),
+            visible_bytes=F("visible_bytes") + self._by_user(visible_bytes),
+        )
+
+    def _by_user(self, sizes) -> Case:
+        return Case(
+            *[When(user_id=user_id, then=Value(sizes[user_id])) for user_id in sizes],
+            default=Value(0),
+            output_field=models.BigIntegerField(),
+        )
+
+    def calculate(self, user) -> Tuple[int, int]:
+        """Get the owned and visible bytes of a user from their stored files."""
+        stored = FilePermissionModel.objects.filter(user=user, file__status="S")
+        totals = stored.aggregate(
+            owned=Sum("file__size", filter=Q(permission="F")),
+            visible=Sum("file__size", filter=VISIBLE_PERMISSIONS),
+        )
+        return totals["owned"] or 0, totals["visible"] or 0
+
+    def reconcile(self) -> int:
+        """
+        Recalculate the usage of every user from their files and correct the
+        records that drifted. Return the number of records corrected.
+        """
+        stored = FilePermissionModel.objects.filter(file__status="S")
+        expected = {
+            user_id: (owned or 0, visible)
+            for user_id, owned, visible in stored.values("user_id")
+            .annotate(
+                owned=Sum("file__size", filter=Q(permission="F")),
+                visible=Sum("file__size", filter=VISIBLE_PERMISSIONS),
+            )
+            .values_list("user_id", "owned", "visible")
+        }
+        drifted = set()
+        for user_id, owned, visible in self.model.objects.values_list(
+            "user_id", "owned_bytes", "visible_bytes"
+        ).iterator():
+            if expected.pop(user_id, (0, 0)) != (owned, visible):
+                drifted.add(user_id)
+        drifted.update(
+            user_id for user_id, totals in expected.items() if totals != (0, 0)
+        )
+
+        corrected = 0
+        for user_id in drifted:
+            # Recalculated under the row lock, so concurrent add() calls are
+            # neither lost nor counted twice.
+            with transaction.atomic():
+                self.model.objects.bulk_create(
+                    [self.model(user_id=user_id)], ignore_conflicts=True
+                )
+                usage = self.model.objects.select_for_update().get(user_id=user_id)
+                owned, visible = self.calculate(usage.user_id)
+                if (usage.owned_bytes, usage.visible_bytes) != (owned, visible):
+                    usage.owned_bytes = owned
+                    usage.visible_bytes = visible
+                    usage.save(update_fields=["owned_bytes", "visible_bytes"])
+                    FileListingCache().invalidate([user_id])
+                    corrected += 1
+        return corrected
+
+
 class FilePermissionRepository(Repository):
     """Repository for FilePermission model."""
 
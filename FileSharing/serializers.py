@@ -1,9 +1,18 @@
 from rest_framework import serializers
 import datetime
+from django.conf import settings
 from accounts.models import UserModel
 from accounts.repository import UserRepository
 from filesharing.models import FileModel
-from .repository import FileRepository
+from .repository import (
+    ContentBlobRepository,
+    FileRepository,
+    StorageUsageRepository,
+)
+from .utils import has_blocked_extension
+
+
+MAX_UPLOAD_SIZE = 350 * 1024 * 1024  # 350MB size limit
 
 
 class FileUploadSerializer(serializers.Serializer):
@@ -12,32 +21,221 @@ class FileUploadSerializer(serializers.Serializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.file_repository = FileRepository()
+        self.content_blob_repository = ContentBlobRepository()
 
     def validate_file(self, value):
-        if value.size > 350 * 1024 * 1024:  # 350MB size limit
+        if value.size > MAX_UPLOAD_SIZE:
             raise serializers.ValidationError("File size should be less than 350MB")
+        # Content that was not written to S3 must match an existing blob.
+        if value.object_key is None and not self.content_blob_repository.exists(
+            value.sha256
+        ):
+            raise serializers.ValidationError(
+                "File content does not match X-Content-SHA256."
+            )
         return value
 
-    def file_path(self, file_id):
-        # get user id from context
-        user_id = self.context["user"].id
-        # get file name
-        original_filename = self.validated_data["file"].name
-        # return file path
-        return f"user_{user_id}/{file_id}_{original_filename}"
-
     def create(self, validated_data):
         owner = self.context["user"]
         new_file = self.file_repository.upload_file(validated_data, owner)
         return new_file
 
 
+class BeginUploadSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_repository = FileRepository()
+
+    def validate_filename(self, value):
+        if "/" in value or "\\" in value or value in [".", ".."]:
+            raise serializers.ValidationError("Invalid file name.")
+        if has_blocked_extension(value):
+            raise serializers.ValidationError(
+                "Files of this type cannot be uploaded."
+            )
+        return value
+
+    def validate_size(self, value):
+        if value > MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError("File size should be less than 350MB")
+        remaining_quota = StorageUsageRepository().get_remaining_quota(
+            self.context["user"]
+        )
+        if remaining_quota is not None and value > remaining_quota:
+            raise serializers.ValidationError("Storage quota exceeded")
+        return value
+
+    def create(self, validated_data):
+        return self.file_repository.create_pending_file(
+            original_filename=validated_data["filename"],
+            size=validated_data["size"],
+            owner=self.context["user"],
+            expires_at=self.context["expires_at"],
+        )
+
+
+class UploadedPartSerializer(serializers.Serializer):
+    part_number = serializers.IntegerField(min_value=1, max_value=10000)
+    etag = serializers.CharField()
+
+
+class CompleteUploadSerializer(serializers.Serializer):
+    parts = UploadedPartSerializer(many=True, required=False)
+
+    def validate_parts(self, value):
+        part_numbers = [part["part_number"] for part in value]
+        if part_numbers != sorted(set(part_numbers)):
+            raise serializers.ValidationError(
+                "Parts must be listed once each, in ascending order."
+            )
+        return value
+
+
+class BatchDownloadSerializer(serializers.Serializer):
+    # Ids are checked one by one by the view, which reports bad ones per id.
+    file_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_file_ids(self, value):
+        if len(value) > settings.MAX_BATCH_DOWNLOAD_FILES:
+            raise serializers.ValidationError(
+                f"No more than {settings.MAX_BATCH_DOWNLOAD_FILES} files can be "
+                "downloaded at once"
+            )
+        return list(dict.fromkeys(value))
+
+
+class BatchDeleteSerializer(serializers.Serializer):
+    # Ids are checked one by one by the view, which reports bad ones per id.
+    file_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_file_ids(self, value):
+        if len(value) > settings.MAX_BATCH_DELETE_FILES:
+            raise serializers.ValidationError(
+                f"No more than {settings.MAX_BATCH_DELETE_FILES} files can be "
+                "deleted at once"
+            )
+        return list(dict.fromkeys(value))
+
+
+class FileFilterSerializer(serializers.Serializer):
+    search = serializers.CharField(required=False, max_length=255)
+    name_prefix = serializers.CharField(required=False, max_length=255)
+    file_extension = serializers.CharField(required=False, max_length=20)
+    min_size = serializers.IntegerField(required=False, min_value=0)
+    max_size = serializers.IntegerField(required=False, min_value=0)
+    uploaded_after = serializers.DateTimeField(required=False)
+    uploaded_before = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get("min_size", 0) > attrs.get("max_size", float("inf")):
+            raise serializers.ValidationError(
+                "min_size must not be greater than max_size."
+            )
+        if (
+            "uploaded_after" in attrs
+            and "uploaded_before" in attrs
+            and attrs["uploaded_after"] > attrs["uploaded_before"]
+        ):
+            raise serializers.ValidationError(
+                "uploaded_after must not be later than uploaded_before."
+            )
+        return attrs
+
+
 class ListFilesSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileModel
         fields = "__all__"
 
 
+UPLOAD_DATE_FORMAT = "%I:%M%p, %d %b"
+
+# Upper bound, divisor and unit of each size range, smallest first.
+FILE_SIZE_UNITS = (
+    (1024, 1, "B"),
+    (1024**2, 1024, "KB"),
+    (1024**3, 1024**2, "MB"),
+    (None, 1024**3, "GB"),
+)
+
+# Columns serialize_file_rows reads, annotated with the caller's permission
+# by FileRepository.get_all_files_for_user.
+FILE_DATA_ROW_FIELDS = (
+    "id",
+    "original_filename",
+    "file_extension",
+    "size",
+    "upload_date",
+    "permission",
+)
+
+# Columns serialize_share_profile_rows reads, annotated by
+# FileRepository.annotate_is_shared.
+SHARE_PROFILE_ROW_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "photo",
+    "is_shared",
+)
+
+
+def format_file_size(size):
+    """Return size in B, KB, MB or GB and its unit; bytes stay an integer."""
+    for limit, divisor, unit in FILE_SIZE_UNITS:
+        if limit is None or size < limit:
+            break
+    if divisor == 1:
+        return size, unit
+    return (size / divisor).__format__(".0f"), unit
+
+
+def serialize_file_rows(rows) -> list:
+    """
+    Serialize values_list(*FILE_DATA_ROW_FIELDS, named=True) rows into the
+    same data FileDataSerializer gives for the files, without building model
+    instances or running serializer fields.
+    """
+    data = []
+    for row in rows:
+        size, unit = format_file_size(row.size)
+        data.append(
+            {
+                "id": str(row.id),
+                "original_filename": row.original_filename,
+                "file_extension": row.file_extension,
+                "size": size,
+                "upload_date": row.upload_date.strftime(UPLOAD_DATE_FORMAT),
+                "unit": unit,
+                "permission": row.permission,
+            }
+        )
+    return data
+
+
+def serialize_share_profile_rows(rows) -> list:
+    """
+    Serialize values_list(*SHARE_PROFILE_ROW_FIELDS, named=True) rows into
+    the same data ShareFileProfileSerializer gives for the users.
+    """
+    photo_storage = UserModel._meta.get_field("photo").storage
+    return [
+        {
+            "id": str(row.id),
+            "email": row.email,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "photo": photo_storage.url(row.photo) if row.photo else None,
+            "is_shared": row.is_shared,
+        }
+        for row in rows
+    ]
+
+
 class FileDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileModel
@@ -56,28 +254,27 @@ class FileDataSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         # 10:09pm, 10 Oct
-        data["upload_date"] = instance.upload_date.strftime("%I:%M%p, %d %b")
-        # size in B, KB, MB, or GB
-        size = instance.size
-        if size < 1024:
-            data["size"] = size
-            data["unit"] = "B"
-        elif size < 1024**2:
-            # with 2 decimal places
-            data["size"] = (size / 1024).__format__(".0f")
-            data["unit"] = "KB"
-        elif size < 1024**3:
-            data["size"] = (size / (1024**2)).__format__(".0f")
-            data["unit"] = "MB"
+        data["upload_date"] = instance.upload_date.strftime(UPLOAD_DATE_FORMAT)
+        data["size"], data["unit"] = format_file_size(instance.size)
+
+        # file permission, annotated by FileRepository.get_all_files_for_user
+        if hasattr(instance, "permission"):
+            data["permission"] = instance.permission
         else:
-            data["size"] = (size / (1024**3)).__format__(".0f")
-            data["unit"] = "GB"
+            data["permission"] = self.file_repository.get_file_permission_for_user(
+                file=instance, user=self.context["user"]
+            )
+
+        return data
 
-        # file permission
-        data["permission"] = self.file_repository.get_file_permission_for_user(
-            file=instance, user=self.context["user"]
-        )
 
+class TrashedFileSerializer(FileDataSerializer):
+    class Meta(FileDataSerializer.Meta):
+        fields = FileDataSerializer.Meta.fields + ["deleted_at"]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["deleted_at"] = instance.deleted_at.strftime(UPLOAD_DATE_FORMAT)
         return data
 
 
@@ -0,0 +1,404 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils._os import safe_join
+
+from .transfer import TransferEngine
+from .utils import S3ClientSingleton
+
+# Most keys S3 deletes in one multi-object delete request.
+S3_MAX_DELETE_KEYS = 1000
+# S3 error codes meaning the object or multipart upload does not exist.
+S3_MISSING_CODES = ["404", "NoSuchKey", "NoSuchUpload"]
+# S3 error codes meaning the parts given to complete a multipart upload do not
+# match the stored ones.
+S3_INVALID_PART_CODES = ["InvalidPart", "InvalidPartOrder", "EntityTooSmall"]
+
+MultipartUpload = namedtuple("MultipartUpload", ["key", "upload_id", "initiated"])
+
+
+class StorageError(Exception):
+    """Raised when the object storage fails an operation."""
+
+
+class ObjectMissing(StorageError):
+    """Raised when an object or multipart upload does not exist."""
+
+
+class InvalidParts(StorageError):
+    """Raised when the parts listed to complete an upload were not stored."""
+
+
+@contextlib.contextmanager
+def s3_errors():
+    """Raise S3 client errors as StorageError."""
+    try:
+        yield
+    except ClientError as e:
+        if e.response["Error"]["Code"] in S3_MISSING_CODES:
+            raise ObjectMissing(str(e)) from e
+        if e.response["Error"]["Code"] in S3_INVALID_PART_CODES:
+            raise InvalidParts(str(e)) from e
+        raise StorageError(str(e)) from e
+
+
+def get_object_storage():
+    """Return the object storage selected by FILE_STORAGE_BACKEND."""
+    if settings.FILE_STORAGE_BACKEND == "local":
+        return LocalObjectStorage()
+    return S3ObjectStorage()
+
+
+class S3ObjectStorage:
+    """Objects in the AWS_STORAGE_BUCKET_NAME bucket."""
+
+    local = False
+
+    def __init__(self):
+        self.client = S3ClientSingleton()
+        self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+    def open_transfer(self) -> TransferEngine:
+        """Start a TransferEngine, whose open_stream writes objects."""
+        return TransferEngine(client=self.client, bucket_name=self.bucket_name)
+
+    def open(self, key, byte_range=None):
+        """
+        Open an object, or the bytes byte_range=(first, last) of it, for
+        reading. Return a file object and the number of bytes it holds.
+        """
+        get_object_kwargs = {"Bucket": self.bucket_name, "Key": key}
+        if byte_range is not None:
+            get_object_kwargs["Range"] = "bytes={}-{}".format(*byte_range)
+        with s3_errors():
+            s3_object = self.client.get_object(**get_object_kwargs)
+        return s3_object["Body"], s3_object["ContentLength"]
+
+    def size(self, key) -> Optional[int]:
+        """Get the size of an object, or None if there is none."""
+        try:
+            with s3_errors():
+                return self.client.head_object(Bucket=self.bucket_name, Key=key)[
+                    "ContentLength"
+                ]
+        except ObjectMissing:
+            return None
+
+    def delete(self, key) -> None:
+        with s3_errors():
+            self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def delete_many(self, keys) -> dict:
+        """
+        Delete objects with multi-object deletes of up to S3_MAX_DELETE_KEYS
+        keys each. Return the error of each key that could not be deleted.
+        """
+        keys = list(keys)
+        errors = {}
+        for start in range(0, len(keys), S3_MAX_DELETE_KEYS):
+            batch = keys[start : start + S3_MAX_DELETE_KEYS]
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+            except ClientError as e:
+                errors.update(dict.fromkeys(batch, str(e)))
+                continue
+            for error in response.get("Errors", []):
+                errors[error["Key"]] = error.get("Message") or error.get("Code")
+        return errors
+
+    def create_multipart_upload(self, key) -> str:
+        """Start a multipart upload to key and return its id."""
+        with s3_errors():
+            return self.client.create_multipart_upload(
+                ACL="private", Bucket=self.bucket_name, Key=key
+            )["UploadId"]
+
+    def upload_part(self, key, upload_id, part_number, body) -> str:
+        """Store a part of a multipart upload and return its ETag."""
+        with s3_errors():
+            return self.client.upload_part(
+                Body=body,
+                Bucket=self.bucket_name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+            )["ETag"]
+
+    def complete_multipart_upload(self, key, upload_id, parts) -> None:
+        """
+        Join the parts, (part_number, etag) pairs, into the object. Raise
+        ObjectMissing if the upload is gone, and InvalidParts if a part was
+        not stored with that ETag.
+        """
+        with s3_errors():
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": etag, "PartNumber": part_number}
+                        for part_number, etag in parts
+                    ]
+                },
+            )
+
+    def abort_multipart_upload(self, key, upload_id) -> None:
+        """Drop a multipart upload and its parts, if it still exists."""
+        try:
+            with s3_errors():
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=key, UploadId=upload_id
+                )
+        except ObjectMissing:
+            pass
+
+    def list_multipart_uploads(self):
+        """Iterate over the unfinished multipart uploads, as MultipartUploads."""
+        paginator = self.client.get_paginator("list_multipart_uploads")
+        with s3_errors():
+            for page in paginator.paginate(Bucket=self.bucket_name):
+                for upload in page.get("Uploads", []):
+                    yield MultipartUpload(
+                        upload["Key"], upload["UploadId"], upload["Initiated"]
+                    )
+
+
+class LocalObjectStorage:
+    """
+    Objects stored at the path of their key under FILE_LOCAL_STORAGE_ROOT,
+    for deployments without S3. "accel" downloads have the web server send
+    them from there.
+
+    Objects are written under a temporary name in their directory and
+    renamed into place, so they are never read half-written. Multipart
+    uploads keep their parts in .uploads/<upload id>/ until they are joined.
+    """
+
+    local = True
+
+    def __init__(self):
+        self.root = settings.FILE_LOCAL_STORAGE_ROOT
+
+    def path(self, key) -> str:
+        """
+        Get the path of an object. Keys that would lead out of the root raise
+        SuspiciousFileOperation.
+        """
+        return safe_join(self.root, key)
+
+    def open_transfer(self):
+        return LocalTransfer(self)
+
+    def open(self, key, byte_range=None):
+        try:
+            file = open(self.path(key), "rb")
+        except FileNotFoundError as e:
+            raise ObjectMissing(str(e)) from e
+        if byte_range is None:
+            return file, os.fstat(file.fileno()).st_size
+        first, last = byte_range
+        return FileRange(file, first, last), last - first + 1
+
+    def size(self, key) -> Optional[int]:
+        try:
+            return os.stat(self.path(key)).st_size
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key) -> None:
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def delete_many(self, keys) -> dict:
+        errors = {}
+        for key in keys:
+            try:
+                self.delete(key)
+            except StorageError as e:
+                errors[key] = str(e)
+        return errors
+
+    def create_multipart_upload(self, key) -> str:
+        upload_id = uuid.uuid4().hex
+        directory = self._upload_directory(upload_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "key"), "w") as file:
+            file.write(key)
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, body) -> str:
+        directory = self._upload_directory(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectMissing(f"No multipart upload {upload_id}")
+        etag = hashlib.md5(body).hexdigest()
+        prefix = f"{part_number:05d}-"
+        with tempfile.NamedTemporaryFile(
+            dir=directory, prefix=".part-", delete=False
+        ) as temp:
+            temp.write(body)
+        # A part sent again replaces the earlier copy.
+        for name in os.listdir(directory):
+            if name.startswith(prefix):
+                os.unlink(os.path.join(directory, name))
+        os.replace(temp.name, os.path.join(directory, prefix + etag))
+        return f'"{etag}"'
+
+    def complete_multipart_upload(self, key, upload_id, parts) -> None:
+        directory = self._upload_directory(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectMissing(f"No multipart upload {upload_id}")
+        part_paths = []
+        for part_number, etag in parts:
+            etag = etag.strip('"')
+            part_path = os.path.join(directory, f"{part_number:05d}-{etag}")
+            if not os.path.exists(part_path):
+                raise InvalidParts(f"No part {part_number} with ETag {etag}")
+            part_paths.append(part_path)
+
+        with self._write(key) as file:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, file)
+        shutil.rmtree(directory)
+
+    def abort_multipart_upload(self, key, upload_id) -> None:
+        shutil.rmtree(self._upload_directory(upload_id), ignore_errors=True)
+
+    def list_multipart_uploads(self):
+        directory = os.path.join(self.root, ".uploads")
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                try:
+                    with open(os.path.join(entry.path, "key")) as file:
+                        key = file.read()
+                    initiated = entry.stat().st_mtime
+                except FileNotFoundError:
+                    # Completed or aborted meanwhile.
+                    continue
+                yield MultipartUpload(
+                    key, entry.name, datetime.fromtimestamp(initiated, timezone.utc)
+                )
+
+    @contextlib.contextmanager
+    def _write(self, key):
+        """Write an object under a temporary name, renamed into place at the end."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".upload-", delete=False
+        ) as temp:
+            try:
+                yield temp
+            except BaseException:
+                temp.close()
+                os.unlink(temp.name)
+                raise
+        os.replace(temp.name, path)
+
+    def _upload_directory(self, upload_id) -> str:
+        return safe_join(self.root, ".uploads", upload_id)
+
+
+class LocalTransfer:
+    """The LocalObjectStorage counterpart of a TransferEngine."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def open_stream(self, key):
+        """Start writing an object that is fed with write."""
+        return LocalStreamingUpload(self.storage.path(key))
+
+    def shutdown(self, cancel=False):
+        # Writes are done by the caller's thread; nothing is left running.
+        pass
+
+
+class LocalStreamingUpload:
+    """
+    A StreamingUpload into a local file. The data is written under a
+    temporary name and renamed into place once it is complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".upload-", delete=False
+        )
+        self._done = False
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        """Store the data written so far as the object."""
+        if not self._done:
+            self.file.close()
+            os.replace(self.file.name, self.path)
+            self._done = True
+
+    def finish(self):
+        self.close()
+
+    def done(self) -> bool:
+        return self._done
+
+    def cancel(self):
+        """Drop the data written so far; a stored object is kept."""
+        if not self._done:
+            self.file.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.file.name)
+            self._done = True
+
+
+class FileRange:
+    """
+    Bytes first to last of a file, read through read() or, by the WSGI
+    server's file wrapper, sent with sendfile from fileno() at the current
+    position for Content-Length bytes.
+    """
+
+    def __init__(self, file, first, last):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = last - first + 1
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,367 @@
+import io
+import os
+import tempfile
+import uuid
+import zipfile
+from unittest.mock import MagicMock, patch
+from django.contrib.auth import get_user_model
+from django.core.exceptions import SuspiciousFileOperation
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from ..downloads import (
+    RangeNotSatisfiable,
+    archive_name,
+    offload_object,
+    parse_byte_range,
+)
+from ..handlers import S3UploadedFile
+from ..models import ContentBlobModel
+from ..repository import FileRepository
+
+User = get_user_model()
+
+CONTENT = bytes(range(256)) * 4
+
+
+class ParseByteRangeTestCase(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_byte_range("bytes=0-99", 1024), (0, 99))
+        self.assertEqual(parse_byte_range("bytes=1000-", 1024), (1000, 1023))
+        self.assertEqual(parse_byte_range("bytes=1000-5000", 1024), (1000, 1023))
+        self.assertEqual(parse_byte_range("bytes=-24", 1024), (1000, 1023))
+        self.assertEqual(parse_byte_range("bytes=-5000", 1024), (0, 1023))
+
+    def test_ignored_headers(self):
+        headers = [None, "", "bytes=0-1,5-6", "items=0-1", "bytes=-", "bytes=5-1"]
+        for header in headers:
+            with self.subTest(header):
+                self.assertIsNone(parse_byte_range(header, 1024))
+
+    def test_unsatisfiable_ranges(self):
+        cases = [("bytes=1024-", 1024), ("bytes=-0", 1024), ("bytes=0-", 0)]
+        for header, size in cases:
+            with self.subTest(header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_byte_range(header, size)
+
+
+@override_settings(FILE_DOWNLOAD_MODE="proxy", FILE_PROXY_CHUNK_SIZE=100)
+class FileContentViewTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser",
+            email="testuser@x.com",
+            password="password",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file = FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None, "blobs/1", "a" * 64, "a b.bin", len(CONTENT), "", None
+                )
+            ],
+            self.user,
+        )[0]
+        self.url = reverse("file-content", args=[self.file.id])
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.get_object.side_effect = self.get_object
+
+    def get_object(self, Bucket, Key, Range=None):
+        first, last = 0, len(CONTENT) - 1
+        if Range is not None:
+            first, last = map(int, Range[len("bytes=") :].split("-"))
+        content = CONTENT[first : last + 1]
+        body = MagicMock(wraps=io.BytesIO(content))
+        return {"Body": body, "ContentLength": len(content)}
+
+    def test_download_url_points_to_the_proxy(self):
+        response = self.client.get(reverse("file-download", args=[self.file.id]))
+        self.assertEqual(response.json()["url"], f"http://testserver{self.url}")
+
+    def test_whole_file_is_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content), CONTENT)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["ETag"], f'"{"a" * 64}"')
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="a b.bin"'
+        )
+
+    def test_blobs_without_hash_are_tagged_by_file(self):
+        ContentBlobModel.objects.filter(pk=self.file.blob_id).update(sha256=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response["ETag"], f'"{self.file.id}"')
+
+    def test_malformed_ids_are_not_found(self):
+        response = self.client.get(reverse("file-content", args=["not-a-uuid"]))
+        self.assertEqual(response.status_code, 404)
+        self.s3_client.get_object.assert_not_called()
+
+    def test_range_is_served_partially(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1000-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            response["Content-Range"], f"bytes 1000-1023/{len(CONTENT)}"
+        )
+        self.assertEqual(response["Content-Length"], "24")
+        self.assertEqual(b"".join(response.streaming_content), CONTENT[1000:])
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"other"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), CONTENT)
+
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 206)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(CONTENT)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(CONTENT)}")
+        self.s3_client.get_object.assert_not_called()
+
+    async def test_content_is_streamed_asynchronously_under_asgi(self):
+        response = await AsyncClient().get(
+            self.url,
+            headers={
+                "Authorization": f"Bearer {AccessToken.for_user(self.user)}",
+                "Range": "bytes=0-249",
+            },
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, CONTENT[:250])
+
+
+class ArchiveNameTestCase(SimpleTestCase):
+
+    def test_names_are_sanitized_and_unique(self):
+        used_names = set()
+        names = [
+            archive_name(filename, used_names)
+            for filename in ["a.txt", "A.txt", "a.txt", "../b\\c.txt", " ", "a (1).txt"]
+        ]
+        self.assertEqual(
+            names,
+            ["a.txt", "A (1).txt", "a (2).txt", ".._b_c.txt", "file", "a (1) (1).txt"],
+        )
+
+
+class ArchiveDownloadViewTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser",
+            email="testuser@x.com",
+            password="password",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.contents = {"blobs/1": CONTENT, "blobs/2": b"", "blobs/3": b"third"}
+        self.files = FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None, key, key[-1] * 64, "same.txt", len(content), "", None
+                )
+                for key, content in self.contents.items()
+            ],
+            self.user,
+        )
+        self.url = reverse("file-download-archive")
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.get_object.side_effect = self.get_object
+        self.bodies = []
+
+    def get_object(self, Bucket, Key):
+        content = self.contents[Key]
+        body = MagicMock(wraps=io.BytesIO(content))
+        self.bodies.append(body)
+        return {"Body": body, "ContentLength": len(content)}
+
+    @override_settings(FILE_PROXY_CHUNK_SIZE=100)
+    def test_archive_is_streamed(self):
+        file_ids = [str(self.files[2].id), str(self.files[0].id), str(self.files[1].id)]
+        response = self.client.post(self.url, {"file_ids": file_ids}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/zip")
+
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), len(CONTENT) // 100)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(
+                archive.namelist(), ["same.txt", "same (1).txt", "same (2).txt"]
+            )
+            self.assertEqual(archive.read("same.txt"), b"third")
+            self.assertEqual(archive.read("same (1).txt"), CONTENT)
+            self.assertEqual(archive.read("same (2).txt"), b"")
+            self.assertIsNone(archive.testzip())
+        for body in self.bodies:
+            body.close.assert_called_once()
+
+    @override_settings(FILE_PROXY_CHUNK_SIZE=100)
+    def test_objects_are_closed_when_the_client_goes_away(self):
+        file_ids = [str(file.id) for file in self.files]
+        response = self.client.post(self.url, {"file_ids": file_ids}, format="json")
+        next(iter(response.streaming_content))
+        response.close()
+        # The second object may have been prefetched; no third was requested.
+        self.assertIn(len(self.bodies), [1, 2])
+        for body in self.bodies:
+            body.close.assert_called_once()
+
+    def test_missing_files_are_reported_before_streaming(self):
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        other_file = FileRepository().upload_files(
+            [S3UploadedFile(None, "blobs/9", "9" * 64, "x.txt", 1, "", None)], other
+        )[0]
+        missing_ids = [str(other_file.id), str(uuid.uuid4())]
+        response = self.client.post(
+            self.url,
+            {"file_ids": [str(self.files[0].id), *missing_ids]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["file_ids"], missing_ids)
+        self.s3_client.get_object.assert_not_called()
+
+    def test_invalid_ids_are_rejected(self):
+        response = self.client.post(
+            self.url, {"file_ids": [str(self.files[0].id), "nope"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["file_ids"], ["nope"])
+
+    async def test_archive_is_streamed_asynchronously_under_asgi(self):
+        response = await AsyncClient().post(
+            self.url,
+            {"file_ids": [str(file.id) for file in self.files]},
+            content_type="application/json",
+            headers={"Authorization": f"Bearer {AccessToken.for_user(self.user)}"},
+        )
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(archive.read("same (1).txt"), b"")
+
+
+class OffloadedDownloadTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser",
+            email="testuser@x.com",
+            password="password",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file = FileRepository().upload_files(
+            [S3UploadedFile(None, "blobs/1 é", "a" * 64, "a.bin", 3, "", None)],
+            self.user,
+        )[0]
+        self.url = reverse("file-content", args=[self.file.id])
+
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        self.root = storage.name
+        os.mkdir(os.path.join(self.root, "blobs"))
+        with open(os.path.join(self.root, "blobs", "1 é"), "wb") as f:
+            f.write(b"abc")
+
+        settings_override = override_settings(
+            FILE_DOWNLOAD_MODE="accel", FILE_LOCAL_STORAGE_ROOT=self.root
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_download_url_points_to_the_content_view(self):
+        response = self.client.get(reverse("file-download", args=[self.file.id]))
+        self.assertEqual(response.json()["url"], f"http://testserver{self.url}")
+
+    def test_file_is_sent_by_the_web_server(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-files/blobs/1%20%C3%A9"
+        )
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="a.bin"'
+        )
+        self.s3_client.get_object.assert_not_called()
+
+    @override_settings(FILE_ACCEL_HEADER="X-Sendfile")
+    def test_x_sendfile_gets_the_path(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response["X-Sendfile"], os.path.join(self.root, "blobs", "1 é")
+        )
+        self.assertFalse(response.has_header("X-Accel-Redirect"))
+
+    def test_permission_is_checked(self):
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.client.force_authenticate(other)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.has_header("X-Accel-Redirect"))
+
+    def test_keys_cannot_leave_the_storage_root(self):
+        with self.assertRaises(SuspiciousFileOperation):
+            offload_object("../etc/passwd", "passwd")
+
+    def test_archives_are_read_from_local_storage(self):
+        response = self.client.post(
+            reverse("file-download-archive"),
+            {"file_ids": [str(self.file.id)]},
+            format="json",
+        )
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(archive.read("a.bin"), b"abc")
+        self.s3_client.get_object.assert_not_called()
+
+    @override_settings(FILE_ACCEL_ZIP=True)
+    def test_archives_are_built_by_the_web_server(self):
+        response = self.client.post(
+            reverse("file-download-archive"),
+            {"file_ids": [str(self.file.id)]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Archive-Files"], "zip")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="files.zip"'
+        )
+        self.assertEqual(
+            response.content, b"- 3 /protected-files/blobs/1%20%C3%A9 a.bin\n"
+        )
+        self.s3_client.get_object.assert_not_called()
@@ -0,0 +1,258 @@
+import hashlib
+import threading
+from unittest.mock import MagicMock, patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.test import RequestFactory, TestCase, override_settings
+from ..handlers import (
+    MULTIPART_OVERHEAD,
+    BlockedFileType,
+    QuotaExceeded,
+    S3BatchUploadHandler,
+    S3MultipartUploadHandler,
+    S3UploadedFile,
+    UploadLimitHandler,
+    UploadTooLarge,
+)
+from ..models import ContentBlobModel, FileModel
+from ..repository import FileRepository
+
+User = get_user_model()
+
+MB = 1024 * 1024
+
+
+@override_settings(
+    S3_UPLOAD_MULTIPART_THRESHOLD=5 * MB,
+    S3_UPLOAD_PART_SIZE=5 * MB,
+    S3_UPLOAD_MAX_CONCURRENCY=2,
+)
+class S3MultipartUploadHandlerTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.request = RequestFactory().post("/files/upload/")
+        self.request.user = self.user
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+        self.s3_client.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+
+        self.handler = S3MultipartUploadHandler(self.request)
+
+    def start(self):
+        with self.assertRaises(StopFutureHandlers):
+            self.handler.new_file("file", "report.pdf", "application/pdf", None)
+
+    def send(self, *chunks):
+        self.start()
+        counter = 0
+        for chunk in chunks:
+            self.handler.receive_data_chunk(chunk, counter)
+            counter += len(chunk)
+        return self.handler.file_complete(counter)
+
+    def test_small_file_uses_single_put(self):
+        uploaded = self.send(b"hello")
+        self.assertIsInstance(uploaded, S3UploadedFile)
+        self.assertEqual(uploaded.size, 5)
+        self.assertEqual(uploaded.name, "report.pdf")
+        self.assertTrue(uploaded.object_key.startswith("blobs/"))
+        self.assertEqual(uploaded.sha256, hashlib.sha256(b"hello").hexdigest())
+        self.s3_client.put_object.assert_called_once()
+        self.s3_client.create_multipart_upload.assert_not_called()
+
+    def test_large_file_is_sent_in_parts(self):
+        uploaded = self.send(b"a" * 4 * MB, b"b" * 4 * MB, b"c" * 3 * MB)
+        self.assertEqual(uploaded.size, 11 * MB)
+        self.assertEqual(self.s3_client.upload_part.call_count, 3)
+        self.s3_client.complete_multipart_upload.assert_called_once()
+        parts = self.s3_client.complete_multipart_upload.call_args.kwargs[
+            "MultipartUpload"
+        ]["Parts"]
+        self.assertEqual(
+            parts,
+            [
+                {"ETag": "etag-1", "PartNumber": 1},
+                {"ETag": "etag-2", "PartNumber": 2},
+                {"ETag": "etag-3", "PartNumber": 3},
+            ],
+        )
+        self.s3_client.put_object.assert_not_called()
+
+    def test_other_fields_are_passed_through(self):
+        self.handler.new_file("avatar", "me.png", "image/png", None)
+        self.assertEqual(self.handler.receive_data_chunk(b"data", 0), b"data")
+        self.assertIsNone(self.handler.file_complete(4))
+
+    def test_interrupted_upload_is_aborted(self):
+        created = threading.Event()
+
+        def create_multipart_upload(**kwargs):
+            created.set()
+            return {"UploadId": "up-1"}
+
+        self.s3_client.create_multipart_upload.side_effect = create_multipart_upload
+        self.start()
+        self.handler.receive_data_chunk(b"a" * 11 * MB, 0)
+        self.assertTrue(created.wait(timeout=5))
+        self.handler.upload_interrupted()
+        self.s3_client.abort_multipart_upload.assert_called_once_with(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=self.handler.object_key,
+            UploadId="up-1",
+        )
+
+    def test_failed_part_aborts_upload(self):
+        self.s3_client.upload_part.side_effect = MagicMock(side_effect=OSError)
+        with self.assertRaises(OSError):
+            self.send(b"a" * 6 * MB, b"b" * 6 * MB)
+        self.s3_client.abort_multipart_upload.assert_called_once()
+        self.s3_client.complete_multipart_upload.assert_not_called()
+
+    def test_known_content_is_not_stored(self):
+        sha256 = hashlib.sha256(b"a" * 24).hexdigest()
+        ContentBlobModel.objects.create(sha256=sha256, object_key="blobs/1", size=24)
+        self.request.META["HTTP_X_CONTENT_SHA256"] = sha256
+        uploaded = self.send(b"a" * 12, b"a" * 12)
+        self.assertIsNone(uploaded.object_key)
+        self.assertEqual(uploaded.sha256, sha256)
+        self.s3_client.put_object.assert_not_called()
+        self.s3_client.create_multipart_upload.assert_not_called()
+        self.s3_client.upload_part.assert_not_called()
+
+    def test_pending_file_is_recorded_before_data_is_sent(self):
+        self.start()
+        self.addCleanup(self.handler.discard)
+        file = FileModel.objects.get()
+        self.assertEqual(file.status, "P")
+        self.assertEqual(file.original_filename, "report.pdf")
+        self.assertEqual(file.upload_session.object_key, self.handler.object_key)
+        self.s3_client.put_object.assert_not_called()
+
+    def test_discarded_upload_is_marked_failed(self):
+        self.send(b"hello")
+        self.handler.discard()
+        self.assertEqual(FileModel.objects.get().status, "F")
+        self.s3_client.delete_object.assert_called_once()
+
+
+@override_settings(
+    S3_UPLOAD_MULTIPART_THRESHOLD=5 * MB,
+    S3_UPLOAD_PART_SIZE=5 * MB,
+    S3_UPLOAD_MAX_CONCURRENCY=2,
+    MAX_BATCH_UPLOAD_FILES=2,
+)
+class S3BatchUploadHandlerTestCase(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().post("/files/upload/batch/")
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.handler = S3BatchUploadHandler(self.request)
+        self.addCleanup(self.handler.discard)
+
+    def send(self, file_name, *chunks):
+        with self.assertRaises(StopFutureHandlers):
+            self.handler.new_file("files", file_name, "text/plain", None)
+        counter = 0
+        for chunk in chunks:
+            self.assertIsNone(self.handler.receive_data_chunk(chunk, counter))
+            counter += len(chunk)
+        return self.handler.file_complete(counter)
+
+    def test_files_are_stored_concurrently(self):
+        self.send("a.txt", b"aaa")
+        self.send("b.txt", b"bb")
+        uploads = self.handler.wait()
+        self.assertEqual([upload.name for upload in uploads], ["a.txt", "b.txt"])
+        self.assertEqual([upload.error for upload in uploads], [None, None])
+        self.assertEqual(
+            uploads[0].uploaded_file.sha256, hashlib.sha256(b"aaa").hexdigest()
+        )
+        self.assertEqual(self.s3_client.put_object.call_count, 2)
+        self.assertEqual(
+            {call.kwargs["Key"] for call in self.s3_client.put_object.call_args_list},
+            {upload.object_key for upload in uploads},
+        )
+
+    def test_files_over_the_limit_are_rejected(self):
+        self.send("a.txt", b"a")
+        self.send("b.txt", b"b")
+        self.send("c.txt", b"c")
+        uploads = self.handler.wait()
+        self.assertIsNone(uploads[1].error)
+        self.assertEqual(
+            uploads[2].error, "No more than 2 files can be uploaded at once"
+        )
+        self.assertEqual(self.s3_client.put_object.call_count, 2)
+
+    def test_failed_transfer_is_reported_per_file(self):
+        self.s3_client.put_object.side_effect = [OSError("boom"), {}]
+        self.send("a.txt", b"a")
+        self.send("b.txt", b"b")
+        uploads = self.handler.wait()
+        self.assertEqual(
+            sorted(upload.error is None for upload in uploads), [False, True]
+        )
+
+    def test_discard_deletes_stored_objects(self):
+        self.send("a.txt", b"a")
+        uploads = self.handler.wait()
+        self.handler.discard()
+        self.s3_client.delete_objects.assert_called_once_with(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Delete={"Objects": [{"Key": uploads[0].object_key}], "Quiet": True},
+        )
+
+
+@override_settings(USER_STORAGE_QUOTA=100, BLOCKED_UPLOAD_EXTENSIONS=["EXE"])
+class UploadLimitHandlerTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.request = RequestFactory().post("/files/upload/")
+        self.request.user = self.user
+        self.handler = UploadLimitHandler(self.request, max_file_size=50)
+
+    def start(self, content_length, file_name="report.pdf"):
+        self.handler.handle_raw_input(None, {}, content_length, b"boundary")
+        self.handler.new_file("file", file_name, "application/pdf", None)
+
+    def test_content_length_over_quota_is_rejected_before_reading(self):
+        FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None, "blobs/1", "a" * 64, "old.pdf", 90, "application/pdf", None
+                )
+            ],
+            self.user,
+        )
+        with self.assertRaises(QuotaExceeded):
+            self.handler.handle_raw_input(
+                None, {}, 10 + MULTIPART_OVERHEAD + 1, b"boundary"
+            )
+
+    def test_upload_is_stopped_when_file_gets_too_large(self):
+        self.start(content_length=1000)
+        self.assertEqual(self.handler.receive_data_chunk(b"a" * 50, 0), b"a" * 50)
+        with self.assertRaises(UploadTooLarge):
+            self.handler.receive_data_chunk(b"a", 50)
+
+    def test_upload_is_stopped_when_quota_is_crossed(self):
+        self.handler.max_file_size = None
+        self.start(content_length=1000)
+        self.handler.receive_data_chunk(b"a" * 60, 0)
+        self.handler.new_file("file", "second.pdf", "application/pdf", None)
+        with self.assertRaises(QuotaExceeded):
+            self.handler.receive_data_chunk(b"a" * 41, 0)
+
+    def test_blocked_extension_is_rejected(self):
+        with self.assertRaises(BlockedFileType):
+            self.start(content_length=10, file_name="setup.exe")
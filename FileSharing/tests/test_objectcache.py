@@ -0,0 +1,223 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import FileResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from ..handlers import S3UploadedFile
+from ..objectcache import ObjectDiskCache
+from ..repository import FileRepository
+
+User = get_user_model()
+
+CONTENT = bytes(range(256)) * 4
+
+
+def wait_for_fills():
+    for thread in threading.enumerate():
+        if thread.name == "object-cache-fill":
+            thread.join(5)
+
+
+def get_object(Bucket, Key):
+    body = MagicMock(wraps=io.BytesIO(CONTENT))
+    return {"Body": body, "ContentLength": len(CONTENT)}
+
+
+class ObjectDiskCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(
+            OBJECT_CACHE_DIR=self.directory,
+            OBJECT_CACHE_MAX_SIZE=3 * len(CONTENT),
+            OBJECT_CACHE_MAX_OBJECT_SIZE=len(CONTENT),
+            FILE_PROXY_CHUNK_SIZE=100,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.get_object.side_effect = get_object
+
+    def read(self, object_key, sent_size=len(CONTENT)):
+        with ObjectDiskCache().open(object_key, len(CONTENT), sent_size) as file:
+            content = b"".join(iter(lambda: file.read(100), b""))
+        wait_for_fills()
+        return content
+
+    def test_objects_are_fetched_once(self):
+        self.assertEqual(self.read("blobs/1"), CONTENT)
+        self.assertEqual(self.read("blobs/1", 10), CONTENT)
+        self.s3_client.get_object.assert_called_once()
+
+        stats = ObjectDiskCache().get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertEqual(stats["bytes_saved"], 10)
+        self.assertEqual(stats["objects"], 1)
+        self.assertEqual(stats["size"], len(CONTENT))
+
+    def test_least_recently_used_objects_are_evicted(self):
+        for number in range(3):
+            self.read(f"blobs/{number}")
+            path = ObjectDiskCache()._path(f"blobs/{number}")
+            os.utime(path, (time.time() - 100 + number, time.time() - 100 + number))
+        # Reading blobs/0 makes blobs/1 the least recently used.
+        self.read("blobs/0")
+        self.read("blobs/3")
+
+        self.s3_client.get_object.reset_mock()
+        for number in [0, 2, 3]:
+            self.read(f"blobs/{number}")
+        self.s3_client.get_object.assert_not_called()
+        self.read("blobs/1")
+        self.s3_client.get_object.assert_called_once()
+
+    def test_concurrent_misses_fetch_once(self):
+        def slow_get_object(**kwargs):
+            time.sleep(0.2)
+            return get_object(**kwargs)
+
+        self.s3_client.get_object.side_effect = slow_get_object
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            contents = list(executor.map(lambda _: self.read("blobs/1"), range(8)))
+        self.assertEqual(contents, [CONTENT] * 8)
+        self.s3_client.get_object.assert_called_once()
+        self.assertEqual(ObjectDiskCache().get_stats()["hits"], 7)
+
+    def test_failed_fetch_leaves_nothing_behind(self):
+        self.s3_client.get_object.side_effect = OSError("connection reset")
+        with self.assertRaises(OSError):
+            self.read("blobs/1")
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_first_reader_does_not_wait_for_the_whole_object(self):
+        resume = threading.Event()
+        chunks = iter([CONTENT[:100], None, b""])
+
+        def read(size):
+            chunk = next(chunks)
+            if chunk is None:
+                # The rest arrives only once the first chunk was served.
+                resume.wait(5)
+                return CONTENT[100:]
+            return chunk
+
+        body = MagicMock()
+        body.read.side_effect = read
+        self.s3_client.get_object.side_effect = None
+        self.s3_client.get_object.return_value = {
+            "Body": body,
+            "ContentLength": len(CONTENT),
+        }
+
+        with ObjectDiskCache().open("blobs/1", len(CONTENT)) as file:
+            self.assertEqual(file.read(100), CONTENT[:100])
+            resume.set()
+            self.assertEqual(file.read(), CONTENT[100:])
+        wait_for_fills()
+        self.assertEqual(self.read("blobs/1"), CONTENT)
+        self.s3_client.get_object.assert_called_once()
+
+    def test_readers_of_a_failed_fetch_fail(self):
+        body = MagicMock()
+        body.read.side_effect = [CONTENT[:100], OSError("connection reset")]
+        self.s3_client.get_object.side_effect = None
+        self.s3_client.get_object.return_value = {
+            "Body": body,
+            "ContentLength": len(CONTENT),
+        }
+
+        with ObjectDiskCache().open("blobs/1", len(CONTENT)) as file:
+            self.assertEqual(file.read(100), CONTENT[:100])
+            with self.assertRaises(OSError):
+                file.read(100)
+        wait_for_fills()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_abandoned_fills_are_fetched_again(self):
+        path = ObjectDiskCache()._path("blobs/1")
+        fill_path = os.path.join(self.directory, ".fill-" + os.path.basename(path))
+        with open(fill_path, "wb") as f:
+            f.write(CONTENT[:10])
+        self.assertEqual(self.read("blobs/1"), CONTENT)
+        self.s3_client.get_object.assert_called_once()
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+
+    def test_large_objects_are_not_cached(self):
+        self.assertTrue(ObjectDiskCache().can_cache(len(CONTENT)))
+        self.assertFalse(ObjectDiskCache().can_cache(len(CONTENT) + 1))
+        with override_settings(OBJECT_CACHE_DIR=None):
+            self.assertFalse(ObjectDiskCache().can_cache(0))
+
+
+@override_settings(FILE_DOWNLOAD_MODE="proxy", FILE_PROXY_CHUNK_SIZE=100)
+class CachedFileContentViewTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(OBJECT_CACHE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            username="testuser",
+            email="testuser@x.com",
+            password="password",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file = FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None, "blobs/1", "a" * 64, "a.bin", len(CONTENT), "", None
+                )
+            ],
+            self.user,
+        )[0]
+        self.url = reverse("file-content", args=[self.file.id])
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.get_object.side_effect = get_object
+
+    def test_files_are_served_from_the_cache(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), CONTENT)
+        self.assertEqual(response["Content-Length"], str(len(CONTENT)))
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="a.bin"'
+        )
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=250-")
+        self.assertEqual(response.status_code, 206)
+        # Hits go to the WSGI server's file wrapper, which can use sendfile.
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response["Content-Length"], str(len(CONTENT) - 250))
+        self.assertEqual(response["Content-Range"], f"bytes 250-1023/{len(CONTENT)}")
+        self.assertEqual(b"".join(response.streaming_content), CONTENT[250:])
+        self.s3_client.get_object.assert_called_once()
+
+        admin = User.objects.create_superuser("admin", "admin@x.com", "password")
+        self.client.force_authenticate(admin)
+        stats = self.client.get(reverse("file-download-cache-stats")).json()
+        self.assertEqual(stats["bytes_saved"], len(CONTENT) - 250)
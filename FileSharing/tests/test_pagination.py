@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..handlers import S3UploadedFile
+from ..models import FileModel
+from ..repository import FileRepository
+
+User = get_user_model()
+
+
+class FileCursorPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        files = FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None, f"blobs/{i}", f"{i:064x}", f"{i}.txt", 10, "text/plain", None
+                )
+                for i in range(40)
+            ],
+            self.user,
+        )
+        # Pairs of files share an upload date to exercise the id tiebreak.
+        now = timezone.now()
+        for i, file in enumerate(files):
+            FileModel.objects.filter(pk=file.pk).update(
+                upload_date=now - timezone.timedelta(minutes=i // 2)
+            )
+        self.expected = list(
+            FileModel.objects.order_by("-upload_date", "-id").values_list(
+                "id", flat=True
+            )
+        )
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, data):
+        return [file["id"] for file in data["files"]]
+
+    def test_pages_walk_forward_and_back(self):
+        first = self.fetch(reverse("filedata-list") + "?pagination=cursor")
+        self.assertIsNone(first["previous"])
+        self.assertIsNone(first["count"])
+        second = self.fetch(first["next"])
+        third = self.fetch(second["next"])
+        self.assertIsNone(third["next"])
+        self.assertEqual(
+            self.ids(first) + self.ids(second) + self.ids(third),
+            [str(file_id) for file_id in self.expected],
+        )
+        self.assertEqual(self.ids(self.fetch(third["previous"])), self.ids(second))
+        self.assertEqual(self.ids(self.fetch(second["previous"])), self.ids(first))
+        self.assertEqual(first["total_size"], 400)
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        url = reverse("filedata-list") + "?pagination=cursor"
+        with CaptureQueriesContext(connection) as first_page:
+            data = self.fetch(url)
+        with CaptureQueriesContext(connection) as second_page:
+            self.fetch(data["next"])
+        self.assertEqual(len(second_page), len(first_page))
+        for query in second_page.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"])
+            self.assertNotIn("OFFSET", query["sql"])
+
+    def test_count_on_request(self):
+        data = self.fetch(reverse("filedata-list") + "?pagination=cursor&count=true")
+        self.assertEqual(data["count"], 40)
+
+    def test_trashed_files_are_left_out_of_the_total(self):
+        trashed = FileModel.objects.get(pk=self.expected[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            FileRepository().trash_files([trashed])
+        data = self.fetch(reverse("filedata-list") + "?pagination=cursor&count=true")
+        self.assertEqual(data["count"], 39)
+        self.assertEqual(data["total_size"], 390)
+        self.assertNotIn(str(trashed.id), self.ids(data))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("filedata-list") + "?cursor=nonsense")
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,94 @@
+import datetime
+import hmac
+from unittest.mock import patch
+import boto3
+from botocore.config import Config
+from django.test import SimpleTestCase
+from ..presign import S3Presigner
+
+NOW = datetime.datetime(2024, 5, 31, 23, 59, 58)
+KEYS = [
+    "blobs/3f2a9c",
+    "user_1/a b+c~é=&?.txt",
+    "/leading//slashes",
+    "user_1/%20*!'()[]",
+]
+
+
+class S3PresignerTestCase(SimpleTestCase):
+
+    def presign_with_botocore(self, endpoint_url, region, operation, params):
+        client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id="AKID",
+            aws_secret_access_key="se/cr+et",
+            config=Config(signature_version="s3v4"),
+        )
+        with patch("botocore.auth.datetime") as mock_datetime:
+            mock_datetime.datetime.utcnow.return_value = NOW
+            return client.generate_presigned_url(
+                operation, Params=params, ExpiresIn=300
+            )
+
+    def presign(self, endpoint_url, region, method, key, params=None):
+        presigner = S3Presigner("AKID", "se/cr+et", endpoint_url, region)
+        return presigner.presign(
+            method,
+            "bucket",
+            key,
+            300,
+            params=params,
+            now=NOW.replace(tzinfo=datetime.timezone.utc),
+        )
+
+    def test_urls_match_botocore(self):
+        for endpoint_url in ["http://localhost:9000", "https://s3.example.com:443"]:
+            for region in ["us-east-1", "eu-west-1"]:
+                for key in KEYS:
+                    with self.subTest(endpoint_url, region=region, key=key):
+                        params = {"Bucket": "bucket", "Key": key}
+                        self.assertEqual(
+                            self.presign(endpoint_url, region, "GET", key),
+                            self.presign_with_botocore(
+                                endpoint_url, region, "get_object", params
+                            ),
+                        )
+                        self.assertEqual(
+                            self.presign(endpoint_url, region, "PUT", key),
+                            self.presign_with_botocore(
+                                endpoint_url, region, "put_object", params
+                            ),
+                        )
+
+    def test_part_urls_match_botocore(self):
+        url = self.presign(
+            "http://localhost:9000",
+            "us-east-1",
+            "PUT",
+            "blobs/1",
+            params={"uploadId": "up+1/=", "partNumber": 7},
+        )
+        expected = self.presign_with_botocore(
+            "http://localhost:9000",
+            "us-east-1",
+            "upload_part",
+            {
+                "Bucket": "bucket",
+                "Key": "blobs/1",
+                "UploadId": "up+1/=",
+                "PartNumber": 7,
+            },
+        )
+        self.assertEqual(url, expected)
+
+    def test_signing_key_is_derived_once_a_day(self):
+        presigner = S3Presigner("AKID", "secret", "http://localhost:9000")
+        with patch("filesharing.presign.hmac.new", wraps=hmac.new) as new:
+            presigner.presign("GET", "bucket", "a", 300, now=NOW)
+            presigner.presign("GET", "bucket", "b", 300, now=NOW)
+            # Four HMACs derive the key, then one signs each URL.
+            self.assertEqual(new.call_count, 6)
+            presigner.presign("GET", "bucket", "c", 300, now=NOW.replace(day=30))
+            self.assertEqual(new.call_count, 11)
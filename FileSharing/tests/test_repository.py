@@ -0,0 +1,462 @@
+from io import StringIO
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ..handlers import S3UploadedFile
+from ..models import (
+    ContentBlobModel,
+    FileModel,
+    FilePermissionModel,
+    StorageUsageModel,
+    UploadSessionModel,
+)
+from ..repository import (
+    ContentBlobRepository,
+    FileRepository,
+    ObjectNotFoundException,
+    StorageUsageRepository,
+    UploadSessionRepository,
+)
+from ..utils import build_object_key
+
+User = get_user_model()
+
+
+class PendingUploadTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.file_repository = FileRepository()
+        self.file = self.file_repository.create_pending_file(
+            original_filename="report.pdf",
+            size=1024,
+            owner=self.user,
+            expires_at=timezone.now() + timezone.timedelta(hours=1),
+        )
+
+    def test_pending_file_has_upload_session(self):
+        self.assertEqual(self.file.status, "P")
+        self.assertEqual(self.file.file_extension, "pdf")
+        self.assertTrue(self.file.upload_session.object_key.startswith("blobs/"))
+
+    def test_pending_file_is_not_listed(self):
+        self.assertFalse(self.file_repository.get_all_files_for_user(self.user).exists())
+
+    def test_finalize_upload(self):
+        self.file_repository.finalize_upload(self.file, self.user)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.status, "S")
+        self.assertTrue(self.file_repository.check_user_is_owner(self.file, self.user))
+        self.assertFalse(UploadSessionModel.objects.filter(file=self.file).exists())
+        self.assertIsNone(self.file.blob.sha256)
+        self.assertEqual(
+            list(self.file_repository.get_all_files_for_user(self.user)), [self.file]
+        )
+
+
+class UploadSessionRepositoryTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.expires_at = timezone.now() + timezone.timedelta(hours=1)
+        file = FileRepository().create_pending_file(
+            original_filename="big.bin",
+            size=25,
+            owner=self.user,
+            expires_at=self.expires_at,
+        )
+        self.upload_session = file.upload_session
+        self.repository = UploadSessionRepository()
+
+    def record(self, part_number, size):
+        self.repository.record_part(
+            self.upload_session,
+            part_number=part_number,
+            etag=f"etag-{part_number}",
+            size=size,
+            expires_at=self.expires_at,
+        )
+
+    def test_offset_counts_contiguous_parts_only(self):
+        self.assertEqual(self.repository.get_received_offset(self.upload_session), 0)
+        self.record(2, 10)
+        self.assertEqual(self.repository.get_received_offset(self.upload_session), 0)
+        self.record(1, 10)
+        self.assertEqual(self.repository.get_received_offset(self.upload_session), 20)
+
+    def test_reuploaded_part_replaces_etag(self):
+        self.record(1, 10)
+        self.repository.record_part(
+            self.upload_session,
+            part_number=1,
+            etag="etag-new",
+            size=10,
+            expires_at=self.expires_at,
+        )
+        self.assertEqual(
+            list(self.upload_session.parts.values_list("etag", flat=True)),
+            ["etag-new"],
+        )
+
+    def test_failed_sessions_are_stale(self):
+        FileRepository().mark_upload_failed(self.upload_session.file)
+        self.assertEqual(
+            list(self.repository.get_stale_sessions(timezone.now())),
+            [self.upload_session],
+        )
+
+    def test_stale_sessions_are_discarded_with_their_file(self):
+        later = timezone.now() + timezone.timedelta(hours=2)
+        stale = list(self.repository.get_stale_sessions(later))
+        self.assertEqual(stale, [self.upload_session])
+        self.repository.discard(stale[0])
+        self.assertFalse(FileModel.objects.exists())
+
+
+class ContentBlobRepositoryTestCase(TestCase):
+
+    def setUp(self):
+        self.repository = ContentBlobRepository()
+        self.blob, self.created = self.repository.acquire(
+            sha256="a" * 64, object_key="blobs/1", size=10
+        )
+
+    def test_first_upload_creates_blob(self):
+        self.assertTrue(self.created)
+        self.assertEqual(self.blob.ref_count, 1)
+
+    def test_same_content_shares_blob(self):
+        blob, created = self.repository.acquire(
+            sha256="a" * 64, object_key="blobs/2", size=10
+        )
+        self.assertFalse(created)
+        self.assertEqual(blob.pk, self.blob.pk)
+        self.assertEqual(blob.object_key, "blobs/1")
+        self.assertEqual(blob.ref_count, 2)
+
+    def test_blob_is_deleted_with_last_reference(self):
+        self.repository.acquire(sha256="a" * 64, object_key=None, size=10)
+        self.assertFalse(self.repository.release(self.blob))
+        self.assertTrue(self.repository.release(self.blob))
+        self.assertFalse(ContentBlobModel.objects.exists())
+
+    def test_unknown_content_without_object_fails(self):
+        with self.assertRaises(ObjectNotFoundException):
+            self.repository.acquire(sha256="b" * 64, object_key=None, size=10)
+
+    def test_acquire_many_shares_known_and_repeated_content(self):
+        blobs = self.repository.acquire_many(
+            [
+                ("a" * 64, "blobs/2", 10),
+                ("b" * 64, "blobs/3", 20),
+                ("b" * 64, "blobs/4", 20),
+            ]
+        )
+        self.assertEqual(
+            [blob.object_key for blob in blobs], ["blobs/1", "blobs/3", "blobs/3"]
+        )
+        self.assertEqual(ContentBlobModel.objects.get(pk=self.blob.pk).ref_count, 2)
+        self.assertEqual(blobs[1].ref_count, 2)
+
+
+class UploadFilesTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.file_repository = FileRepository()
+
+    def uploaded_file(self, name, sha256, object_key, size=10):
+        return S3UploadedFile(
+            file_id=None,
+            object_key=object_key,
+            sha256=sha256,
+            name=name,
+            size=size,
+            content_type="text/plain",
+            charset=None,
+        )
+
+    def test_upload_files_in_bulk(self):
+        # Savepoints, one lookup and one insert per table and the usage
+        # update, whatever the number of files.
+        with self.assertNumQueries(11):
+            files = self.file_repository.upload_files(
+                [
+                    self.uploaded_file("a.txt", "a" * 64, "blobs/1"),
+                    self.uploaded_file("b.pdf", "b" * 64, "blobs/2"),
+                    self.uploaded_file("c.txt", "a" * 64, "blobs/3"),
+                ],
+                self.user,
+            )
+        self.assertEqual(
+            [file.original_filename for file in files], ["a.txt", "b.pdf", "c.txt"]
+        )
+        self.assertEqual(files[1].file_extension, "pdf")
+        self.assertEqual(files[2].blob.object_key, "blobs/1")
+        self.assertEqual(
+            set(self.file_repository.get_all_files_for_user(self.user)), set(files)
+        )
+        self.assertEqual(
+            FilePermissionModel.objects.filter(user=self.user, permission="F").count(),
+            3,
+        )
+
+
+class StorageUsageRepositoryTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@x.com", password="password"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@x.com", password="password"
+        )
+        self.file_repository = FileRepository()
+        self.repository = StorageUsageRepository()
+        self.file = self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, "blobs/1", "a" * 64, "a.txt", 100, "text/plain", None
+                )
+            ],
+            self.owner,
+        )[0]
+
+    def usage(self, user):
+        usage = self.repository.get_for_user(user)
+        return usage.owned_bytes, usage.visible_bytes
+
+    def test_upload_counts_for_owner(self):
+        self.assertEqual(self.usage(self.owner), (100, 100))
+        self.assertEqual(self.usage(self.reader), (0, 0))
+
+    def test_sharing_counts_as_visible_only(self):
+        self.file_repository.grant_read_permission(self.file, self.reader)
+        self.assertEqual(self.usage(self.reader), (0, 100))
+        self.file_repository.revoke_read_permission(self.file, self.reader)
+        self.file_repository.revoke_read_permission(self.file, self.reader)
+        self.assertEqual(self.usage(self.reader), (0, 0))
+
+    def test_delete_releases_usage_of_everyone(self):
+        self.file_repository.grant_read_permission(self.file, self.reader)
+        self.file_repository.delete_files_from_db([self.file])
+        self.assertEqual(self.usage(self.owner), (0, 0))
+        self.assertEqual(self.usage(self.reader), (0, 0))
+
+    def test_trash_counts_towards_the_quota_only(self):
+        self.file_repository.grant_read_permission(self.file, self.reader)
+        self.file_repository.trash_files([self.file])
+        self.assertEqual(self.usage(self.owner), (100, 0))
+        self.assertEqual(self.usage(self.reader), (0, 0))
+        self.assertEqual(self.repository.calculate(self.owner), (100, 0))
+
+        self.file_repository.restore_files([self.file])
+        self.assertEqual(self.usage(self.owner), (100, 100))
+        self.assertEqual(self.usage(self.reader), (0, 100))
+
+        self.file_repository.trash_files([self.file])
+        trashed = FileModel.objects.select_related("blob").get(pk=self.file.pk)
+        self.file_repository.delete_files_from_db([trashed])
+        self.assertEqual(self.usage(self.owner), (0, 0))
+        self.assertEqual(self.usage(self.reader), (0, 0))
+        self.assertEqual(self.repository.reconcile(), 0)
+
+    @override_settings(USER_STORAGE_QUOTA=150)
+    def test_remaining_quota(self):
+        self.assertEqual(self.repository.get_remaining_quota(self.owner), 50)
+        with override_settings(USER_STORAGE_QUOTA=None):
+            self.assertIsNone(self.repository.get_remaining_quota(self.owner))
+
+    def test_reconcile_corrects_drift(self):
+        FilePermissionModel.objects.create(
+            file=self.file, user=self.reader, permission="R"
+        )
+        StorageUsageModel.objects.filter(user=self.owner).update(owned_bytes=7)
+        self.assertEqual(self.repository.reconcile(), 2)
+        self.assertEqual(self.usage(self.owner), (100, 100))
+        self.assertEqual(self.usage(self.reader), (0, 100))
+        self.assertEqual(self.repository.reconcile(), 0)
+
+
+class FilterFilesTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.file_repository = FileRepository()
+        self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, f"blobs/{name}", name * 4, name, size, "text/plain", None
+                )
+                for name, size in [
+                    ("Quarterly Report.pdf", 300),
+                    ("report-draft.docx", 200),
+                    ("holiday.JPG", 5000),
+                    ("ab", 1),
+                ]
+            ],
+            self.user,
+        )
+
+    def names(self, **filters):
+        queryset = self.file_repository.filter_files(
+            self.file_repository.get_all_files_for_user(self.user),
+            self.user,
+            **filters,
+        )
+        return sorted(file.original_filename for file in queryset)
+
+    def test_names_are_indexed(self):
+        file = FileModel.objects.get(original_filename="holiday.JPG")
+        self.assertIn("jpg", set(file.name_trigrams.values_list("trigram", flat=True)))
+
+    def test_search_matches_substrings_case_insensitively(self):
+        self.assertEqual(
+            self.names(search="REPORT"), ["Quarterly Report.pdf", "report-draft.docx"]
+        )
+        self.assertEqual(self.names(search="rt d"), [])
+        self.assertEqual(self.names(search="b"), ["ab"])
+
+    def test_search_uses_trigram_index(self):
+        queryset = self.file_repository.filter_files(
+            self.file_repository.get_all_files_for_user(self.user),
+            self.user,
+            search="report",
+        )
+        self.assertIn("file_name_trigrams", str(queryset.query))
+
+    def test_search_candidates_are_limited_to_the_user(self):
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.file_repository.upload_files(
+            [S3UploadedFile(None, "blobs/o", "o" * 64, "report.txt", 1, "", None)],
+            other,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.names(search="report")), 2)
+        subquery = queries[0]["sql"].split("file_name_trigrams", 1)[1]
+        self.assertIn("file_permissions", subquery)
+
+    def test_names_differing_in_accents_are_indexed(self):
+        self.file_repository.upload_files(
+            [S3UploadedFile(None, "blobs/c", "c" * 64, "café cafe.txt", 1, "", None)],
+            self.user,
+        )
+        file = FileModel.objects.get(original_filename="café cafe.txt")
+        self.assertIn("afe", set(file.name_trigrams.values_list("trigram", flat=True)))
+        # Rows that already exist, as equal trigrams do under MySQL's
+        # accent-insensitive collation, are skipped.
+        self.file_repository.index_file_names([file])
+        self.assertEqual(self.names(search="café"), ["café cafe.txt"])
+
+    def test_prefix_extension_and_size(self):
+        self.assertEqual(self.names(name_prefix="rep"), ["report-draft.docx"])
+        self.assertEqual(self.names(file_extension="jpg"), ["holiday.JPG"])
+        self.assertEqual(
+            self.names(min_size=200, max_size=300),
+            ["Quarterly Report.pdf", "report-draft.docx"],
+        )
+
+    def test_upload_date_range(self):
+        now = timezone.now()
+        self.assertEqual(len(self.names(uploaded_after=now - timezone.timedelta(1))), 4)
+        self.assertEqual(self.names(uploaded_before=now - timezone.timedelta(1)), [])
+
+
+class PurgeTrashTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@x.com", password="password"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@x.com", password="password"
+        )
+        self.file_repository = FileRepository()
+        # The last two files have the same content, stored once.
+        self.files = self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, f"blobs/{i}", sha256 * 64, f"{i}.txt", 10, "", None
+                )
+                for i, sha256 in enumerate("abcc")
+            ],
+            self.owner,
+        )
+        self.file_repository.grant_read_permission(self.files[0], self.reader)
+        self.legacy = FileModel.objects.create(
+            original_filename="old.txt", size=10, file_extension="txt"
+        )
+        FilePermissionModel.objects.create(
+            file=self.legacy, user=self.owner, permission="F"
+        )
+        StorageUsageRepository().add([self.owner.id], owned_bytes=10, visible_bytes=10)
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.delete_objects.return_value = {}
+
+    def trash(self, files, days_ago):
+        self.file_repository.trash_files(files)
+        FileModel.objects.filter(id__in=[file.id for file in files]).update(
+            deleted_at=timezone.now() - timezone.timedelta(days=days_ago)
+        )
+
+    def purge(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("purge_trash", batch_size=2, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def deleted_keys(self):
+        return {
+            item["Key"]
+            for call in self.s3_client.delete_objects.call_args_list
+            for item in call.kwargs["Delete"]["Objects"]
+        }
+
+    def usage(self, user):
+        usage = StorageUsageRepository().get_for_user(user)
+        return usage.owned_bytes, usage.visible_bytes
+
+    @override_settings(FILE_TRASH_RETENTION=30 * 24 * 60 * 60)
+    def test_expired_files_are_purged_in_batches(self):
+        self.trash([*self.files[:3], self.legacy], days_ago=31)
+        self.trash([self.files[3]], days_ago=1)
+        stdout, _ = self.purge()
+        self.assertIn("Purged 4 files", stdout)
+        self.assertEqual(self.s3_client.delete_objects.call_count, 2)
+
+        # blobs/3 still holds the content of the file trashed recently.
+        self.assertEqual(
+            self.deleted_keys(),
+            {
+                "blobs/0",
+                "blobs/1",
+                build_object_key(self.owner.id, self.legacy.id, "old.txt"),
+            },
+        )
+        self.assertEqual(list(FileModel.objects.all()), [self.files[3]])
+        self.assertEqual(
+            list(ContentBlobModel.objects.values_list("object_key", flat=True)),
+            ["blobs/2"],
+        )
+        # The file left in the trash still counts towards the quota only.
+        self.assertEqual(self.usage(self.owner), (10, 0))
+        self.assertEqual(self.usage(self.reader), (0, 0))
+        self.assertEqual(StorageUsageRepository().reconcile(), 0)
+
+    def test_storage_errors_are_reported(self):
+        self.trash([self.files[0]], days_ago=31)
+        self.s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "blobs/0", "Code": "AccessDenied", "Message": "Denied"}]
+        }
+        stdout, stderr = self.purge()
+        self.assertEqual(stderr, "blobs/0: Denied\n")
+        self.assertIn("1 could not be deleted", stdout)
+        self.assertFalse(FileModel.objects.filter(id=self.files[0].id).exists())
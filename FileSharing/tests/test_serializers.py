@@ -0,0 +1,72 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from ..handlers import S3UploadedFile
+from ..repository import FileRepository
+from ..serializers import (
+    FILE_DATA_ROW_FIELDS,
+    SHARE_PROFILE_ROW_FIELDS,
+    FileDataSerializer,
+    ShareFileProfileSerializer,
+    serialize_file_rows,
+    serialize_share_profile_rows,
+)
+
+User = get_user_model()
+
+
+class RowSerializationTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.file_repository = FileRepository()
+        self.files = self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None,
+                    f"blobs/{i}",
+                    f"{i}" * 64,
+                    f"{i}.txt",
+                    size,
+                    "text/plain",
+                    None,
+                )
+                for i, size in enumerate(
+                    [0, 1023, 1024, 1536 * 1024, 5 * 1024**2, 1536 * 1024**2]
+                )
+            ],
+            self.user,
+        )
+
+    def test_file_rows_match_file_data_serializer(self):
+        queryset = self.file_repository.get_all_files_for_user(self.user)
+        expected = JSONRenderer().render(
+            FileDataSerializer(queryset, many=True, context={"user": self.user}).data
+        )
+        rows = queryset.values_list(*FILE_DATA_ROW_FIELDS, named=True)
+        self.assertEqual(JSONRenderer().render(serialize_file_rows(rows)), expected)
+
+    def test_share_profile_rows_match_share_file_profile_serializer(self):
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password", is_active=True
+        )
+        User.objects.create_user(
+            username="nophoto", email="nophoto@x.com", photo="", is_active=True
+        )
+        self.file_repository.grant_read_permission(self.files[0], other)
+        users = self.file_repository.annotate_is_shared(
+            User.objects.filter(is_active=True).order_by("username"), self.files[0]
+        )
+        storage = User._meta.get_field("photo").storage
+        with patch.object(storage, "url", side_effect=lambda name: f"/{name}"):
+            expected = JSONRenderer().render(
+                ShareFileProfileSerializer(
+                    users, many=True, context={"file": self.files[0]}
+                ).data
+            )
+            rows = users.values_list(*SHARE_PROFILE_ROW_FIELDS, named=True)
+            actual = JSONRenderer().render(serialize_share_profile_rows(rows))
+        self.assertEqual(actual, expected)
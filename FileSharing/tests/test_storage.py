@@ -0,0 +1,165 @@
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from ..handlers import S3UploadedFile
+from ..repository import FileRepository
+from ..storage import (
+    InvalidParts,
+    LocalObjectStorage,
+    ObjectMissing,
+    S3ObjectStorage,
+)
+
+User = get_user_model()
+
+
+class S3ObjectStorageTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_objects_are_deleted_in_batches(self):
+        self.s3_client.delete_objects.side_effect = [
+            {"Errors": [{"Key": "k3", "Code": "AccessDenied", "Message": "Denied"}]},
+            ClientError({"Error": {"Code": "SlowDown"}}, "DeleteObjects"),
+            {},
+        ]
+        keys = [f"k{i}" for i in range(2500)]
+        errors = S3ObjectStorage().delete_many(keys)
+
+        batches = [
+            [item["Key"] for item in call.kwargs["Delete"]["Objects"]]
+            for call in self.s3_client.delete_objects.call_args_list
+        ]
+        self.assertEqual(batches, [keys[:1000], keys[1000:2000], keys[2000:]])
+        self.assertEqual(len(errors), 1001)
+        self.assertEqual(errors["k3"], "Denied")
+        self.assertIn("SlowDown", errors["k1000"])
+
+    def test_missing_objects_have_no_size(self):
+        self.s3_client.head_object.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        self.assertIsNone(S3ObjectStorage().size("blobs/1"))
+
+
+class LocalObjectStorageTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings_override = override_settings(FILE_LOCAL_STORAGE_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = LocalObjectStorage()
+
+    def read(self, key, byte_range=None):
+        body, size = self.storage.open(key, byte_range)
+        with body:
+            content = body.read()
+        self.assertEqual(len(content), size)
+        return content
+
+    def test_streamed_objects_appear_when_finished(self):
+        stream = self.storage.open_transfer().open_stream("blobs/1")
+        stream.write(b"hello ")
+        stream.write(b"world")
+        self.assertIsNone(self.storage.size("blobs/1"))
+        stream.finish()
+        self.assertTrue(stream.done())
+        self.assertEqual(self.read("blobs/1"), b"hello world")
+        self.assertEqual(self.read("blobs/1", (6, 9)), b"worl")
+
+    def test_cancelled_streams_leave_nothing_behind(self):
+        stream = self.storage.open_transfer().open_stream("blobs/1")
+        stream.write(b"hello")
+        stream.cancel()
+        self.assertEqual(os.listdir(os.path.join(self.root, "blobs")), [])
+        with self.assertRaises(ObjectMissing):
+            self.storage.open("blobs/1")
+
+    def test_multipart_uploads_are_joined_in_order(self):
+        upload_id = self.storage.create_multipart_upload("blobs/1")
+        etag_2 = self.storage.upload_part("blobs/1", upload_id, 2, b"world")
+        self.storage.upload_part("blobs/1", upload_id, 1, b"bye ")
+        # A part sent again replaces the first copy.
+        etag_1 = self.storage.upload_part("blobs/1", upload_id, 1, b"hello ")
+        self.assertEqual(
+            [upload.key for upload in self.storage.list_multipart_uploads()],
+            ["blobs/1"],
+        )
+
+        with self.assertRaises(InvalidParts):
+            self.storage.complete_multipart_upload(
+                "blobs/1", upload_id, [(1, etag_1), (2, '"0"')]
+            )
+        self.storage.complete_multipart_upload(
+            "blobs/1", upload_id, [(1, etag_1), (2, etag_2)]
+        )
+        self.assertEqual(self.read("blobs/1"), b"hello world")
+        self.assertEqual(list(self.storage.list_multipart_uploads()), [])
+
+    def test_aborted_uploads_are_dropped(self):
+        upload_id = self.storage.create_multipart_upload("blobs/1")
+        self.storage.upload_part("blobs/1", upload_id, 1, b"hello")
+        self.storage.abort_multipart_upload("blobs/1", upload_id)
+        self.storage.abort_multipart_upload("blobs/1", upload_id)
+        self.assertEqual(list(self.storage.list_multipart_uploads()), [])
+        with self.assertRaises(ObjectMissing):
+            self.storage.upload_part("blobs/1", upload_id, 2, b"world")
+
+    def test_deletes_skip_missing_objects(self):
+        stream = self.storage.open_transfer().open_stream("blobs/1")
+        stream.finish()
+        self.assertEqual(self.storage.delete_many(["blobs/1", "blobs/2"]), {})
+        self.assertIsNone(self.storage.size("blobs/1"))
+
+
+class LocalStorageCommandsTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            FILE_STORAGE_BACKEND="local",
+            FILE_LOCAL_STORAGE_ROOT=directory.name,
+            FILE_TRASH_RETENTION=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = LocalObjectStorage()
+        self.user = User.objects.create_user(username="testuser", password="password")
+
+    def test_purged_files_are_deleted_from_disk(self):
+        stream = self.storage.open_transfer().open_stream("blobs/1")
+        stream.write(b"hello")
+        stream.finish()
+        file_repository = FileRepository()
+        file = file_repository.upload_files(
+            [S3UploadedFile(None, "blobs/1", "a" * 64, "a.txt", 5, "", None)],
+            self.user,
+        )[0]
+        file_repository.trash_files([file])
+
+        call_command("purge_trash", stdout=StringIO())
+        self.assertIsNone(self.storage.size("blobs/1"))
+
+    def test_orphaned_multipart_uploads_are_aborted(self):
+        upload_id = self.storage.create_multipart_upload("blobs/1")
+        self.storage.upload_part("blobs/1", upload_id, 1, b"hello")
+        old = (timezone.now() - timezone.timedelta(days=2)).timestamp()
+        os.utime(os.path.join(self.storage.root, ".uploads", upload_id), (old, old))
+
+        stdout = StringIO()
+        call_command("reconcile_uploads", stdout=stdout, stderr=StringIO())
+        self.assertIn("aborted 1 orphaned", stdout.getvalue())
+        self.assertEqual(list(self.storage.list_multipart_uploads()), [])
@@ -0,0 +1,51 @@
+import threading
+from django.test import SimpleTestCase
+from ..transfer import UploadPipe
+
+
+class UploadPipeTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.pipe = UploadPipe(max_buffer_size=4)
+        self.writer_errors = []
+
+    def write_in_background(self, *chunks, close=True):
+        def writer():
+            try:
+                for chunk in chunks:
+                    self.pipe.write(chunk)
+            except BrokenPipeError as exc:
+                self.writer_errors.append(exc)
+            if close:
+                self.pipe.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def test_read_blocks_until_size_is_available(self):
+        self.write_in_background(b"abc", b"defgh", b"ij")
+        self.assertEqual(self.pipe.read(6), b"abcdef")
+        self.assertEqual(self.pipe.read(6), b"ghij")
+        self.assertEqual(self.pipe.read(6), b"")
+
+    def test_writer_is_bounded_by_buffer_size(self):
+        thread = self.write_in_background(b"x" * 10)
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(self.pipe.read(), b"x" * 10)
+
+    def test_abort_fails_both_sides(self):
+        thread = self.write_in_background(b"x" * 10, close=False)
+        self.pipe.abort()
+        thread.join(5)
+        self.assertEqual(len(self.writer_errors), 1)
+        with self.assertRaises(BrokenPipeError):
+            self.pipe.read(1)
+        with self.assertRaises(BrokenPipeError):
+            self.pipe.write(b"y")
+
+    def test_pipe_is_not_seekable(self):
+        self.assertTrue(self.pipe.readable())
+        self.assertFalse(self.pipe.seekable())
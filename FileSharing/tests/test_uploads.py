@@ -0,0 +1,372 @@
+import hashlib
+import os
+import tempfile
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from ..models import ContentBlobModel, FileModel, StorageUsageModel, UploadSessionModel
+from ..storage import LocalObjectStorage
+
+User = get_user_model()
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code}}, "Operation")
+
+
+@override_settings(
+    S3_PRESIGNED_MULTIPART_THRESHOLD=10, S3_UPLOAD_PART_SIZE=5, USER_STORAGE_QUOTA=100
+)
+class DirectUploadViewsTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+        patcher = patch("filesharing.views.S3PresignerSingleton")
+        self.presigner = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.presigner.presign.return_value = "https://s3/put"
+
+    def begin(self, filename="a.txt", size=12):
+        return self.client.post(
+            reverse("upload-begin"), {"filename": filename, "size": size}, format="json"
+        )
+
+    def complete(self, file_id, parts=None):
+        data = {} if parts is None else {"parts": parts}
+        return self.client.post(
+            reverse("upload-complete", args=[file_id]), data, format="json"
+        )
+
+    def usage(self):
+        usage = StorageUsageModel.objects.filter(user=self.user).first()
+        return (usage.owned_bytes, usage.visible_bytes) if usage else (0, 0)
+
+    def test_small_files_get_one_url(self):
+        response = self.begin(size=10)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["url"], "https://s3/put")
+        self.assertNotIn("parts", response.json())
+        self.s3_client.create_multipart_upload.assert_not_called()
+
+    def test_large_files_get_one_url_per_part(self):
+        response = self.begin(size=12)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["part_size"], 5)
+        self.assertEqual(
+            [part["part_number"] for part in response.json()["parts"]], [1, 2, 3]
+        )
+        self.assertEqual(UploadSessionModel.objects.get().upload_id, "up-1")
+
+    @override_settings(FILE_STORAGE_BACKEND="local")
+    def test_begin_is_refused_with_local_storage(self):
+        response = self.begin()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FileModel.objects.exists())
+
+    def test_begin_is_refused_over_the_quota(self):
+        response = self.begin(size=101)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["size"], ["Storage quota exceeded"])
+        self.assertFalse(FileModel.objects.exists())
+
+    @override_settings(BLOCKED_UPLOAD_EXTENSIONS=["exe"])
+    def test_begin_is_refused_for_blocked_extensions(self):
+        response = self.begin(filename="setup.EXE")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("filename", response.json())
+        self.assertFalse(FileModel.objects.exists())
+
+    def test_completed_upload_is_stored(self):
+        file_id = self.begin().json()["file_id"]
+        self.assertEqual(FileModel.objects.get().status, "P")
+        self.assertEqual(self.usage(), (0, 0))
+        self.s3_client.head_object.return_value = {"ContentLength": 12}
+
+        parts = [{"part_number": n, "etag": f'"{n}"'} for n in [1, 2, 3]]
+        response = self.complete(file_id, parts)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["file_id"], file_id)
+        self.assertEqual(
+            self.s3_client.complete_multipart_upload.call_args.kwargs[
+                "MultipartUpload"
+            ],
+            {"Parts": [{"ETag": f'"{n}"', "PartNumber": n} for n in [1, 2, 3]]},
+        )
+        self.assertEqual(FileModel.objects.get().status, "S")
+        self.assertFalse(UploadSessionModel.objects.exists())
+        self.assertEqual(self.usage(), (12, 12))
+
+    def test_multipart_completion_needs_parts(self):
+        file_id = self.begin().json()["file_id"]
+        response = self.complete(file_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("parts", response.json())
+        response = self.complete(
+            file_id,
+            [{"part_number": 2, "etag": "a"}, {"part_number": 1, "etag": "b"}],
+        )
+        self.assertEqual(response.status_code, 400)
+        self.s3_client.complete_multipart_upload.assert_not_called()
+
+    def test_mismatched_parts_are_rejected(self):
+        file_id = self.begin().json()["file_id"]
+        self.s3_client.complete_multipart_upload.side_effect = client_error(
+            "InvalidPart"
+        )
+        response = self.complete(file_id, [{"part_number": 1, "etag": '"x"'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["message"], "Parts do not match the uploaded parts"
+        )
+        self.assertEqual(FileModel.objects.get().status, "P")
+
+    def test_aborted_upload_is_a_conflict(self):
+        file_id = self.begin().json()["file_id"]
+        self.s3_client.complete_multipart_upload.side_effect = client_error(
+            "NoSuchUpload"
+        )
+        response = self.complete(file_id, [{"part_number": 1, "etag": '"1"'}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(FileModel.objects.get().status, "P")
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_missing_or_resized_objects_are_not_stored(self):
+        file_id = self.begin(size=10).json()["file_id"]
+        self.s3_client.head_object.side_effect = client_error("404")
+        response = self.complete(file_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "File has not been uploaded")
+
+        self.s3_client.head_object.side_effect = None
+        self.s3_client.head_object.return_value = {"ContentLength": 9}
+        response = self.complete(file_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(FileModel.objects.get().status, "P")
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_other_users_cannot_complete(self):
+        file_id = self.begin(size=10).json()["file_id"]
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.client.force_authenticate(other)
+        self.assertEqual(self.complete(file_id).status_code, 404)
+        self.assertEqual(self.complete("not-a-uuid").status_code, 404)
+
+
+@override_settings(S3_UPLOAD_PART_SIZE=5, FILE_STORAGE_BACKEND="local")
+class ResumableUploadViewsTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(FILE_LOCAL_STORAGE_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Three parts: 5, 5 and 2 bytes.
+        response = self.client.post(
+            reverse("upload-resumable"),
+            {"filename": "a.txt", "size": 12},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["part_count"], 3)
+        self.file_id = response.json()["file_id"]
+
+    def put_part(self, part_number, body, file_id=None):
+        return self.client.put(
+            reverse(
+                "upload-resumable-part", args=[file_id or self.file_id, part_number]
+            ),
+            body,
+            content_type="application/octet-stream",
+        )
+
+    def status(self):
+        return self.client.get(reverse("upload-resumable-detail", args=[self.file_id]))
+
+    def complete(self):
+        return self.client.post(
+            reverse("upload-resumable-complete", args=[self.file_id])
+        )
+
+    def test_parts_must_have_their_exact_size(self):
+        response = self.put_part(1, b"abcd")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "Part 1 must be 5 bytes")
+        # One byte too many is caught by reading one byte past the part.
+        self.assertEqual(self.put_part(1, b"abcdef").status_code, 400)
+        self.assertEqual(self.put_part(3, b"abc").status_code, 400)
+        self.assertEqual(self.put_part(3, b"ab").status_code, 200)
+        self.assertEqual(self.put_part(4, b"ab").status_code, 400)
+        self.assertEqual(self.put_part(0, b"ab").status_code, 400)
+        self.assertEqual(self.status().json()["parts"], [3])
+
+    def test_offset_covers_the_parts_received_in_order(self):
+        response = self.put_part(2, b"fghij")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["offset"], 0)
+        response = self.put_part(1, b"abcde")
+        self.assertEqual(response.json()["offset"], 10)
+
+        status = self.status().json()
+        self.assertEqual(status["parts"], [1, 2])
+        self.assertEqual(status["offset"], 10)
+        self.assertEqual(status["size"], 12)
+
+    def test_repeated_part_replaces_the_first(self):
+        self.put_part(1, b"xxxxx")
+        response = self.put_part(1, b"abcde")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["offset"], 5)
+        self.assertEqual(self.status().json()["parts"], [1])
+
+        self.put_part(2, b"fghij")
+        self.put_part(3, b"kl")
+        self.assertEqual(self.complete().status_code, 201)
+        body, _ = LocalObjectStorage().open(FileModel.objects.get().blob.object_key)
+        with body:
+            self.assertEqual(body.read(), b"abcdefghijkl")
+
+    def test_completion_needs_every_part(self):
+        self.put_part(1, b"abcde")
+        self.put_part(3, b"kl")
+        response = self.complete()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "Not all parts have been uploaded")
+
+        self.put_part(2, b"fghij")
+        response = self.complete()
+        self.assertEqual(response.status_code, 201)
+        file = FileModel.objects.get()
+        self.assertEqual(file.status, "S")
+        self.assertEqual(file.size, 12)
+        self.assertFalse(UploadSessionModel.objects.exists())
+        usage = StorageUsageModel.objects.get(user=self.user)
+        self.assertEqual((usage.owned_bytes, usage.visible_bytes), (12, 12))
+        self.assertEqual(self.status().status_code, 404)
+
+    def test_abort_drops_the_upload(self):
+        self.put_part(1, b"abcde")
+        response = self.client.delete(
+            reverse("upload-resumable-detail", args=[self.file_id])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(FileModel.objects.exists())
+        self.assertEqual(list(LocalObjectStorage().list_multipart_uploads()), [])
+        self.assertEqual(self.status().status_code, 404)
+        self.assertEqual(self.put_part(2, b"fghij").status_code, 404)
+
+    def test_other_users_cannot_touch_the_upload(self):
+        other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.client.force_authenticate(other)
+        detail_url = reverse("upload-resumable-detail", args=[self.file_id])
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+        self.assertEqual(self.put_part(1, b"abcde").status_code, 404)
+        self.assertEqual(self.complete().status_code, 404)
+        self.assertEqual(self.client.delete(detail_url).status_code, 404)
+        self.assertEqual(self.put_part(1, b"abcde", "not-a-uuid").status_code, 404)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.status().json()["parts"], [])
+
+
+@override_settings(FILE_STORAGE_BACKEND="local", BLOCKED_UPLOAD_EXTENSIONS=["exe"])
+class BatchFileUploadViewTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings_override = override_settings(FILE_LOCAL_STORAGE_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, *files):
+        return self.client.post(
+            reverse("upload-batch"),
+            {"files": [SimpleUploadedFile(name, content) for name, content in files]},
+            format="multipart",
+        )
+
+    def stored_objects(self):
+        blobs = os.path.join(self.root, "blobs")
+        if not os.path.isdir(blobs):
+            return []
+        return [name for name in os.listdir(blobs) if not name.startswith(".")]
+
+    def test_all_failed_is_a_bad_request(self):
+        response = self.upload(("a.exe", b"hello"), ("b.exe", b"world"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [result["status"] for result in response.json()["files"]],
+            ["failed", "failed"],
+        )
+        self.assertFalse(FileModel.objects.exists())
+        self.assertEqual(self.stored_objects(), [])
+
+    def test_failures_are_reported_per_file(self):
+        response = self.upload(("a.txt", b"hello"), ("b.exe", b"world"))
+        self.assertEqual(response.status_code, 201)
+        uploaded, failed = response.json()["files"]
+        self.assertEqual(uploaded["filename"], "a.txt")
+        self.assertEqual(uploaded["status"], "uploaded")
+        self.assertEqual(
+            failed,
+            {
+                "filename": "b.exe",
+                "status": "failed",
+                "message": "Files of this type cannot be uploaded",
+            },
+        )
+        file = FileModel.objects.get()
+        self.assertEqual(str(file.id), uploaded["file_id"])
+        self.assertEqual(file.status, "S")
+        self.assertEqual(len(self.stored_objects()), 1)
+
+    def test_identical_files_share_one_blob(self):
+        response = self.upload(("a.txt", b"hello"), ("b.txt", b"hello"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(FileModel.objects.count(), 2)
+        blob = ContentBlobModel.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.sha256, hashlib.sha256(b"hello").hexdigest())
+        # The second copy was deleted once it was found to be a duplicate.
+        self.assertEqual(self.stored_objects(), [os.path.basename(blob.object_key)])
+
+    @override_settings(USER_STORAGE_QUOTA=8)
+    def test_rejected_request_leaves_no_objects(self):
+        # The first file fits in the quota and is stored before the second
+        # one crosses it.
+        response = self.upload(("a.txt", b"hello"), ("b.txt", b"world"))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["message"], "Storage quota exceeded")
+        self.assertFalse(FileModel.objects.exists())
+        self.assertEqual(self.stored_objects(), [])
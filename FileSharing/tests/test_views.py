@@ -0,0 +1,531 @@
+import hashlib
+import json
+import time
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from ..cache import FileListingCache
+from ..handlers import S3UploadedFile
+from ..models import (
+    FileModel,
+    FilePermissionModel,
+    StorageUsageModel,
+)
+from ..repository import ContentBlobRepository, FileRepository
+from ..utils import build_object_key
+
+User = get_user_model()
+
+
+class FileDataListViewTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file_repository = FileRepository()
+
+    def upload(self, owner, count):
+        return self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None,
+                    f"blobs/{owner.username}-{i}",
+                    hashlib.sha256(f"{owner.username}-{i}".encode()).hexdigest(),
+                    f"{owner.username}-{i}.txt",
+                    10,
+                    "text/plain",
+                    None,
+                )
+                for i in range(count)
+            ],
+            owner,
+        )
+
+    def test_permissions_are_listed(self):
+        self.upload(self.user, 1)
+        shared = self.upload(self.other, 1)[0]
+        self.file_repository.grant_read_permission(shared, self.user)
+        response = self.client.get(reverse("filedata-list"))
+        permissions = {
+            file["original_filename"]: file["permission"]
+            for file in response.json()["files"]
+        }
+        self.assertEqual(permissions, {"testuser-0.txt": "F", "other-0.txt": "R"})
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for count in (2, 20):
+            with self.captureOnCommitCallbacks(execute=True):
+                shared = self.upload(self.other, count)
+                for file in shared:
+                    self.file_repository.grant_read_permission(file, self.user)
+            # Storage usage, count and the page itself.
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse("filedata-list"))
+            self.assertEqual(response.status_code, 200)
+
+    def test_files_can_be_searched(self):
+        self.upload(self.user, 12)
+        response = self.client.get(
+            reverse("filedata-list"), {"search": "user-1", "max_size": 10}
+        )
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_invalid_filters_are_rejected(self):
+        response = self.client.get(
+            reverse("filedata-list"), {"min_size": 10, "max_size": 5}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class FileListingCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.other = User.objects.create_user(
+            username="other", email="other@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file_repository = FileRepository()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file = self.file_repository.upload_files(
+                [
+                    S3UploadedFile(
+                        None, "blobs/1", "a" * 64, "a.txt", 10, "text/plain", None
+                    )
+                ],
+                self.other,
+            )[0]
+
+    def count(self):
+        return self.client.get(reverse("filedata-list")).json()["count"]
+
+    def test_listing_is_served_from_cache(self):
+        self.assertEqual(self.count(), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(), 0)
+
+    def test_sharing_invalidates_the_listing(self):
+        self.assertEqual(self.count(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.grant_read_permission(self.file, self.user)
+        self.assertEqual(self.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.revoke_read_permission(self.file, self.user)
+        self.assertEqual(self.count(), 0)
+
+    def test_trash_invalidates_the_listing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.grant_read_permission(self.file, self.user)
+        self.assertEqual(self.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.trash_files([self.file])
+        self.assertEqual(self.count(), 0)
+
+    def test_evicted_version_does_not_serve_stale_entries(self):
+        self.assertEqual(self.count(), 0)
+        cache.delete(FileListingCache.version_key.format(user_id=self.user.id))
+        FilePermissionModel.objects.create(
+            file=self.file, user=self.user, permission="R"
+        )
+        self.assertEqual(self.count(), 1)
+
+    def test_missed_invalidation_expires(self):
+        etag = self.client.get(reverse("filedata-list"))["ETag"]
+        # A change whose invalidation went to another process's cache.
+        FilePermissionModel.objects.create(
+            file=self.file, user=self.user, permission="R"
+        )
+        response = self.client.get(reverse("filedata-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        later = time.time() + settings.FILE_LISTING_CACHE_TIMEOUT + 1
+        with patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            response = self.client.get(
+                reverse("filedata-list"), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+
+    def test_stats(self):
+        before = FileListingCache().get_stats()
+        self.count()
+        self.count()
+        after = FileListingCache().get_stats()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    def test_unchanged_listing_is_not_modified(self):
+        response = self.client.get(reverse("filedata-list"))
+        etag = response["ETag"]
+        self.assertIn("private", response["Cache-Control"])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("filedata-list"), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_etag_changes_with_the_listing(self):
+        etag = self.client.get(reverse("filedata-list"))["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.grant_read_permission(self.file, self.user)
+        response = self.client.get(reverse("filedata-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["count"], 1)
+
+
+@override_settings(FILE_EXPORT_BATCH_SIZE=2)
+class FileExportViewTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser",
+            email="testuser@x.com",
+            password="password",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.token = AccessToken.for_user(self.user)
+        self.files = FileRepository().upload_files(
+            [
+                S3UploadedFile(
+                    None,
+                    f"blobs/{i}",
+                    f"{i}" * 64,
+                    f"{i}.txt",
+                    10,
+                    "text/plain",
+                    None,
+                )
+                for i in range(5)
+            ],
+            self.user,
+        )
+        self.expected_ids = [
+            str(file.id)
+            for file in sorted(
+                self.files, key=lambda file: (file.upload_date, file.id), reverse=True
+            )
+        ]
+
+    def test_ndjson_export_streams_every_file(self):
+        response = self.client.get(reverse("filedata-export"), {"type": "ndjson"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], self.expected_ids)
+
+    def test_json_export_is_an_array(self):
+        response = self.client.get(reverse("filedata-export"))
+        files = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([file["id"] for file in files], self.expected_ids)
+        self.assertEqual(files[0]["permission"], "F")
+
+    def test_unknown_type_is_rejected(self):
+        response = self.client.get(reverse("filedata-export"), {"type": "csv"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_export_is_streamed_asynchronously_under_asgi(self):
+        response = await AsyncClient().get(
+            reverse("filedata-export"),
+            {"type": "ndjson"},
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(
+            [json.loads(line)["id"] for line in content.decode().splitlines()],
+            self.expected_ids,
+        )
+
+
+class FileUploadViewTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = patch("filesharing.storage.S3ClientSingleton")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_released_blob_asks_for_the_content(self):
+        # The declared blob exists when it is checked, but is released
+        # before the upload is finalized.
+        with patch.object(ContentBlobRepository, "exists", return_value=True):
+            response = self.client.post(
+                reverse("upload"),
+                {"file": SimpleUploadedFile("a.txt", b"hello")},
+                format="multipart",
+                HTTP_X_CONTENT_SHA256=hashlib.sha256(b"hello").hexdigest(),
+            )
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("X-Content-SHA256", response.json()["message"])
+        self.assertEqual(FileModel.objects.get().status, "F")
+        self.s3_client.put_object.assert_not_called()
+
+
+class DownloadFileViewTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@x.com", password="password"
+        )
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file_repository = FileRepository()
+        self.file = self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, "blobs/1", "a" * 64, "a.txt", 10, "text/plain", None
+                )
+            ],
+            self.owner,
+        )[0]
+        self.file_repository.grant_read_permission(self.file, self.user)
+
+        patcher = patch("filesharing.views.S3PresignerSingleton")
+        self.presigner = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.presigner.presign.side_effect = [
+            "https://s3/1",
+            "https://s3/2",
+        ]
+        self.url = reverse("file-download", args=[self.file.id])
+
+    def test_url_is_reused(self):
+        self.assertEqual(self.client.get(self.url).json()["url"], "https://s3/1")
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()["url"], "https://s3/1")
+        self.assertEqual(self.presigner.presign.call_count, 1)
+
+    def test_revoke_drops_the_cached_url(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.revoke_read_permission(self.file, self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_url_presigned_during_a_revoke_is_not_reused(self):
+        def presign_while_revoking(*args):
+            # Access was checked already; the revoke commits before the URL
+            # is cached.
+            with self.captureOnCommitCallbacks(execute=True):
+                self.file_repository.revoke_read_permission(self.file, self.user)
+            return "https://s3/1"
+
+        self.presigner.presign.side_effect = presign_while_revoking
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_trash_drops_the_cached_url(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_repository.trash_files([self.file])
+        self.assertNotEqual(self.client.get(self.url).status_code, 200)
+
+
+class BatchDownloadViewTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@x.com", password="password"
+        )
+        self.user = User.objects.create_user(
+            username="testuser", email="testuser@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        file_repository = FileRepository()
+        self.shared, self.private = file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, f"blobs/{i}", f"{i}" * 64, f"{i}.txt", 10, "text/plain", None
+                )
+                for i in range(2)
+            ],
+            self.owner,
+        )
+        file_repository.grant_read_permission(self.shared, self.user)
+        # Uploaded before content addressing, so stored under the owner's key.
+        self.legacy = FileModel.objects.create(
+            original_filename="old.txt", size=10, file_extension="txt"
+        )
+        FilePermissionModel.objects.create(
+            file=self.legacy, user=self.user, permission="F"
+        )
+
+        patcher = patch("filesharing.views.S3PresignerSingleton")
+        self.presigner = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.presigner.presign.side_effect = (
+            lambda method, bucket, key, expires_in: f"https://s3/{key}"
+        )
+
+    def download(self, file_ids):
+        return self.client.post(
+            reverse("file-download-batch"), {"file_ids": file_ids}, format="json"
+        )
+
+    def test_urls_and_errors_are_reported_per_file(self):
+        file_ids = [str(self.shared.id), str(self.legacy.id), str(self.private.id)]
+        with self.assertNumQueries(1):
+            response = self.download(file_ids + ["nope"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["files"],
+            {
+                file_ids[0]: {"url": "https://s3/blobs/0"},
+                file_ids[1]: {
+                    "url": "https://s3/"
+                    + build_object_key(self.user.id, self.legacy.id, "old.txt")
+                },
+                file_ids[2]: {"message": "File not found"},
+                "nope": {"message": "Invalid file id"},
+            },
+        )
+
+    def test_cached_urls_are_reused(self):
+        self.download([str(self.shared.id)])
+        with self.assertNumQueries(0):
+            response = self.download([str(self.shared.id)])
+        self.assertEqual(
+            response.json()["files"][str(self.shared.id)], {"url": "https://s3/blobs/0"}
+        )
+        self.assertEqual(self.presigner.presign.call_count, 1)
+
+    def test_too_many_files_are_rejected(self):
+        with self.settings(MAX_BATCH_DOWNLOAD_FILES=1):
+            response = self.download([str(self.shared.id), str(self.legacy.id)])
+        self.assertEqual(response.status_code, 400)
+
+
+class TrashViewsTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@x.com", password="password"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@x.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.file_repository = FileRepository()
+        self.files = self.file_repository.upload_files(
+            [
+                S3UploadedFile(
+                    None, f"blobs/{i}", f"{i}" * 64, f"{i}.txt", 10, "", None
+                )
+                for i in range(3)
+            ],
+            self.owner,
+        )
+        self.file_repository.grant_read_permission(self.files[0], self.reader)
+        self.others = self.file_repository.upload_files(
+            [S3UploadedFile(None, "blobs/x", "x" * 64, "x.txt", 10, "", None)],
+            self.reader,
+        )
+
+    def listed_ids(self, user):
+        return {
+            file.id for file in self.file_repository.get_all_files_for_user(user)
+        }
+
+    def usage(self, user):
+        usage = StorageUsageModel.objects.get(user=user)
+        return usage.owned_bytes, usage.visible_bytes
+
+    def test_deleted_file_goes_to_the_trash(self):
+        file = self.files[0]
+        response = self.client.delete(reverse("file-delete", args=[file.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"message": "File moved to trash"})
+
+        self.assertNotIn(file.id, self.listed_ids(self.owner))
+        self.assertNotIn(file.id, self.listed_ids(self.reader))
+        # Still counted towards the owner's quota, but no longer visible.
+        self.assertEqual(self.usage(self.owner), (30, 20))
+        self.assertEqual(self.usage(self.reader), (10, 10))
+
+        response = self.client.get(reverse("trash-list"))
+        self.assertEqual(
+            [item["id"] for item in response.json()["results"]], [str(file.id)]
+        )
+        self.assertIn("deleted_at", response.json()["results"][0])
+        response = self.client.get(reverse("file-download", args=[file.id]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.delete(reverse("file-delete", args=[file.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_trashed_file_is_restored(self):
+        file = self.files[0]
+        self.client.delete(reverse("file-delete", args=[file.id]))
+        response = self.client.post(reverse("trash-restore", args=[file.id]))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertIn(file.id, self.listed_ids(self.reader))
+        self.assertEqual(self.usage(self.reader), (10, 20))
+        response = self.client.post(reverse("trash-restore", args=[file.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_only_owners_delete_and_restore(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.delete(reverse("file-delete", args=[self.files[0].id]))
+        self.assertEqual(response.status_code, 403)
+
+        self.file_repository.trash_files([self.files[0]])
+        response = self.client.post(reverse("trash-restore", args=[self.files[0].id]))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse("trash-list"))
+        self.assertEqual(response.json()["results"], [])
+
+    def test_batch_delete_reports_outcome_per_file(self):
+        file_ids = [str(file.id) for file in self.files[:2]]
+        other_id = str(self.others[0].id)
+        response = self.client.post(
+            reverse("file-delete-batch"),
+            {"file_ids": file_ids + [other_id, "nope"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["files"],
+            {
+                **dict.fromkeys(file_ids, {"message": "File moved to trash"}),
+                other_id: {"message": "Permission denied"},
+                "nope": {"message": "Invalid file id"},
+            },
+        )
+        self.assertEqual(self.listed_ids(self.owner), {self.files[2].id})
+        self.assertEqual(self.usage(self.reader), (10, 10))
+
+    def test_batch_delete_rejects_too_many_files(self):
+        with self.settings(MAX_BATCH_DELETE_FILES=1):
+            response = self.client.post(
+                reverse("file-delete-batch"),
+                {"file_ids": [str(file.id) for file in self.files[:2]]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,176 @@
+import threading
+
+from django.conf import settings
+from s3transfer.manager import TransferConfig, TransferManager
+from s3transfer.subscribers import BaseSubscriber
+
+from .utils import S3ClientSingleton
+
+# Bytes a StreamingUpload buffers between the request and the transfer engine.
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+
+def get_transfer_config() -> TransferConfig:
+    """Build the TransferConfig for uploads from the S3_UPLOAD_* settings."""
+    return TransferConfig(
+        multipart_threshold=settings.S3_UPLOAD_MULTIPART_THRESHOLD,
+        multipart_chunksize=settings.S3_UPLOAD_PART_SIZE,
+        max_request_concurrency=settings.S3_UPLOAD_MAX_CONCURRENCY,
+        # Never hold more parts in memory than can be sent at once.
+        max_in_memory_upload_chunks=settings.S3_UPLOAD_MAX_CONCURRENCY,
+    )
+
+
+class UploadPipe:
+    """
+    A bounded, blocking, non-seekable file object. The request thread writes
+    into it while the transfer engine reads part-sized blocks out of it.
+    """
+
+    def __init__(self, max_buffer_size=PIPE_BUFFER_SIZE):
+        self.max_buffer_size = max_buffer_size
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._aborted = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        """Write data, blocking while the buffer is full."""
+        view = memoryview(data)
+        with self._condition:
+            while view:
+                self._condition.wait_for(
+                    lambda: self._aborted
+                    or len(self._buffer) < self.max_buffer_size
+                )
+                if self._aborted:
+                    raise BrokenPipeError("The upload was aborted")
+                room = self.max_buffer_size - len(self._buffer)
+                self._buffer += view[:room]
+                view = view[room:]
+                self._condition.notify_all()
+
+    def read(self, size=-1):
+        """Read size bytes, blocking until they arrive or the pipe is closed."""
+        data = bytearray()
+        with self._condition:
+            while size < 0 or len(data) < size:
+                self._condition.wait_for(
+                    lambda: self._buffer or self._closed or self._aborted
+                )
+                if self._aborted:
+                    raise BrokenPipeError("The upload was aborted")
+                if not self._buffer:
+                    break
+                wanted = len(self._buffer) if size < 0 else size - len(data)
+                data += self._buffer[:wanted]
+                del self._buffer[:wanted]
+                self._condition.notify_all()
+        return bytes(data)
+
+    def close(self):
+        """Signal the end of the data."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def abort(self):
+        """Wake up and fail both sides."""
+        with self._condition:
+            self._aborted = True
+            self._buffer = bytearray()
+            self._condition.notify_all()
+
+
+class AbortPipeOnDone(BaseSubscriber):
+    """Unblock the writer if the transfer ends before all data was read."""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def on_done(self, future, **kwargs):
+        self.pipe.abort()
+
+
+class StreamingUpload:
+    """An upload to S3 whose content is written piece by piece."""
+
+    def __init__(self, engine, key, extra_args=None):
+        self.key = key
+        self.pipe = UploadPipe()
+        self.future = engine.upload(
+            self.pipe, key, extra_args, subscribers=[AbortPipeOnDone(self.pipe)]
+        )
+
+    def write(self, data):
+        try:
+            self.pipe.write(data)
+        except BrokenPipeError:
+            # Surface the error that ended the transfer, if there was one.
+            self.future.result()
+            raise
+
+    def close(self):
+        """Signal the end of the data without waiting for the upload."""
+        self.pipe.close()
+
+    def finish(self):
+        """Wait for the upload to complete, raising if it failed."""
+        self.close()
+        return self.future.result()
+
+    def done(self) -> bool:
+        """Check if the upload has ended, successfully or not."""
+        return self.future.done()
+
+    def cancel(self):
+        """Stop the upload; a started multipart upload is aborted."""
+        self.pipe.abort()
+        self.future.cancel()
+        try:
+            self.future.result()
+        except Exception:
+            pass
+
+
+class TransferEngine:
+    """
+    Runs uploads through an s3transfer TransferManager, which sends files
+    above the multipart threshold as parts from a thread pool. Configured by
+    the S3_UPLOAD_* settings unless a client or config is given.
+    """
+
+    def __init__(self, client=None, config=None, bucket_name=None):
+        self.client = client or S3ClientSingleton()
+        self.config = config or get_transfer_config()
+        self.bucket_name = bucket_name or settings.AWS_STORAGE_BUCKET_NAME
+        self.manager = TransferManager(self.client, self.config)
+
+    def upload(self, fileobj, key, extra_args=None, subscribers=None):
+        """Start uploading fileobj to key and return its TransferFuture."""
+        return self.manager.upload(
+            fileobj,
+            self.bucket_name,
+            key,
+            extra_args={"ACL": "private", **(extra_args or {})},
+            subscribers=subscribers,
+        )
+
+    def open_stream(self, key, extra_args=None) -> StreamingUpload:
+        """Start an upload to key that is fed with StreamingUpload.write."""
+        return StreamingUpload(self, key, extra_args)
+
+    def shutdown(self, cancel=False):
+        self.manager.shutdown(cancel=cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(cancel=exc_type is not None)
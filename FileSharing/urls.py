@@ -4,9 +4,71 @@ from filesharing import views
 
 urlpatterns = [
     path("upload/", views.FileUploadView.as_view(), name="upload"),
+    path(
+        "upload/batch/", views.BatchFileUploadView.as_view(), name="upload-batch"
+    ),
+    path("upload/begin/", views.BeginUploadView.as_view(), name="upload-begin"),
+    path(
+        "upload/complete/<file_id>/",
+        views.CompleteUploadView.as_view(),
+        name="upload-complete",
+    ),
+    path(
+        "upload/resumable/",
+        views.ResumableUploadView.as_view(),
+        name="upload-resumable",
+    ),
+    path(
+        "upload/resumable/<file_id>/",
+        views.ResumableUploadDetailView.as_view(),
+        name="upload-resumable-detail",
+    ),
+    path(
+        "upload/resumable/<file_id>/parts/<int:part_number>/",
+        views.ResumableUploadPartView.as_view(),
+        name="upload-resumable-part",
+    ),
+    path(
+        "upload/resumable/<file_id>/complete/",
+        views.ResumableUploadCompleteView.as_view(),
+        name="upload-resumable-complete",
+    ),
     path("fetch/", views.FileDataListView.as_view(), name="filedata-list"),
+    path("fetch/export/", views.FileExportView.as_view(), name="filedata-export"),
+    path(
+        "fetch/cache-stats/",
+        views.ListingCacheStatsView.as_view(),
+        name="filedata-cache-stats",
+    ),
+    path("delete/batch/", views.BatchDeleteView.as_view(), name="file-delete-batch"),
     path("delete/<file_id>/", views.DeleteFileView.as_view(), name="file-delete"),
+    path(
+        "download/batch/",
+        views.BatchDownloadView.as_view(),
+        name="file-download-batch",
+    ),
+    path(
+        "download/archive/",
+        views.ArchiveDownloadView.as_view(),
+        name="file-download-archive",
+    ),
+    path(
+        "download/cache-stats/",
+        views.ObjectCacheStatsView.as_view(),
+        name="file-download-cache-stats",
+    ),
     path("download/<file_id>/", views.DownloadFileView.as_view(), name="file-download"),
+    path(
+        "download/<file_id>/content/",
+        views.FileContentView.as_view(),
+        name="file-content",
+    ),
+    path("trash/", views.TrashListView.as_view(), name="trash-list"),
+    path(
+        "trash/<file_id>/restore/",
+        views.RestoreFileView.as_view(),
+        name="trash-restore",
+    ),
     path(
         "share/user-list/<file_id>/",
         views.UserSharedListView.as_view(),
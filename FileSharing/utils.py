@@ -1,6 +1,11 @@
 import boto3
 import threading
-from core import settings
+import unicodedata
+from asgiref.sync import sync_to_async
+from botocore.config import Config
+from django.conf import settings
+
+from .presign import S3Presigner
 
 
 class S3ResourceSingleton:
@@ -33,5 +38,78 @@ class S3ClientSingleton:
                         endpoint_url=settings.AWS_S3_ENDPOINT_URL,
                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                        region_name=settings.AWS_S3_REGION_NAME,
+                        config=Config(
+                            signature_version=settings.AWS_S3_SIGNATURE_VERSION
+                        ),
                     )
         return cls._instance
+
+
+class S3PresignerSingleton:
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = S3Presigner(
+                        access_key=settings.AWS_ACCESS_KEY_ID,
+                        secret_key=settings.AWS_SECRET_ACCESS_KEY,
+                        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                        region=settings.AWS_S3_REGION_NAME,
+                    )
+        return cls._instance
+
+
+def build_object_key(user_id, file_id, filename):
+    """Return the S3 key of a file uploaded before content addressing."""
+    return f"user_{user_id}/{file_id}_{filename}"
+
+
+def build_blob_key(blob_id):
+    """Return the S3 key under which a content blob is stored."""
+    return f"blobs/{blob_id}"
+
+
+def has_blocked_extension(filename):
+    """Check if the extension of a file name is in BLOCKED_UPLOAD_EXTENSIONS."""
+    if "." not in filename:
+        return False
+    blocked = {extension.lower() for extension in settings.BLOCKED_UPLOAD_EXTENSIONS}
+    return filename.split(".")[-1].lower() in blocked
+
+
+def build_trigrams(text):
+    """
+    Return the distinct three-character substrings of text, lowercased and
+    without accents, since MySQL's default collation compares them that way.
+    """
+    text = "".join(
+        character
+        for character in unicodedata.normalize("NFKD", text.lower())
+        if not unicodedata.combining(character)
+    )
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+async def iterate_in_thread(iterator, thread_sensitive=True):
+    """
+    Iterate over a sync iterator from async code. By default each item is
+    produced in the request's sync thread, which owns the database
+    connection that a queryset iterator reads from; iterators that do not
+    touch the database can use any worker thread instead.
+    """
+    iterator = iter(iterator)
+    get_next = sync_to_async(next, thread_sensitive=thread_sensitive)
+    done = object()
+    try:
+        while True:
+            item = await get_next(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            await sync_to_async(iterator.close, thread_sensitive=thread_sensitive)()
@@ -1,95 +1,634 @@
+import itertools
+import json
 import math
+import uuid
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 import boto3
 from botocore.exceptions import ClientError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from accounts.models import UserModel
 from accounts.repository import UserRepository
 from filesharing.models import FileModel, FilePermissionModel
 from filesharing.serializers import (
+    BatchDeleteSerializer,
+    BatchDownloadSerializer,
+    BeginUploadSerializer,
+    CompleteUploadSerializer,
     FileDataSerializer,
+    FileFilterSerializer,
     FileUploadSerializer,
-    ShareFileProfileSerializer,
     ShareFileSerializer,
+    TrashedFileSerializer,
+    FILE_DATA_ROW_FIELDS,
+    SHARE_PROFILE_ROW_FIELDS,
+    serialize_file_rows,
+    serialize_share_profile_rows,
 )
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
-from core import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.conf import settings
 from rest_framework import generics
 from django.db import transaction
-from .utils import S3ResourceSingleton, S3ClientSingleton
-from .repository import FileRepository
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from datetime import timedelta
+from rest_framework.settings import api_settings
+from .cache import DownloadUrlCache, FileListingCache
+from .handlers import (
+    S3BatchUploadHandler,
+    S3MultipartUploadHandler,
+    UploadLimitHandler,
+    UploadRejected,
+)
+from .downloads import (
+    APP_DOWNLOAD_MODES,
+    offload_archive,
+    offload_object,
+    stream_archive,
+    stream_object,
+)
+from .objectcache import ObjectDiskCache
+from .pagination import FileCursorPagination
+from .storage import InvalidParts, ObjectMissing, StorageError, get_object_storage
+from .utils import S3PresignerSingleton, iterate_in_thread
+from .repository import (
+    FileRepository,
+    ObjectNotFoundException,
+    StorageUsageRepository,
+    UploadSessionRepository,
+)
 
 
 class FileUploadView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request):
         user = request.user
 
-        file = request.FILES["file"]
-        received_data = request.data
+        # Stream the file into S3 while the request body is being parsed.
+        # No transaction is held open while the bytes are transferred; the
+        # handler records the file as pending before sending anything.
+        # Limits are checked first, so no byte past one is sent to S3.
+        upload_handler = S3MultipartUploadHandler(request)
+        request.upload_handlers[:0] = [UploadLimitHandler(request), upload_handler]
+
+        try:
+            received_data = request.data
+        except UploadRejected as exc:
+            upload_handler.discard()
+            return Response({"message": exc.detail}, status=exc.status_code)
+        except (ClientError, StorageError) as e:
+            upload_handler.discard()
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except Exception:
+            upload_handler.discard()
+            raise
+
         serializer = FileUploadSerializer(
             data=received_data,
             context={
                 "user": user,
             },
         )
+        if not serializer.is_valid():
+            upload_handler.discard()
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                new_file = serializer.save()
+        except ObjectNotFoundException:
+            # The blob named by X-Content-SHA256 was released after the
+            # content was checked, and the body was not stored.
+            upload_handler.discard()
+            return Response(
+                {
+                    "message": "File content is no longer stored, "
+                    "upload it again without X-Content-SHA256"
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+        except Exception as exc:
+            upload_handler.discard()
+            return Response(
+                {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if new_file.blob.object_key != upload_handler.object_key:
+            # The same content was already stored; drop our copy.
+            upload_handler.delete_stored_object()
+        return Response({"message": "File uploaded successfully"}, status=201)
+
+
+class BatchFileUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+
+        # Every "files" part is streamed into S3 while the body is parsed;
+        # the transfers overlap and are collected by wait().
+        # Sizes and file types are reported per file by the batch handler;
+        # only the quota stops the whole request.
+        upload_handler = S3BatchUploadHandler(request)
+        request.upload_handlers[:0] = [
+            UploadLimitHandler(request, max_file_size=None, check_extensions=False),
+            upload_handler,
+        ]
+
+        try:
+            request.data
+        except UploadRejected as exc:
+            upload_handler.discard()
+            return Response({"message": exc.detail}, status=exc.status_code)
+        except Exception:
+            upload_handler.discard()
+            raise
+
+        uploads = upload_handler.wait()
+        if not uploads:
+            return Response(
+                {"message": "No files were uploaded"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        stored = [upload for upload in uploads if upload.error is None]
+        try:
+            with transaction.atomic():
+                new_files = FileRepository().upload_files(
+                    [upload.uploaded_file for upload in stored], user
+                )
+        except Exception as exc:
+            upload_handler.discard()
+            return Response(
+                {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        # Content that was already stored keeps its blob; drop our copies.
+        upload_handler.delete_objects(
+            [
+                upload.object_key
+                for upload, new_file in zip(stored, new_files)
+                if new_file.blob.object_key != upload.object_key
+            ]
+        )
+
+        new_files = iter(new_files)
+        results = []
+        for upload in uploads:
+            if upload.error is None:
+                results.append(
+                    {
+                        "filename": upload.name,
+                        "file_id": next(new_files).id,
+                        "status": "uploaded",
+                    }
+                )
+            else:
+                results.append(
+                    {
+                        "filename": upload.name,
+                        "status": "failed",
+                        "message": upload.error,
+                    }
+                )
+
+        return Response(
+            {"files": results},
+            status=status.HTTP_201_CREATED if stored else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class BeginUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        expires_in = settings.S3_PRESIGNED_UPLOAD_EXPIRES
+        serializer = BeginUploadSerializer(
+            data=request.data,
+            context={
+                "user": user,
+                "expires_at": timezone.now() + timedelta(seconds=expires_in),
+            },
+        )
         serializer.is_valid(raise_exception=True)
 
+        storage = get_object_storage()
+        if storage.local:
+            return Response(
+                {"message": "Direct uploads are only available with S3 storage"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         with transaction.atomic():
-            try:
-                # begin
-                file_details = serializer.save()
+            file = serializer.save()
+        upload_session = file.upload_session
 
-                file_path = serializer.file_path(
-                    file_id=file_details.id,
+        presigner = S3PresignerSingleton()
+        bucket = settings.AWS_STORAGE_BUCKET_NAME
+        response_data = {
+            "file_id": file.id,
+            "expires_at": upload_session.expires_at,
+        }
+        try:
+            if file.size <= settings.S3_PRESIGNED_MULTIPART_THRESHOLD:
+                response_data["url"] = presigner.presign(
+                    "PUT", bucket, upload_session.object_key, expires_in
                 )
+            else:
+                upload_session.upload_id = storage.create_multipart_upload(
+                    upload_session.object_key
+                )
+                upload_session.part_size = settings.S3_UPLOAD_PART_SIZE
+                upload_session.save(update_fields=["upload_id", "part_size"])
+
+                part_count = math.ceil(file.size / upload_session.part_size)
+                response_data["part_size"] = upload_session.part_size
+                response_data["parts"] = [
+                    {
+                        "part_number": part_number,
+                        "url": presigner.presign(
+                            "PUT",
+                            bucket,
+                            upload_session.object_key,
+                            expires_in,
+                            params={
+                                "uploadId": upload_session.upload_id,
+                                "partNumber": part_number,
+                            },
+                        ),
+                    }
+                    for part_number in range(1, part_count + 1)
+                ]
+        except StorageError as e:
+            file.delete()
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
 
-                s3_resource = S3ResourceSingleton()
-            except Exception as exc:
-                transaction.set_rollback(True)
+def complete_upload_session(upload_session, user, parts):
+    """
+    Complete the upload behind a session, check the stored object against
+    the declared size and mark the file as stored.
+    """
+    file = upload_session.file
+    storage = get_object_storage()
+    try:
+        if upload_session.upload_id:
+            if not parts:
                 return Response(
-                    {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {"parts": ["This field is required."]},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
-            else:
-                try:
-                    bucket = s3_resource.Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-                    bucket.put_object(ACL="private", Body=file, Key=file_path)
+            try:
+                storage.complete_multipart_upload(
+                    upload_session.object_key,
+                    upload_session.upload_id,
+                    [(part["part_number"], part["etag"]) for part in parts],
+                )
+            except InvalidParts:
+                return Response(
+                    {"message": "Parts do not match the uploaded parts"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            except ObjectMissing:
+                # Aborted, by reconcile_uploads once it expired or otherwise;
+                # its parts are gone and it has to be begun again.
+                return Response(
+                    {"message": "Upload no longer exists, begin it again"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            # The UploadId is gone once completed; a retry only re-checks.
+            upload_session.upload_id = ""
+            upload_session.save(update_fields=["upload_id"])
 
-                except ClientError as e:
-                    transaction.set_rollback(True)
-                    return Response(
-                        {"message": str(e)},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    )
-            return Response({"message": "File uploaded successfully"}, status=201)
+        size = storage.size(upload_session.object_key)
+    except ObjectMissing:
+        size = None
+    except StorageError as e:
+        return Response(
+            {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if size is None:
+        return Response(
+            {"message": "File has not been uploaded"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if size != file.size:
+        return Response(
+            {"message": "Uploaded size does not match the declared size"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    with transaction.atomic():
+        FileRepository().finalize_upload(file, user)
+
+    return Response(
+        {"message": "File uploaded successfully", "file_id": file.id},
+        status=status.HTTP_201_CREATED,
+    )
+
+
+class UploadSessionMixin:
+    def get_upload_session(self, file_id, user):
+        """Return the caller's upload session for a file, or None."""
+        try:
+            return UploadSessionRepository().get_or_raise(file_id=file_id, user=user)
+        except (ObjectNotFoundException, ValidationError):
+            return None
+
+
+class CompleteUploadView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, file_id):
+        upload_session = self.get_upload_session(file_id, request.user)
+        if upload_session is None:
+            return Response(
+                {"message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = CompleteUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return complete_upload_session(
+            upload_session, request.user, serializer.validated_data.get("parts")
+        )
+
+
+class ResumableUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        serializer = BeginUploadSerializer(
+            data=request.data,
+            context={
+                "user": user,
+                "expires_at": timezone.now()
+                + timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES),
+            },
+        )
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            file = serializer.save()
+        upload_session = file.upload_session
+
+        try:
+            upload_id = get_object_storage().create_multipart_upload(
+                upload_session.object_key
+            )
+        except StorageError as e:
+            file.delete()
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        upload_session.upload_id = upload_id
+        upload_session.part_size = settings.S3_UPLOAD_PART_SIZE
+        upload_session.save(update_fields=["upload_id", "part_size"])
+
+        return Response(
+            {
+                "file_id": file.id,
+                "part_size": upload_session.part_size,
+                "part_count": math.ceil(file.size / upload_session.part_size),
+                "expires_at": upload_session.expires_at,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ResumableUploadDetailView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, file_id):
+        upload_session = self.get_upload_session(file_id, request.user)
+        if upload_session is None or not upload_session.upload_id:
+            return Response(
+                {"message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        upload_session_repository = UploadSessionRepository()
+        return Response(
+            {
+                "file_id": upload_session.file_id,
+                "size": upload_session.file.size,
+                "part_size": upload_session.part_size,
+                "offset": upload_session_repository.get_received_offset(
+                    upload_session
+                ),
+                "parts": list(
+                    upload_session.parts.values_list("part_number", flat=True)
+                ),
+                "expires_at": upload_session.expires_at,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def delete(self, request, file_id):
+        upload_session = self.get_upload_session(file_id, request.user)
+        if upload_session is None:
+            return Response(
+                {"message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            if upload_session.upload_id:
+                get_object_storage().abort_multipart_upload(
+                    upload_session.object_key, upload_session.upload_id
+                )
+        except StorageError as e:
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        UploadSessionRepository().discard(upload_session)
+        return Response({"message": "Upload aborted"}, status=status.HTTP_200_OK)
+
+
+class ResumableUploadPartView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, file_id, part_number):
+        upload_session = self.get_upload_session(file_id, request.user)
+        if upload_session is None or not upload_session.upload_id:
+            return Response(
+                {"message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        file_size = upload_session.file.size
+        part_size = upload_session.part_size
+        if part_number < 1 or part_number > math.ceil(file_size / part_size):
+            return Response(
+                {"message": "Invalid part number"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Every part but the last one is exactly part_size bytes long. Read at
+        # most one byte more than expected so the body stays bounded.
+        expected_size = min(part_size, file_size - (part_number - 1) * part_size)
+        stream = request.stream
+        body = stream.read(expected_size + 1) if stream is not None else b""
+        if len(body) != expected_size:
+            return Response(
+                {"message": f"Part {part_number} must be {expected_size} bytes"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            etag = get_object_storage().upload_part(
+                upload_session.object_key,
+                upload_session.upload_id,
+                part_number,
+                body,
+            )
+        except StorageError as e:
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        upload_session_repository = UploadSessionRepository()
+        upload_session_repository.record_part(
+            upload_session,
+            part_number=part_number,
+            etag=etag,
+            size=expected_size,
+            expires_at=timezone.now()
+            + timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES),
+        )
+
+        return Response(
+            {
+                "part_number": part_number,
+                "etag": etag,
+                "offset": upload_session_repository.get_received_offset(
+                    upload_session
+                ),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class ResumableUploadCompleteView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, file_id):
+        upload_session = self.get_upload_session(file_id, request.user)
+        if upload_session is None:
+            return Response(
+                {"message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        parts = [
+            {"part_number": part.part_number, "etag": part.etag}
+            for part in upload_session.parts.all()
+        ]
+        if upload_session.upload_id and len(parts) != math.ceil(
+            upload_session.file.size / upload_session.part_size
+        ):
+            return Response(
+                {"message": "Not all parts have been uploaded"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return complete_upload_session(upload_session, request.user, parts)
+
+
+def listing_etag(request, *args, **kwargs):
+    return FileListingCache().get_etag(request.user.id, request.build_absolute_uri())
 
 
 class FileDataListView(generics.ListAPIView):
     serializer_class = FileDataSerializer
     permission_classes = [IsAuthenticated]
 
+    @property
+    def pagination_class(self):
+        # ?pagination=cursor opts in to keyset pagination; its links carry
+        # a cursor, which keeps later pages in that mode.
+        query_params = self.request.query_params
+        if (
+            query_params.get("pagination") == "cursor"
+            or FileCursorPagination.cursor_query_param in query_params
+        ):
+            return FileCursorPagination
+        return api_settings.DEFAULT_PAGINATION_CLASS
+
     def get_queryset(self):
         file_repository = FileRepository()
-        return file_repository.get_all_files_for_user(user=self.request.user)
+        queryset = file_repository.get_all_files_for_user(user=self.request.user)
+
+        filter_serializer = FileFilterSerializer(data=self.request.query_params)
+        filter_serializer.is_valid(raise_exception=True)
+        return file_repository.filter_files(
+            queryset, self.request.user, **filter_serializer.validated_data
+        )
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["user"] = self.request.user
         return context
 
+    # A matching If-None-Match is answered with 304 before anything else
+    # runs; clients must revalidate, as the listing is per user.
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=listing_etag))
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        # Cached per user and URL until the user's files change.
+        listing_cache = FileListingCache()
+        cache_key = listing_cache.get_key(
+            request.user.id, request.build_absolute_uri()
+        )
+        response_data = listing_cache.get(cache_key)
+        if response_data is None:
+            response_data = self.get_listing(request)
+            listing_cache.set(cache_key, response_data)
+        return Response(response_data)
+
+    def get_listing(self, request):
+        # Plain rows instead of model instances; serialize_file_rows gives
+        # the same data as FileDataSerializer.
+        queryset = self.get_queryset().values_list(*FILE_DATA_ROW_FIELDS, named=True)
         page = self.paginate_queryset(queryset)
 
-        total_size_B = sum(file.size for file in queryset)
-        total_size, unit = self.convert_size(total_size_B)
+        storage_usage = StorageUsageRepository().get_for_user(request.user)
+        total_size, unit = self.convert_size(storage_usage.visible_bytes)
+
+        if isinstance(self.paginator, FileCursorPagination):
+            # Counting is what cursors avoid, so it is only done on request.
+            count = (
+                queryset.count()
+                if request.query_params.get("count") == "true"
+                else None
+            )
+            response_data = {
+                "count": count,
+                "next": self.paginator.get_next_link(),
+                "previous": self.paginator.get_previous_link(),
+                "total_pages": None,
+                "total_size": total_size,
+                "unit": unit,
+                "files": serialize_file_rows(page),
+            }
+            return response_data
 
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             total_pages = self.paginator.page.paginator.num_pages
             response_data = {
                 "count": self.paginator.page.paginator.count,
@@ -98,11 +637,10 @@ class FileDataListView(generics.ListAPIView):
                 "total_pages": total_pages,
                 "total_size": total_size,
                 "unit": unit,
-                "files": serializer.data,
+                "files": serialize_file_rows(page),
             }
-            return Response(response_data)
+            return response_data
 
-        serializer = self.get_serializer(queryset, many=True)
         response_data = {
             "count": len(queryset),
             "next": None,
@@ -110,12 +648,12 @@ class FileDataListView(generics.ListAPIView):
             "total_pages": "1",
             "total_size": total_size,
             "unit": unit,
-            "files": serializer.data,
+            "files": serialize_file_rows(queryset),
         }
-        return Response(response_data)
+        return response_data
 
     def convert_size(self, size_bytes):
-        if size_bytes == 0:
+        if size_bytes <= 0:
             return (0, "B")
         size_name = ("B", "KB", "MB", "GB", "TB")
         i = int(math.floor(math.log(size_bytes, 1024)))
@@ -124,76 +662,200 @@ class FileDataListView(generics.ListAPIView):
         return (round(s, 3), size_name[i])
 
 
+# Content types of the formats /files/fetch/export/ can be streamed in.
+EXPORT_CONTENT_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+# Rows encoded into each chunk of an export.
+EXPORT_CHUNK_ROWS = 500
+
+
+def encode_file_export(rows, export_type):
+    """Encode file rows as a JSON array or NDJSON, in chunks of rows."""
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    rows = iter(rows)
+    separator = ""
+    if export_type == "json":
+        yield b"["
+    while True:
+        chunk = serialize_file_rows(itertools.islice(rows, EXPORT_CHUNK_ROWS))
+        if not chunk:
+            break
+        items = [encoder.encode(item) for item in chunk]
+        if export_type == "json":
+            yield (separator + ",".join(items)).encode()
+            separator = ","
+        else:
+            yield ("\n".join(items) + "\n").encode()
+    if export_type == "json":
+        yield b"]"
+
+
+class FileExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        export_type = request.query_params.get("type", "json")
+        if export_type not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {"message": "Export type must be json or ndjson"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = FileRepository().iterate_files_for_user(
+            request.user, FILE_DATA_ROW_FIELDS
+        )
+        content = encode_file_export(rows, export_type)
+        if isinstance(request._request, ASGIRequest):
+            # Under ASGI, Django reads a sync iterator to the end before
+            # sending anything, so it is handed an async one instead.
+            content = iterate_in_thread(content)
+        response = StreamingHttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[export_type]
+        )
+        response["Content-Disposition"] = f'attachment; filename="files.{export_type}"'
+        return response
+
+
+class ListingCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Counted in the cache backend, so per process with local memory.
+        return Response(FileListingCache().get_stats(), status=status.HTTP_200_OK)
+
+
+class ObjectCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Counted in the cache backend, so per process with local memory.
+        return Response(ObjectDiskCache().get_stats(), status=status.HTTP_200_OK)
+
+
 class DeleteFileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, file_id):
         try:
-            user = request.user
             file_repository = FileRepository()
-            file = file_repository.get_or_raise(pk=file_id)
-
-            if not file_repository.check_user_is_owner(file, user):
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=True)
+            if not file_repository.check_user_is_owner(file, request.user):
                 return Response(
                     {"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
                 )
-            file_permissions = file_repository.get_all_file_permissions(file)
-
-        except FileModel.DoesNotExist:
+        except (ObjectNotFoundException, ValidationError):
             return Response(
                 {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
-        except FilePermissionModel.DoesNotExist:
-            return Response(
-                {"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
-            )
-        except Exception as exc:
-            return Response(
-                {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
 
-        s3_resource = S3ResourceSingleton()
+        # The content is deleted later by purge_trash, off the request path.
+        file_repository.trash_files([file])
+        return Response({"message": "File moved to trash"}, status=status.HTTP_200_OK)
 
-        try:
-            file_repository.delete_file_from_s3(
-                s3_resource=s3_resource,
-                user=user,
-                file=file,
-                bucket_name=settings.AWS_STORAGE_BUCKET_NAME,
-            )
 
-            file_repository.delete_file_from_db(file, file_permissions)
+class BatchDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request):
+        serializer = BatchDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+
+        file_ids = {}
+        for file_id in serializer.validated_data["file_ids"]:
+            try:
+                file_ids[file_id] = uuid.UUID(file_id)
+            except ValueError:
+                file_ids[file_id] = None
+
+        # Ownership of every file is checked with one query.
+        file_repository = FileRepository()
+        files = file_repository.get_files_with_ownership(
+            [file_id for file_id in file_ids.values() if file_id is not None], user
+        )
+        results = {}
+        owned_ids = {}
+        for given_id, file_id in file_ids.items():
+            if file_id is None:
+                results[given_id] = {"message": "Invalid file id"}
+            elif file_id not in files:
+                results[given_id] = {"message": "File not found"}
+            elif not files[file_id].is_owner:
+                results[given_id] = {"message": "Permission denied"}
+            else:
+                owned_ids[given_id] = file_id
+
+        file_repository.trash_files([files[file_id] for file_id in owned_ids.values()])
+        for given_id in owned_ids:
+            results[given_id] = {"message": "File moved to trash"}
+
+        return Response({"files": results}, status=status.HTTP_200_OK)
+
+
+class TrashListView(generics.ListAPIView):
+    serializer_class = TrashedFileSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return FileRepository().get_trash_for_user(self.request.user)
+
+
+class RestoreFileView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, file_id):
+        try:
+            file_repository = FileRepository()
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=False)
+            if not file_repository.check_user_is_owner(file, request.user):
+                return Response(
+                    {"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
+                )
+        except (ObjectNotFoundException, ValidationError):
             return Response(
-                {"message": "File deleted successfully"}, status=status.HTTP_200_OK
-            )
-        except ClientError as e:
-            return Response(
-                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as exc:
+
+        if not file_repository.restore_files([file]):
+            # Restored or purged by another request in the meantime.
             return Response(
-                {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
+        return Response(
+            {"message": "File restored successfully"}, status=status.HTTP_200_OK
+        )
 
 
 class DownloadFileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, file_id):
+        # Cached URLs are dropped as soon as access to the file is revoked.
+        # The key is taken before access is checked, so a revoke committing
+        # in between leaves the URL presigned here under a stale key.
+        download_url_cache = DownloadUrlCache()
+        cache_key = None
+        if settings.FILE_DOWNLOAD_MODE == "presigned":
+            try:
+                cache_key = download_url_cache.get_key(file_id, request.user.id)
+            except ValueError:
+                # Not a file id; answered as missing below.
+                pass
+            else:
+                url = download_url_cache.get(cache_key)
+                if url is not None:
+                    return Response({"url": url}, status=status.HTTP_200_OK)
+
         try:
             file_repository = FileRepository()
             user = request.user
-            file = file_repository.get_or_raise(pk=file_id)
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=True)
             if not file_repository.check_permission(file, user):
                 return Response(
                     {"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
                 )
 
-            owner = file_repository.get_file_owner(file)
-
-            s3_client = S3ClientSingleton()
-        except FileModel.DoesNotExist:
+            object_name = file_repository.get_object_key(file)
+        except (FileModel.DoesNotExist, ObjectNotFoundException):
             return Response(
                 {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
@@ -206,15 +868,18 @@ class DownloadFileView(APIView):
                 {"message": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        if settings.FILE_DOWNLOAD_MODE in APP_DOWNLOAD_MODES:
+            url = request.build_absolute_uri(reverse("file-content", args=[file.id]))
+            return Response({"url": url}, status=status.HTTP_200_OK)
+
         try:
             bucket = settings.AWS_STORAGE_BUCKET_NAME
-            object_name = f"user_{owner.id}/{file.id}_{file.original_filename}"
 
-            response = s3_client.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": bucket, "Key": object_name},
-                ExpiresIn=60 * 5,  # 5 minutes to expire
+            response = S3PresignerSingleton().presign(
+                "GET", bucket, object_name, settings.S3_DOWNLOAD_URL_EXPIRES
             )
+            if cache_key is not None:
+                download_url_cache.set(cache_key, response)
 
             return Response({"url": response}, status=status.HTTP_200_OK)
 
@@ -228,6 +893,157 @@ class DownloadFileView(APIView):
             )
 
 
+class FileContentView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, file_id):
+        if settings.FILE_DOWNLOAD_MODE not in APP_DOWNLOAD_MODES:
+            return Response(
+                {"message": "Files are not served by the app"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        try:
+            file_repository = FileRepository()
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=True)
+            if not file_repository.check_permission(file, request.user):
+                return Response(
+                    {"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
+                )
+            object_name = file_repository.get_object_key(file)
+        except (ObjectNotFoundException, ValidationError):
+            return Response(
+                {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        if settings.FILE_DOWNLOAD_MODE == "accel":
+            return offload_object(object_name, file.original_filename)
+
+        # The content of a file never changes, so its blob hash identifies
+        # it. Files stored before content addressing, and blobs written by
+        # presigned and resumable uploads, have none; their id does instead.
+        if file.blob_id is not None and file.blob.sha256 is not None:
+            etag = f'"{file.blob.sha256}"'
+        else:
+            etag = f'"{file.id}"'
+        try:
+            return stream_object(
+                request._request, object_name, file.size, etag, file.original_filename
+            )
+        except StorageError as e:
+            return Response(
+                {"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class BatchDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchDownloadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+
+        file_ids = {}
+        for file_id in serializer.validated_data["file_ids"]:
+            try:
+                file_ids[file_id] = uuid.UUID(file_id)
+            except ValueError:
+                file_ids[file_id] = None
+
+        # URLs still cached need no lookup; the rest are resolved together.
+        download_url_cache = DownloadUrlCache()
+        valid_ids = [file_id for file_id in file_ids.values() if file_id is not None]
+        served_by_app = settings.FILE_DOWNLOAD_MODE in APP_DOWNLOAD_MODES
+        cache_keys = (
+            {} if served_by_app else download_url_cache.get_keys(valid_ids, user.id)
+        )
+        cached_urls = download_url_cache.get_many(cache_keys)
+        object_keys = FileRepository().get_object_keys_for_user(
+            [file_id for file_id in valid_ids if file_id not in cached_urls], user
+        )
+
+        presigner = S3PresignerSingleton()
+        results = {}
+        new_urls = {}
+        for given_id, file_id in file_ids.items():
+            if file_id is None:
+                results[given_id] = {"message": "Invalid file id"}
+                continue
+            if file_id in cached_urls:
+                results[given_id] = {"url": cached_urls[file_id]}
+                continue
+            if file_id not in object_keys:
+                # Files the user cannot access are reported as missing.
+                results[given_id] = {"message": "File not found"}
+                continue
+            if served_by_app:
+                url = reverse("file-content", args=[file_id])
+                results[given_id] = {"url": request.build_absolute_uri(url)}
+                continue
+            new_urls[file_id] = presigner.presign(
+                "GET",
+                settings.AWS_STORAGE_BUCKET_NAME,
+                object_keys[file_id],
+                settings.S3_DOWNLOAD_URL_EXPIRES,
+            )
+            results[given_id] = {"url": new_urls[file_id]}
+        download_url_cache.set_many(new_urls, cache_keys)
+
+        return Response({"files": results}, status=status.HTTP_200_OK)
+
+
+class ArchiveDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchDownloadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        file_ids = {}
+        invalid_ids = []
+        for given_id in serializer.validated_data["file_ids"]:
+            try:
+                file_ids[given_id] = uuid.UUID(given_id)
+            except ValueError:
+                invalid_ids.append(given_id)
+        if invalid_ids:
+            return Response(
+                {"message": "Invalid file id", "file_ids": invalid_ids},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Everything is checked before the first byte is sent, since the
+        # status of a streamed response cannot change afterwards.
+        files = {
+            file.id: file
+            for file in FileRepository().get_readable_files(
+                list(file_ids.values()), request.user
+            )
+        }
+        missing_ids = [
+            given_id for given_id, file_id in file_ids.items() if file_id not in files
+        ]
+        if missing_ids:
+            return Response(
+                {"message": "File not found", "file_ids": missing_ids},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        files = [files[file_id] for file_id in file_ids.values()]
+        if settings.FILE_DOWNLOAD_MODE == "accel" and settings.FILE_ACCEL_ZIP:
+            return offload_archive(files)
+
+        # Without FILE_ACCEL_ZIP the archive is built by the app, reading
+        # every file itself, in "accel" mode too.
+        content = stream_archive(files, settings.FILE_PROXY_CHUNK_SIZE)
+        if isinstance(request._request, ASGIRequest):
+            content = iterate_in_thread(content, thread_sensitive=False)
+        response = StreamingHttpResponse(content, content_type="application/zip")
+        response["Content-Disposition"] = 'attachment; filename="files.zip"'
+        return response
+
+
 class UserSharedListView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -236,13 +1052,15 @@ class UserSharedListView(APIView):
             file_repository = FileRepository()
             user_repository = UserRepository()
             user = request.user
-            file = file_repository.get_or_raise(pk=file_id)
-            users = user_repository.get_all_active_users_except_current(user)
-            serializer = ShareFileProfileSerializer(
-                users, many=True, context={"file": file}
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=True)
+            users = file_repository.annotate_is_shared(
+                user_repository.get_all_active_users_except_current(user), file
+            )
+            rows = users.values_list(*SHARE_PROFILE_ROW_FIELDS, named=True)
+            return Response(
+                serialize_share_profile_rows(rows), status=status.HTTP_200_OK
             )
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except FileModel.DoesNotExist:
+        except (FileModel.DoesNotExist, ObjectNotFoundException):
             return Response(
                 {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
@@ -264,7 +1082,7 @@ class ShareFileView(APIView):
         received_data = request.data
         try:
             file_repository = FileRepository()
-            file = file_repository.get_or_raise(pk=file_id)
+            file = file_repository.get_or_raise(pk=file_id, deleted_at__isnull=True)
             serializer = ShareFileSerializer(
                 data=received_data, many=True, context={"file": file, "owner": user}
             )
@@ -274,7 +1092,7 @@ class ShareFileView(APIView):
             return Response(
                 {"message": "Sharing List Updated."}, status=status.HTTP_200_OK
             )
-        except FileModel.DoesNotExist:
+        except (FileModel.DoesNotExist, ObjectNotFoundException):
             return Response(
                 {"message": "File not found"}, status=status.HTTP_404_NOT_FOUND
             )
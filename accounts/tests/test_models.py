@@ -1,8 +1,10 @@
 from django.db import IntegrityError
 from django.forms import ValidationError
-from django.test import TestCase
+from unittest.mock import patch
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from accounts.models import UserModel
+from rest_framework.test import APIClient
 from django.contrib.auth import authenticate
 
 
@@ -230,3 +232,43 @@ class UserAuthenticationTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "access")
         self.assertContains(response, "refresh")
+
+
+class ProfileViewTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create_user(
+            username="testuser",
+            email="testuser@example.com",
+            password="password123",
+            is_active=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_profile_is_not_modified(self):
+        response = self.client.get(reverse("profile"))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            reverse("profile"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_the_profile(self):
+        etag = self.client.get(reverse("profile"))["ETag"]
+        self.user.username = "renamed"
+        self.user.save()
+        response = self.client.get(reverse("profile"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    @override_settings(AWS_QUERYSTRING_EXPIRE=3600)
+    def test_not_modified_never_outlives_the_photo_url(self):
+        with patch("accounts.views.time.time", return_value=7200):
+            etag = self.client.get(reverse("profile"))["ETag"]
+        for now, status_code in [(7200 + 1799, 304), (7200 + 1800, 200)]:
+            with patch("accounts.views.time.time", return_value=now):
+                response = self.client.get(
+                    reverse("profile"), HTTP_IF_NONE_MATCH=etag
+                )
+            # The photo URL in the first body expires at 7200 + 3600.
+            self.assertEqual(response.status_code, status_code)
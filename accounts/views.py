@@ -1,3 +1,5 @@
+import hashlib
+import time
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -8,7 +10,11 @@ from accounts.serializers import (
     SendVerificationEmailSerializer,
 )
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.conf import settings
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from .repository import UserRepository, VerificationRepository
 
 
@@ -59,9 +65,23 @@ class VerifyLinkView(APIView):
                     return Response(status=status.HTTP_200_OK)
 
 
+def profile_etag(request, *args, **kwargs):
+    # Derived from the fields ProfileSerializer returns, which are already
+    # loaded with the authenticated user. The photo URL is presigned, so the
+    # tag also changes every half of AWS_QUERYSTRING_EXPIRE: a 304 only
+    # confirms a URL that has at least that long left before it expires.
+    user = request.user
+    window = int(time.time()) // (settings.AWS_QUERYSTRING_EXPIRE // 2)
+    return hashlib.sha256(
+        f"{user.id}:{user.username}:{user.photo.name}:{window}".encode()
+    ).hexdigest()
+
+
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=profile_etag))
     def get(self, request):
         user = request.user
         serializer = ProfileSerializer(instance=user)
@@ -138,11 +138,119 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # User added settings
 AUTH_USER_MODEL = "accounts.UserModel"
 
+# Where file content is stored: "s3" keeps objects in AWS_STORAGE_BUCKET_NAME;
+# "local" keeps them under FILE_LOCAL_STORAGE_ROOT, for deployments without an
+# object store. Local storage works with the "proxy" and "accel" download
+# modes, not with presigned downloads or presigned direct uploads.
+FILE_STORAGE_BACKEND = config("FILE_STORAGE_BACKEND", default="s3")
+
 DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+if FILE_STORAGE_BACKEND == "local":
+    DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 AWS_ACCESS_KEY_ID = config("ACCESS_KEY")
 AWS_SECRET_ACCESS_KEY = config("SECRET_KEY")
 AWS_STORAGE_BUCKET_NAME = config("BUCKET_NAME")
 AWS_S3_ENDPOINT_URL = config("ENDPOINT_URL")
+AWS_S3_REGION_NAME = config("REGION_NAME", default="us-east-1")
+# Presigned URLs are signed with SigV4, which S3PresignerSingleton produces
+# without botocore; the client is configured the same way.
+AWS_S3_SIGNATURE_VERSION = "s3v4"
+# Lifetime of the presigned URLs S3Boto3Storage gives for media such as
+# profile photos.
+AWS_QUERYSTRING_EXPIRE = 60 * 60
+
+# Transfer engine for uploads that pass through the app: files above the
+# threshold are sent as multipart uploads in parts of S3_UPLOAD_PART_SIZE
+# (S3 requires >= 5MB), with up to S3_UPLOAD_MAX_CONCURRENCY parts in flight.
+# The concurrency also bounds the part buffers held per upload.
+S3_UPLOAD_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+S3_UPLOAD_MAX_CONCURRENCY = 4
+# Streamed uploads still pending after this many seconds are assumed to have
+# lost their request and are finished or rolled back by reconcile_uploads.
+PENDING_UPLOAD_EXPIRES = 60 * 60
+# Most files accepted by one batch upload request (S3 deletes at most 1000
+# objects per request, which is how a failed batch is cleaned up).
+MAX_BATCH_UPLOAD_FILES = 500
+# Storage each user may fill with the files they own, in bytes, from the
+# USER_STORAGE_QUOTA environment variable; unset for no limit. Uploads
+# crossing it are stopped while the body is being received.
+USER_STORAGE_QUOTA = config(
+    "USER_STORAGE_QUOTA", default=None, cast=lambda value: int(value) if value else None
+)
+# Extensions (without the dot, case-insensitive) that cannot be uploaded.
+BLOCKED_UPLOAD_EXTENSIONS = []
+# Presigned direct-to-bucket uploads: URL lifetime in seconds, and the size
+# above which the client is given one presigned URL per multipart part.
+S3_PRESIGNED_UPLOAD_EXPIRES = 60 * 60
+S3_PRESIGNED_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+# Lifetime in seconds of presigned download URLs. Issued URLs are reused
+# until they have S3_DOWNLOAD_URL_MIN_REMAINING seconds left.
+S3_DOWNLOAD_URL_EXPIRES = 5 * 60
+S3_DOWNLOAD_URL_MIN_REMAINING = 60
+# How /files/download/<file_id>/ serves files: "presigned" hands out a
+# presigned URL to the bucket; "proxy" and "accel" a URL of
+# /files/download/<file_id>/content/. "proxy" streams the object through the
+# app for deployments where clients cannot reach the object store. "accel"
+# only checks permissions there and has the web server send the file from
+# FILE_LOCAL_STORAGE_ROOT, so no file bytes pass through the app.
+FILE_DOWNLOAD_MODE = "presigned"
+# Bytes read from the object storage and sent to the client at a time by the
+# proxy.
+FILE_PROXY_CHUNK_SIZE = 256 * 1024
+# Directory holding each object at the path of its key: the store of the
+# "local" FILE_STORAGE_BACKEND, and where "accel" mode has the web server send
+# files from (with "s3" storage, a mounted bucket).
+FILE_LOCAL_STORAGE_ROOT = config(
+    "LOCAL_STORAGE_ROOT", default=os.path.join(BASE_DIR, "objects")
+)
+# Header handing a file to the web server in "accel" mode. nginx's
+# "X-Accel-Redirect" gets FILE_ACCEL_REDIRECT_PREFIX followed by the object
+# key, which must be an internal location aliasing FILE_LOCAL_STORAGE_ROOT:
+#     location /protected-files/ { internal; alias /srv/objects/; }
+# "X-Sendfile" (Apache mod_xsendfile, lighttpd) gets the file's path instead.
+FILE_ACCEL_HEADER = "X-Accel-Redirect"
+FILE_ACCEL_REDIRECT_PREFIX = "/protected-files/"
+# Have nginx's mod_zip build ZIP archives in "accel" mode, from a file list
+# pointing at FILE_ACCEL_REDIRECT_PREFIX. Otherwise archives are always built
+# by the app, which reads every file in them itself, in "accel" mode too.
+FILE_ACCEL_ZIP = False
+# Disk cache of object content for files sent through the app, in "proxy"
+# mode and in archives; None disables it. Objects larger than
+# OBJECT_CACHE_MAX_OBJECT_SIZE, and all objects with "local" storage, are
+# streamed without being cached, and the least recently used entries are
+# deleted once the cache holds more than OBJECT_CACHE_MAX_SIZE bytes.
+OBJECT_CACHE_DIR = config("OBJECT_CACHE_DIR", default=None)
+OBJECT_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+OBJECT_CACHE_MAX_OBJECT_SIZE = 512 * 1024 * 1024
+# Most files whose download URLs one batch download request can ask for.
+MAX_BATCH_DOWNLOAD_FILES = 100
+# Most files one batch delete request can move to the trash.
+MAX_BATCH_DELETE_FILES = 1000
+# Seconds deleted files stay in the trash, where their owner can restore
+# them, before the purge_trash command deletes them and their content.
+FILE_TRASH_RETENTION = 30 * 24 * 60 * 60
+# Files purge_trash deletes per transaction. With S3 their objects are
+# removed with multi-object deletes, which take up to 1000 keys each.
+FILE_PURGE_BATCH_SIZE = 1000
+# Resumable uploads expire this many seconds after their last received part;
+# the reconcile_uploads command then aborts them.
+RESUMABLE_UPLOAD_EXPIRES = 24 * 60 * 60
+
+# Seconds a cached /files/fetch/ response and the listing version behind its
+# ETag are kept. Entries are invalidated as soon as the user's files change.
+# That reaches every worker only through a shared cache: with more than one
+# worker process, set CACHES to a shared backend such as Redis or Memcached,
+# since the default LocMemCache is per process and the other workers would
+# serve the old listing, and 304s for it, until this timeout runs out.
+#     CACHES = {"default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": "redis://127.0.0.1:6379",
+#     }}
+FILE_LISTING_CACHE_TIMEOUT = 10 * 60
+# Rows /files/fetch/export/ reads per query. Each batch starts after the last
+# row of the one before, so memory stays flat however many files there are.
+FILE_EXPORT_BATCH_SIZE = 2000
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"